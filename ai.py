@@ -1,44 +1,256 @@
+import os
+import random
+import threading
+import time
+
+import openai
 from openai import OpenAI
 
+
+class AIError(Exception):
+    """The upstream model could not produce an analysis."""
+
+
+class CircuitOpenError(AIError):
+    """Raised without calling upstream while the circuit breaker is open."""
+
+
+class CircuitBreaker:
+    """Stops calling an upstream that keeps failing.
+
+    After `failure_threshold` consecutive failed calls the circuit opens and
+    calls fail fast for `reset_after` seconds. Then a single trial call is
+    let through: success closes the circuit, failure opens it again.
+    """
+
+    def __init__(self, failure_threshold=5, reset_after=30):
+        self.failure_threshold = failure_threshold
+        self.reset_after = reset_after
+        self.failures = 0
+        self.opened_at = None
+        self._trial_running = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        with self._lock:
+            return self._state()
+
+    def _state(self):
+        if self.opened_at is None:
+            return 'closed'
+        if time.monotonic() - self.opened_at >= self.reset_after:
+            return 'half-open'
+        return 'open'
+
+    def allow(self):
+        with self._lock:
+            state = self._state()
+            if state == 'closed':
+                return True
+            if state == 'half-open' and not self._trial_running:
+                self._trial_running = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._trial_running = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self._trial_running or self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+            self._trial_running = False
+
+
+# Point these at fake_openai.py (or any OpenAI-compatible server) for local runs
+AI_MODEL = os.environ.get('OPENROUTER_MODEL', "deepseek/deepseek-chat-v3-0324:free")
+AI_MAX_CONNECTIONS = int(os.environ.get('AI_MAX_CONNECTIONS', 10))
+AI_CONNECT_TIMEOUT = float(os.environ.get('AI_CONNECT_TIMEOUT', 5))
+AI_READ_TIMEOUT = float(os.environ.get('AI_READ_TIMEOUT', 60))  # max wait for the next bytes, not the whole answer
+AI_MAX_RETRIES = int(os.environ.get('AI_MAX_RETRIES', 2))
+AI_BACKOFF_BASE = float(os.environ.get('AI_BACKOFF_BASE', 0.5))
+AI_BACKOFF_MAX = float(os.environ.get('AI_BACKOFF_MAX', 8))
+
+# openai re-exports Timeout but not Limits; take the class from its default limits
+HttpLimits = type(openai.DEFAULT_CONNECTION_LIMITS)
+AI_TIMEOUT = openai.Timeout(AI_READ_TIMEOUT, connect=AI_CONNECT_TIMEOUT)
+
 client = OpenAI(
-    base_url="https://openrouter.ai/api/v1",
-    api_key="sk-or-v1-xxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxx",  # Replace with your actual key
+    base_url=os.environ.get('OPENROUTER_BASE_URL', "https://openrouter.ai/api/v1"),
+    api_key=os.environ.get('OPENROUTER_API_KEY', "sk-or-v1-xxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxx"),  # Replace with your actual key
+    timeout=AI_TIMEOUT,
+    max_retries=0,  # retried below, with jitter and the circuit breaker
+    http_client=openai.DefaultHttpxClient(
+        timeout=AI_TIMEOUT,
+        limits=HttpLimits(max_connections=AI_MAX_CONNECTIONS,
+                          max_keepalive_connections=AI_MAX_CONNECTIONS, keepalive_expiry=30),
+    ),
 )
+breaker = CircuitBreaker(failure_threshold=int(os.environ.get('AI_BREAKER_THRESHOLD', 5)),
+                         reset_after=float(os.environ.get('AI_BREAKER_RESET', 30)))
 
-def analyze_txt_content(text):
-    try:
-        completion = client.chat.completions.create(
-    model="deepseek/deepseek-chat-v3-0324:free",
-    messages=[
-        {
-            "role": "system",
-            "content": "You are a financial assistant. Give a short budget summary and 2 suggestions only."
-        },
-        {
-            "role": "user",
-            "content": f"{text}"
+
+SYSTEM_PROMPT = "You are a financial assistant. Give a short budget summary and 2 suggestions only."
+MAX_OUTPUT_TOKENS = 600
+# Bump whenever SYSTEM_PROMPT or the prompt built from the summary changes,
+# so cached responses from the old prompt stop being shared
+PROMPT_VERSION = 2
+
+
+def completion_kwargs(text):
+    return dict(
+        model=AI_MODEL,
+        messages=[
+            {
+                "role": "system",
+                "content": SYSTEM_PROMPT
+            },
+            {
+                "role": "user",
+                "content": f"{text}"
+            }
+        ],
+        max_tokens=MAX_OUTPUT_TOKENS,  # Limits output tokens
+        extra_headers={
+            "HTTP-Referer": "http://localhost:5000",
+            "X-Title": "FinTracker AI",
         }
-    ],
-    max_tokens=600,  # Limits output tokens
-    extra_headers={
-        "HTTP-Referer": "http://localhost:5000",
-        "X-Title": "FinTracker AI",
-    }
-)
+    )
+
+def estimate_tokens(text):
+    """Upper-bound token cost of one analysis: the prompt (~4 chars a token) plus max output."""
+    return (len(SYSTEM_PROMPT) + len(text)) // 4 + 1 + MAX_OUTPUT_TOKENS
+
+def is_retryable(error):
+    if isinstance(error, openai.APIConnectionError):  # includes timeouts
+        return True
+    return isinstance(error, openai.APIStatusError) and (error.status_code == 429 or error.status_code >= 500)
 
+def backoff_delay(attempt, error=None):
+    """Full-jitter exponential backoff, honouring a short Retry-After."""
+    response = getattr(error, 'response', None)
+    retry_after = response.headers.get('retry-after') if response is not None else None
+    try:
+        if retry_after is not None and float(retry_after) <= AI_BACKOFF_MAX:
+            return float(retry_after)
+    except ValueError:
+        pass
+    return random.uniform(0, min(AI_BACKOFF_MAX, AI_BACKOFF_BASE * 2 ** attempt))
+
+def call_upstream(request):
+    """Run request() with bounded retries, behind the circuit breaker.
 
-        # Ensure response has .choices and content
-        if completion and completion.choices and completion.choices[0].message:
-            return completion.choices[0].message.content
+    Returns its result or raises AIError. Non-retryable errors (bad key,
+    bad request) are raised straight away and don't trip the breaker.
+    """
+    if not breaker.allow():
+        raise CircuitOpenError("AI service is temporarily unavailable.")
+    for attempt in range(AI_MAX_RETRIES + 1):
+        try:
+            result = request()
+        except openai.OpenAIError as e:
+            if not is_retryable(e):
+                breaker.record_success()  # upstream answered; this is our problem
+                raise AIError(str(e)) from e
+            if attempt == AI_MAX_RETRIES:
+                breaker.record_failure()
+                raise AIError(str(e)) from e
+            time.sleep(backoff_delay(attempt, e))
         else:
-            return "❌ AI Error: No valid response received from model."
+            breaker.record_success()
+            return result
+
+def analyze_txt_content(text):
+    completion = call_upstream(lambda: client.chat.completions.create(**completion_kwargs(text)))
+
+    # Ensure response has .choices and content
+    if completion and completion.choices and completion.choices[0].message and \
+            (completion.choices[0].message.content or '').strip():
+        return completion.choices[0].message.content
+    raise AIError("No valid response received from model.")
+
 
-    except Exception as e:
-        return f"❌ AI Error: {str(e)}"
+def stream_txt_content(text):
+    """Yield the analysis in pieces as the model produces them.
+
+    Opening the stream is retried like analyze_txt_content; once tokens have
+    been yielded a failure is raised as AIError, since the caller has
+    already used part of the answer. A stream that ends without any text
+    is an AIError too, so an empty analysis never gets cached.
+    """
+    stream = call_upstream(lambda: client.chat.completions.create(stream=True, **completion_kwargs(text)))
+    produced = False
+    try:
+        for chunk in stream:
+            if chunk.choices and chunk.choices[0].delta and chunk.choices[0].delta.content:
+                produced = produced or bool(chunk.choices[0].delta.content.strip())
+                yield chunk.choices[0].delta.content
+    except Exception as e:  # includes transport errors the SDK doesn't wrap mid-stream
+        breaker.record_failure()
+        raise AIError(str(e)) from e
+    finally:
+        stream.close()
+    if not produced:
+        raise AIError("No valid response received from model.")
 
 
 import hashlib
 import json
+import re
+
+import markdown
+from markdown.treeprocessors import Treeprocessor
+
+SAFE_URL_SCHEMES = ('http:', 'https:', 'mailto:', '#', '/')
+
+
+class _StripUnsafeLinks(Treeprocessor):
+    def run(self, root):
+        for el in root.iter():
+            for attr in ('href', 'src'):
+                url = el.get(attr)
+                if url is not None and ':' in url.split('/', 1)[0] and not url.lower().startswith(SAFE_URL_SCHEMES):
+                    del el.attrib[attr]
+
+
+def render_markdown(text):
+    """Render model output to HTML once, with raw HTML and script URLs stripped."""
+    md = markdown.Markdown(extensions=['fenced_code', 'tables'])
+    md.preprocessors.deregister('html_block')
+    md.inlinePatterns.deregister('html')
+    md.treeprocessors.register(_StripUnsafeLinks(md), 'strip_unsafe_links', 0)
+    return md.convert(text)
+
+
+def local_analyze_txt_content(text):
+    """Offline stand-in for analyze_txt_content: same contract, no network.
+
+    Selected with AI_BACKEND=local so the AI path can be developed, tested
+    and load-tested without an OpenRouter key.
+    """
+    lines = [line.strip() for line in text.splitlines() if line.strip()]
+    summary = "\n".join(f"- {line}" for line in lines) or "- No data provided."
+    return (
+        "### Budget Summary\n"
+        f"{summary}\n\n"
+        "### Suggestions\n"
+        "1. Track your largest category weekly and set a cap for it.\n"
+        "2. Move a fixed share of income to savings at the start of each month.\n"
+    )
+
+def local_stream_txt_content(text):
+    # Word by word, so the streaming UI can be exercised offline too
+    yield from re.findall(r'\S+\s*', local_analyze_txt_content(text))
+
+def response_digest(data_hash, model=None):
+    """Cache key of a response: same inputs, model and prompt give the same answer."""
+    raw = f"{data_hash}:{model or AI_MODEL}:{PROMPT_VERSION}"
+    return hashlib.sha256(raw.encode()).hexdigest()
 
 def generate_data_hash(profile_data, expense_data):
     combined = {
@@ -0,0 +1,152 @@
+import logging
+import queue
+import threading
+
+log = logging.getLogger('fintracker.ai_jobs')
+
+QUEUED = 'queued'
+DUPLICATE = 'duplicate'
+REJECTED = 'rejected'
+
+
+class AIJobScheduler:
+    """Process-wide pool for background AI calls.
+
+    A fixed number of worker threads drain a bounded queue. Jobs are keyed
+    (e.g. by (user_id, data hash)); submitting a key that is already queued
+    or running is a no-op, and when the queue is full new work is shed
+    instead of piling up more upstream calls.
+    """
+
+    def __init__(self, workers=2, max_queue=32):
+        self.workers = workers
+        self.max_queue = max_queue
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._pending = set()
+        self._lock = threading.Lock()
+        self._threads = []
+        self._running = 0
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+        self.deduplicated = 0
+
+    def submit(self, key, fn, *args):
+        """Queue fn(*args) unless `key` is already pending. Returns QUEUED, DUPLICATE or REJECTED."""
+        with self._lock:
+            if key in self._pending:
+                self.deduplicated += 1
+                return DUPLICATE
+            try:
+                self._queue.put_nowait((key, fn, args))
+            except queue.Full:
+                self.rejected += 1
+                return REJECTED
+            self._pending.add(key)
+            self._start_workers()
+        return QUEUED
+
+    def is_pending(self, key):
+        with self._lock:
+            return key in self._pending
+
+    def _start_workers(self):
+        # Started lazily so importing the app doesn't spawn threads
+        while len(self._threads) < self.workers:
+            thread = threading.Thread(target=self._work, name=f"ai-worker-{len(self._threads)}", daemon=True)
+            self._threads.append(thread)
+            thread.start()
+
+    def _work(self):
+        while True:
+            key, fn, args = self._queue.get()
+            with self._lock:
+                self._running += 1
+            try:
+                fn(*args)
+                with self._lock:
+                    self.completed += 1
+            except Exception as e:
+                with self._lock:
+                    self.failed += 1
+                log.warning("AI job failed", extra={'job': key, 'error': str(e)})
+            finally:
+                with self._lock:
+                    self._running -= 1
+                    self._pending.discard(key)
+                self._queue.task_done()
+
+    def join(self):
+        """Block until every queued job has finished (used by tests and CLI commands)."""
+        self._queue.join()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'workers': self.workers,
+                'queue_depth': self._queue.qsize(),
+                'queue_capacity': self.max_queue,
+                'in_flight': self._running,
+                'pending': len(self._pending),
+                'completed': self.completed,
+                'failed': self.failed,
+                'rejected': self.rejected,
+                'deduplicated': self.deduplicated,
+            }
+
+
+class TokenStream:
+    """Output of one running job, readable by any number of listeners."""
+
+    def __init__(self):
+        self.chunks = []
+        self.done = False
+        self.error = None
+        self._cond = threading.Condition()
+
+    def append(self, chunk):
+        with self._cond:
+            self.chunks.append(chunk)
+            self._cond.notify_all()
+
+    def finish(self, error=None):
+        with self._cond:
+            self.done = True
+            self.error = error
+            self._cond.notify_all()
+
+    def read(self, start, timeout):
+        """Chunks from index `start` on, waiting up to `timeout` for new ones.
+
+        Returns (chunks, done); an empty list with done False means the
+        wait timed out.
+        """
+        with self._cond:
+            self._cond.wait_for(lambda: self.done or len(self.chunks) > start, timeout)
+            return self.chunks[start:], self.done
+
+
+class TokenStreams:
+    """Registry of the TokenStreams of jobs that are currently running."""
+
+    def __init__(self):
+        self._streams = {}
+        self._cond = threading.Condition()
+
+    def open(self, key):
+        stream = TokenStream()
+        with self._cond:
+            self._streams[key] = stream
+            self._cond.notify_all()
+        return stream
+
+    def close(self, key):
+        # Listeners already holding the stream keep reading it to the end
+        with self._cond:
+            self._streams.pop(key, None)
+
+    def get(self, key, timeout=0):
+        """The running stream for `key`, waiting up to `timeout` for its job to start."""
+        with self._cond:
+            self._cond.wait_for(lambda: key in self._streams, timeout)
+            return self._streams.get(key)
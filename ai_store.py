@@ -0,0 +1,329 @@
+import glob
+import json
+import os
+import re
+import threading
+from collections import OrderedDict, namedtuple
+from datetime import datetime, timedelta
+
+from sqlalchemy import Column, DateTime, Integer, MetaData, String, Table, Text, delete, select, update
+
+from migrations import dialect_insert
+
+# A user's current analysis. data_hash is the user's input hash, digest the
+# key of the (possibly shared) response; html is the rendered Markdown,
+# produced once by whoever generated the response.
+AIResult = namedtuple('AIResult', 'data_hash response created_at html digest', defaults=(None, None))
+
+# One generated response, addressed by ai.response_digest()
+AIResponse = namedtuple('AIResponse', 'response html created_at')
+
+
+class AIResultStore:
+    """Content-addressed AI responses plus each user's pointer to one.
+
+    Responses are keyed by a digest of everything that determines them (the
+    input data hash, model and prompt version), so users whose inputs match
+    share one completion. Backends implement the _load*/_save* methods.
+
+    `ttl` (seconds) is the lifetime of a response -- an expired result is
+    still returned by get() so the page has something to show, but
+    is_stale() reports it and link() won't hand it out. `front_ttl` bounds
+    how long the in-process LRU may serve an entry without re-reading the
+    backend, so writes from other processes show up.
+
+    With `prune_every` set, every that many put() calls also prune() the
+    store down to `max_responses`, so it stays bounded without a cron job.
+    """
+
+    def __init__(self, max_entries=1024, ttl=None, front_ttl=30, max_responses=None, prune_every=None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.front_ttl = front_ttl
+        self.max_responses = max_responses
+        self.prune_every = prune_every
+        self._front = OrderedDict()
+        self._lock = threading.Lock()
+        self._writes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, user_id):
+        """The user's latest result, fresh or not, or None."""
+        result = self._front_get(('user', user_id))
+        if result is None:
+            result = self._load(user_id)
+            if result is not None:
+                self._remember(('user', user_id), result)
+        return result
+
+    def put(self, user_id, data_hash, response, html=None, created_at=None, digest=None):
+        """Store a newly generated response and point the user at it."""
+        digest = digest or data_hash
+        now = datetime.now()
+        stored = AIResponse(response, html, created_at or now)
+        self._save_response(digest, stored, now)
+        self._remember(('digest', digest), stored)
+        result = self._point(user_id, data_hash, digest, stored)
+        if self._prune_due():
+            self.prune()
+        return result
+
+    def link(self, user_id, data_hash, digest):
+        """Point the user at an existing unexpired response for `digest`.
+
+        Returns the user's new result, or None on a miss (the caller then
+        generates the response).
+        """
+        stored = self._front_get(('digest', digest))
+        if stored is None:
+            stored = self._load_response(digest)
+        if stored is None or self._expired(stored.created_at):
+            return None
+        self._touch(digest, datetime.now())
+        self._remember(('digest', digest), stored)
+        return self._point(user_id, data_hash, digest, stored)
+
+    def is_stale(self, result, data_hash):
+        if result is None or result.data_hash != data_hash:
+            return True
+        return self._expired(result.created_at)
+
+    def prune(self, max_responses=None):
+        """Drop expired responses and, past `max_responses`, the least recently used.
+
+        `max_responses` defaults to the store's own cap. Users pointing at a
+        dropped response simply get a new one next time. Returns the number
+        of responses removed.
+        """
+        with self._lock:
+            self._front.clear()
+        expired_before = datetime.now() - timedelta(seconds=self.ttl) if self.ttl is not None else None
+        return self._prune(expired_before, max_responses if max_responses is not None else self.max_responses)
+
+    def count_lookup(self, hit):
+        """Record one user-facing lookup for the hit/miss stats.
+
+        Left to the caller, since re-checks (a stream waiting for its job,
+        background refreshes) would otherwise count the same request twice.
+        """
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {'hits': self.hits, 'misses': self.misses,
+                    'hit_rate': round(self.hits / lookups, 3) if lookups else None,
+                    'front_entries': len(self._front)}
+
+    def _point(self, user_id, data_hash, digest, stored):
+        self._save_user(user_id, data_hash, digest)
+        result = AIResult(data_hash, stored.response, stored.created_at, stored.html, digest)
+        self._remember(('user', user_id), result)
+        return result
+
+    def _prune_due(self):
+        if not self.prune_every:
+            return False
+        with self._lock:
+            self._writes += 1
+            return self._writes % self.prune_every == 0
+
+    def _expired(self, created_at):
+        return self.ttl is not None and datetime.now() - created_at > timedelta(seconds=self.ttl)
+
+    def _front_get(self, key):
+        now = datetime.now()
+        with self._lock:
+            entry = self._front.get(key)
+            if entry is not None and (now - entry[1]).total_seconds() < self.front_ttl:
+                self._front.move_to_end(key)
+                return entry[0]
+        return None
+
+    def _remember(self, key, value):
+        with self._lock:
+            self._front[key] = (value, datetime.now())
+            self._front.move_to_end(key)
+            while len(self._front) > self.max_entries:
+                self._front.popitem(last=False)
+
+    def _load(self, user_id):
+        raise NotImplementedError
+
+    def _load_response(self, digest):
+        raise NotImplementedError
+
+    def _save_response(self, digest, stored, used_at):
+        raise NotImplementedError
+
+    def _save_user(self, user_id, data_hash, digest):
+        raise NotImplementedError
+
+    def _touch(self, digest, used_at):
+        raise NotImplementedError
+
+    def _prune(self, expired_before, max_responses):
+        raise NotImplementedError
+
+
+class MemoryAIResultStore(AIResultStore):
+    """Dict-backed store for tests and single-process development."""
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self._responses = {}   # digest -> (AIResponse, last used)
+        self._users = {}       # user_id -> (data_hash, digest)
+
+    def _load(self, user_id):
+        if user_id not in self._users:
+            return None
+        data_hash, digest = self._users[user_id]
+        stored = self._load_response(digest)
+        if stored is None:
+            return None
+        return AIResult(data_hash, stored.response, stored.created_at, stored.html, digest)
+
+    def _load_response(self, digest):
+        entry = self._responses.get(digest)
+        return entry[0] if entry else None
+
+    def _save_response(self, digest, stored, used_at):
+        self._responses[digest] = (stored, used_at)
+
+    def _save_user(self, user_id, data_hash, digest):
+        self._users[user_id] = (data_hash, digest)
+
+    def _touch(self, digest, used_at):
+        if digest in self._responses:
+            self._responses[digest] = (self._responses[digest][0], used_at)
+
+    def _prune(self, expired_before, max_responses):
+        doomed = {d for d, (stored, _) in self._responses.items()
+                  if expired_before is not None and stored.created_at < expired_before}
+        live = sorted((used, d) for d, (_, used) in self._responses.items() if d not in doomed)
+        if max_responses is not None and len(live) > max_responses:
+            doomed.update(d for _, d in live[:len(live) - max_responses])
+        for digest in doomed:
+            del self._responses[digest]
+        return len(doomed)
+
+
+metadata = MetaData()
+
+ai_responses = Table(
+    'ai_responses', metadata,
+    Column('digest', String(64), primary_key=True),
+    Column('response', Text, nullable=False),
+    Column('html', Text, nullable=True),
+    Column('created_at', DateTime, nullable=False),
+    Column('last_used_at', DateTime, nullable=False, index=True),
+)
+
+ai_user_results = Table(
+    'ai_user_results', metadata,
+    Column('user_id', Integer, primary_key=True),
+    Column('data_hash', String(64), nullable=False),
+    Column('digest', String(64), nullable=False, index=True),
+)
+
+
+class SQLAIResultStore(AIResultStore):
+    """Stores results in ai_responses / ai_user_results (see migrations.split_ai_results).
+
+    Uses the engine directly, so it is safe to call from worker threads that
+    have no Flask app context. Each write is a single atomic upsert.
+    """
+
+    def __init__(self, engine, **kwargs):
+        super().__init__(**kwargs)
+        self.engine = engine
+
+    def _load(self, user_id):
+        with self.engine.connect() as conn:
+            row = conn.execute(
+                select(ai_user_results.c.data_hash, ai_responses.c.response, ai_responses.c.created_at,
+                       ai_responses.c.html, ai_user_results.c.digest)
+                .join(ai_responses, ai_responses.c.digest == ai_user_results.c.digest)
+                .where(ai_user_results.c.user_id == user_id)
+            ).first()
+        return AIResult(*row) if row else None
+
+    def _load_response(self, digest):
+        with self.engine.connect() as conn:
+            row = conn.execute(
+                select(ai_responses.c.response, ai_responses.c.html, ai_responses.c.created_at)
+                .where(ai_responses.c.digest == digest)
+            ).first()
+        return AIResponse(*row) if row else None
+
+    def _upsert(self, conn, table, key, values):
+        insert = dialect_insert(self.engine.dialect.name)
+        stmt = insert(table).values(**values)
+        conn.execute(stmt.on_conflict_do_update(
+            index_elements=[table.c[key]],
+            set_={name: stmt.excluded[name] for name in values if name != key}
+        ))
+
+    def _save_response(self, digest, stored, used_at):
+        with self.engine.begin() as conn:
+            self._upsert(conn, ai_responses, 'digest',
+                         dict(digest=digest, last_used_at=used_at, **stored._asdict()))
+
+    def _save_user(self, user_id, data_hash, digest):
+        with self.engine.begin() as conn:
+            self._upsert(conn, ai_user_results, 'user_id',
+                         dict(user_id=user_id, data_hash=data_hash, digest=digest))
+
+    def _touch(self, digest, used_at):
+        with self.engine.begin() as conn:
+            conn.execute(update(ai_responses).where(ai_responses.c.digest == digest)
+                         .values(last_used_at=used_at))
+
+    def _prune(self, expired_before, max_responses):
+        removed = 0
+        with self.engine.begin() as conn:
+            if expired_before is not None:
+                removed += conn.execute(delete(ai_responses)
+                                        .where(ai_responses.c.created_at < expired_before)).rowcount
+            if max_responses is not None:
+                keep = select(ai_responses.c.digest).order_by(ai_responses.c.last_used_at.desc()) \
+                    .limit(max_responses)
+                removed += conn.execute(delete(ai_responses)
+                                        .where(ai_responses.c.digest.not_in(keep))).rowcount
+        return removed
+
+
+def import_json_cache_files(store, directory='.', render=None):
+    """One-shot import of the legacy ai_cache_{user_id}.json files.
+
+    The file mtime becomes created_at; a file never overwrites a newer
+    stored result. `render` turns a response into HTML for the store.
+    Returns the user ids imported.
+    """
+    imported = []
+    for path in sorted(glob.glob(os.path.join(directory, 'ai_cache_*.json'))):
+        match = re.fullmatch(r'ai_cache_(\d+)\.json', os.path.basename(path))
+        if not match:
+            continue
+        try:
+            with open(path) as f:
+                cache = json.load(f)
+        except (OSError, ValueError):
+            continue
+        if not cache.get('hash') or 'response' not in cache:
+            continue
+
+        user_id = int(match.group(1))
+        created_at = datetime.fromtimestamp(os.path.getmtime(path))
+        existing = store.get(user_id)
+        if existing is not None and existing.created_at >= created_at:
+            continue
+        html = render(cache['response']) if render else None
+        store.put(user_id, cache['hash'], cache['response'], html=html, created_at=created_at)
+        imported.append(user_id)
+    return imported
@@ -1,28 +1,104 @@
-from flask import Flask, render_template, redirect, url_for, request, session,flash,make_response
+from flask import Flask, render_template, redirect, url_for, request, session,flash,make_response,Response,stream_with_context,jsonify,g
+from flask import before_render_template, template_rendered
 from flask_sqlalchemy import SQLAlchemy
-from sqlalchemy import Date
-import bcrypt
-from datetime import datetime
-from graphs import generate_bar_chart,generate_worm_chart, generate_pie_chart, generate_gauge_charts,get_icon_status_data
-
-app = Flask(__name__)
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///database.db'
+from sqlalchemy import Date, func, extract, case, event, inspect as sa_inspect
+from sqlalchemy.orm import make_transient_to_detached
+from sqlalchemy.orm.attributes import set_committed_value
+from sqlalchemy.exc import IntegrityError
+from datetime import date, datetime
+import logging
+import os
+import time
+import csv
+import functools
+import hashlib
+import io
+import json
+import zlib
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import click
+from migrations import run_migrations, dialect_insert, schema_lock
+from config import database_config, sqlite_pragmas, apply_sqlite_pragmas
+from fragment_cache import FragmentCache
+from identity_cache import IdentityCache
+import seed_data
+import random
+from passwords import PasswordHasher, HasherBusy
+from logs import configure_logging
+from metrics import Metrics, RequestTiming, instrument_engine
+from graphs import generate_bar_chart,generate_worm_chart, generate_pie_chart, generate_gauge_charts,get_icon_status_data,previous_month
+from graphs import bar_chart_data, pie_chart_data, worm_chart_data, gauge_chart_data, generate_gauge
+
+class FinTracker(Flask):
+    def get_send_file_max_age(self, filename):
+        # Static JS is requested with ?v=<content hash> (static_version), so it can be cached for long
+        if filename and filename.endswith('.js'):
+            return self.config['STATIC_JS_MAX_AGE']
+        return super().get_send_file_max_age(filename)
+
+app = FinTracker(__name__)
+app.config.update(database_config())
 db = SQLAlchemy(app)
 app.secret_key = 'secret_key'
+app.config['LOG_LEVEL'] = os.environ.get('LOG_LEVEL', 'INFO')
+app.config['LOG_FORMAT'] = os.environ.get('LOG_FORMAT', 'text')  # 'text' (key=value) or 'json'
+configure_logging(app.config['LOG_LEVEL'], app.config['LOG_FORMAT'])
+log = logging.getLogger('fintracker.app')
+# Stage timings on every response; turn off to keep internals out of public headers
+app.config['SERVER_TIMING'] = os.environ.get('SERVER_TIMING', '1') == '1'
+app.config['METRICS_ENABLED'] = os.environ.get('METRICS_ENABLED', '1') == '1'
+metrics = Metrics()
+app.config['DASHBOARD_CACHE_MAX_BYTES'] = int(os.environ.get('DASHBOARD_CACHE_MAX_BYTES', 32 * 1024 * 1024))
+dashboard_cache = FragmentCache(app.config['DASHBOARD_CACHE_MAX_BYTES'])
+app.config['EXPENSE_PAGE_SIZE'] = int(os.environ.get('EXPENSE_PAGE_SIZE', 50))
+app.config['EXPENSE_MAX_PAGE_SIZE'] = int(os.environ.get('EXPENSE_MAX_PAGE_SIZE', 500))
+app.config['IMPORT_BATCH_SIZE'] = int(os.environ.get('IMPORT_BATCH_SIZE', 1000))
+app.config['API_BATCH_MAX'] = int(os.environ.get('API_BATCH_MAX', 500))
+app.config['DASHBOARD_RENDER_MODE'] = os.environ.get('DASHBOARD_RENDER_MODE', 'lazy')  # 'server', 'lazy' or 'client'
+app.config['STATIC_JS_MAX_AGE'] = int(os.environ.get('STATIC_JS_MAX_AGE', 7 * 24 * 3600))
+
+@functools.lru_cache(maxsize=64)
+def _file_digest(path, mtime):
+    with open(path, 'rb') as f:
+        return hashlib.sha1(f.read()).hexdigest()[:12]
+
+@app.template_global()
+def static_version(filename):
+    """Cache-buster for a static file: changes whenever the file's contents do."""
+    path = os.path.join(app.static_folder, filename)
+    return _file_digest(path, os.path.getmtime(path))
+# Seconds the logged-in user's rows may be reused without a query (0 = off)
+app.config['IDENTITY_CACHE_TTL'] = float(os.environ.get('IDENTITY_CACHE_TTL', 5))
+identity_cache = IdentityCache(app.config['IDENTITY_CACHE_TTL'])
+# bcrypt cost for new hashes; stored hashes with another cost are rehashed at login
+app.config['BCRYPT_ROUNDS'] = int(os.environ.get('BCRYPT_ROUNDS', 12))
+app.config['BCRYPT_MAX_WORKERS'] = int(os.environ.get('BCRYPT_MAX_WORKERS', max(1, (os.cpu_count() or 2) // 2)))
+app.config['BCRYPT_MAX_PENDING'] = int(os.environ.get('BCRYPT_MAX_PENDING', 64))
+password_hasher = PasswordHasher(app.config['BCRYPT_ROUNDS'], app.config['BCRYPT_MAX_WORKERS'],
+                                 app.config['BCRYPT_MAX_PENDING'])
 
 class User(db.Model):
     id = db.Column(db.Integer,primary_key=True)
     name = db.Column(db.String(100),nullable=False)
     email = db.Column(db.String(100),unique=True)
     password = db.Column(db.String(100),nullable=False)
+    # Bumped on every expense or profile write; keys the dashboard cache
+    data_version = db.Column(db.Integer, nullable=False, default=0, server_default='0')
 
     def __init__(self,name,email,password):
         self.name = name
         self.email = email
-        self.password = bcrypt.hashpw(password.encode('utf-8'),bcrypt.gensalt()).decode('utf-8')
-    
+        self.password = password_hasher.hash(password)
+
     def check_password(self, password):
-        return bcrypt.checkpw(password.encode('utf-8'),self.password.encode('utf-8'))
+        return password_hasher.check(password, self.password)
+
+    def rehash_password(self, password):
+        """Re-hash at the configured cost; True if the stored hash changed."""
+        if not password_hasher.needs_rehash(self.password):
+            return False
+        self.password = password_hasher.hash(password)
+        return True
 
 class Expenses(db.Model):
     id = db.Column(db.Integer,primary_key=True)
@@ -31,15 +107,26 @@ class Expenses(db.Model):
     amount = db.Column(db.Integer,nullable=False)
     date = db.Column(db.Date, nullable=False)
     description = db.Column(db.String(100),nullable=False)
+    # Client-supplied key so retried API writes don't create duplicates
+    idempotency_key = db.Column(db.String(64), nullable=True)
 
     user = db.relationship('User', backref=db.backref('expenses', lazy=True))
 
-    def __init__(self,name,amount,date,description,user_id):
+    # Kept in sync with migrations.add_expense_indexes for existing databases
+    __table_args__ = (
+        db.Index('ix_expenses_user_date', 'user_id', 'date'),
+        db.Index('ix_expenses_user_amount', 'user_id', 'amount'),
+        db.Index('ix_expenses_user_name', 'user_id', 'name'),
+        db.Index('ux_expenses_user_idempotency_key', 'user_id', 'idempotency_key', unique=True),
+    )
+
+    def __init__(self,name,amount,date,description,user_id,idempotency_key=None):
         self.name = name
         self.amount = amount
         self.date = date
         self.description = description
         self.user_id = user_id
+        self.idempotency_key = idempotency_key
 
 class UserDetails(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -54,8 +141,326 @@ class UserDetails(db.Model):
 
     user = db.relationship('User', backref=db.backref('details', uselist=False))
 
+class MonthlyRollup(db.Model):
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    year = db.Column(db.Integer, primary_key=True)
+    month = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(100), primary_key=True)
+    total = db.Column(db.Integer, nullable=False, default=0)
+    count = db.Column(db.Integer, nullable=False, default=0)
+
 with app.app_context():
-    db.create_all()
+    apply_sqlite_pragmas(db.engine, sqlite_pragmas())
+    instrument_engine(db.engine)
+    # Every worker runs this at startup; the lock keeps them from racing
+    with schema_lock(db.engine) as conn:
+        db.metadata.create_all(conn)
+    run_migrations(db.engine)
+
+@app.cli.command('migrate')
+def migrate_command():
+    """Apply pending schema migrations."""
+    applied = run_migrations(db.engine)
+    click.echo(f"Applied migrations: {applied}" if applied else "Schema is up to date.")
+
+
+# --- Request timing: stages go to the Server-Timing header and /metrics ---
+# Registered before load_current_user so its query is counted too.
+
+@app.before_request
+def start_request_timing():
+    g.timing = RequestTiming()
+
+@before_render_template.connect_via(app)
+def _template_started(sender, template, context, **extra):
+    g.template_started = time.perf_counter()
+
+@template_rendered.connect_via(app)
+def _template_finished(sender, template, context, **extra):
+    started = g.pop('template_started', None)
+    if started is not None and 'timing' in g:
+        g.timing.add('template', time.perf_counter() - started)
+
+@app.after_request
+def finish_request_timing(response):
+    timing = g.get('timing')
+    if timing is None:
+        return response
+    total = timing.elapsed()
+    # Streamed bodies (SSE, exports) are produced after this point and not counted
+    if app.config['SERVER_TIMING']:
+        response.headers['Server-Timing'] = timing.server_timing(total)
+    metrics.observe(request.endpoint or 'unmatched', request.method, response.status_code, total, timing)
+    return response
+
+
+def bump_data_version(user_id):
+    db.session.execute(
+        db.update(User).where(User.id == user_id).values(data_version=User.data_version + 1)
+    )
+    # Dropped once the bump commits; dropping it now would let a concurrent
+    # request cache the old row again before the new version is visible
+    db.session.info.setdefault('stale_identities', set()).add(user_id)
+
+@event.listens_for(db.session, 'after_commit')
+def _invalidate_committed_identities(session):
+    for user_id in session.info.pop('stale_identities', ()):
+        identity_cache.invalidate(user_id)
+
+@event.listens_for(db.session, 'after_soft_rollback')
+def _forget_rolled_back_identities(session, previous_transaction):
+    if not previous_transaction.nested:  # a savepoint rollback keeps the outer bumps
+        session.info.pop('stale_identities', None)
+
+
+# --- Current user: one joined query per request, optionally cached per process ---
+
+def load_identity(user_id):
+    """(User, UserDetails or None) in a single query, or None if the user is gone."""
+    row = db.session.query(User, UserDetails) \
+        .outerjoin(UserDetails, UserDetails.user_id == User.id) \
+        .filter(User.id == user_id).first()
+    return (row[0], row[1]) if row else None
+
+def load_all_identities():
+    return db.session.query(User, UserDetails) \
+        .outerjoin(UserDetails, UserDetails.user_id == User.id) \
+        .order_by(User.id).all()
+
+def _snapshot(obj):
+    return None if obj is None else {attr.key: getattr(obj, attr.key) for attr in sa_inspect(type(obj)).column_attrs}
+
+def _attach(model, values):
+    # Rebuild a persistent instance from cached column values without a
+    # query; it behaves like a freshly loaded row (changes are tracked)
+    if values is None:
+        return None
+    obj = sa_inspect(model).class_manager.new_instance()
+    for key, value in values.items():
+        set_committed_value(obj, key, value)
+    make_transient_to_detached(obj)
+    return db.session.merge(obj, load=False)
+
+@app.before_request
+def load_current_user():
+    g.user = g.details = None
+    user_id = session.get('user_id')
+    if user_id is None or request.endpoint == 'static':
+        return  # static files never look at the user
+
+    cached = identity_cache.get(user_id)
+    if cached is not None:
+        g.user, g.details = _attach(User, cached[0]), _attach(UserDetails, cached[1])
+        return
+    identity = load_identity(user_id)
+    if identity is None:
+        session.pop('user_id', None)  # deleted account
+        return
+    g.user, g.details = identity
+    if identity_cache.ttl:
+        identity_cache.set(user_id, (_snapshot(g.user), _snapshot(g.details)))
+
+# --- Monthly rollup: per (user, year, month, name) sums kept in step with Expenses ---
+
+def update_monthly_rollup(rows):
+    """Fold (user_id, date, name, amount) rows into MonthlyRollup.
+
+    Runs inside the caller's transaction, so the rollup commits (or rolls
+    back) together with the expenses themselves. Rows are collapsed per key
+    first, so a batch costs one upsert per distinct month and name.
+    """
+    deltas = {}
+    for user_id, expense_date, name, amount in rows:
+        key = (user_id, expense_date.year, expense_date.month, name)
+        total, count = deltas.get(key, (0, 0))
+        deltas[key] = (total + amount, count + 1)
+    if not deltas:
+        return
+
+    insert = dialect_insert(db.engine.dialect.name)
+    table = MonthlyRollup.__table__
+    stmt = insert(table)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[table.c.user_id, table.c.year, table.c.month, table.c.name],
+        set_={'total': table.c.total + stmt.excluded.total,
+              'count': table.c.count + stmt.excluded.count}
+    )
+    db.session.execute(stmt, [
+        {'user_id': u, 'year': y, 'month': m, 'name': n, 'total': total, 'count': count}
+        for (u, y, m, n), (total, count) in deltas.items()
+    ])
+
+def rebuild_monthly_rollups(user_id=None):
+    """Recompute MonthlyRollup from Expenses, for one user or everyone."""
+    delete = MonthlyRollup.query
+    source = db.select(
+        Expenses.user_id,
+        extract('year', Expenses.date),
+        extract('month', Expenses.date),
+        Expenses.name,
+        func.sum(Expenses.amount),
+        func.count(Expenses.id),
+    )
+    if user_id is not None:
+        delete = delete.filter_by(user_id=user_id)
+        source = source.where(Expenses.user_id == user_id)
+    source = source.group_by(Expenses.user_id, extract('year', Expenses.date),
+                             extract('month', Expenses.date), Expenses.name)
+
+    delete.delete(synchronize_session=False)
+    db.session.execute(MonthlyRollup.__table__.insert().from_select(
+        ['user_id', 'year', 'month', 'name', 'total', 'count'], source
+    ))
+    db.session.commit()
+
+@app.cli.command('rebuild-rollups')
+def rebuild_rollups_command():
+    """Backfill the monthly rollup table from Expenses."""
+    rebuild_monthly_rollups()
+    click.echo(f"Rebuilt {MonthlyRollup.query.count()} rollup rows.")
+
+@app.cli.command('seed')
+@click.option('--users', type=int, default=10, help='Users to create.')
+@click.option('--expenses', type=int, default=1000, help='Expenses per user.')
+@click.option('--months', type=int, default=24, help='Months of history per user.')
+@click.option('--seed', type=int, default=0, help='Random seed; same seed, same data.')
+@click.option('--end', type=click.DateTime(['%Y-%m-%d']), default=None,
+              help='Last expense date (default today); pin it to compare runs across days.')
+@click.option('--prefix', default='seed', help='Email prefix, e.g. seed-user-1@example.com.')
+@click.option('--password', default='password', help='Password for every seeded user.')
+@click.option('--batch-size', type=int, default=10000, help='Rows per bulk insert.')
+def seed_command(users, expenses, months, seed, end, prefix, password, batch_size):
+    """Generate synthetic users and expenses for load testing."""
+    end = end.date() if end else date.today()
+    taken = User.query.filter(User.email.like(f'{prefix}-user-%@example.com')).count()
+    if taken:
+        click.echo(f"{taken} '{prefix}' users already exist; pick another --prefix.")
+        return
+
+    started = time.perf_counter()
+    # One hash for everyone: hashing per user would dominate the run
+    hashed = password_hasher.hash(password)
+    rows = 0
+    for index in range(1, users + 1):
+        # A generator per user, so changing --users doesn't reshuffle the others
+        rng = random.Random(f'{seed}:{index}')
+        profile = seed_data.generate_user(rng, index, prefix)
+        user_id = db.session.execute(db.insert(User).values(
+            name=profile.pop('name'), email=profile['email'], password=hashed
+        ).returning(User.id)).scalar_one()
+        db.session.execute(db.insert(UserDetails).values(user_id=user_id, **profile))
+        for batch in seed_data.batched(seed_data.generate_expenses(rng, user_id, expenses, end, months),
+                                       batch_size):
+            # Core insert: skips the ORM's per-row bookkeeping
+            db.session.execute(Expenses.__table__.insert(), batch)
+            update_monthly_rollup([(user_id, r['date'], r['name'], r['amount']) for r in batch])
+            rows += len(batch)
+        db.session.commit()
+        if index % 100 == 0 or index == users:
+            elapsed = time.perf_counter() - started
+            click.echo(f"{index}/{users} users, {rows} expenses ({rows / elapsed:,.0f} rows/s)")
+
+
+# --- Aggregation layer: dashboard numbers come from the rollup, not raw rows ---
+
+def get_name_totals(user_id):
+    rows = db.session.query(MonthlyRollup.name, func.sum(MonthlyRollup.total)) \
+        .filter(MonthlyRollup.user_id == user_id) \
+        .group_by(MonthlyRollup.name).all()
+    return {name: total for name, total in rows}
+
+def get_yearly_totals(user_id):
+    rows = db.session.query(MonthlyRollup.year, func.sum(MonthlyRollup.total)) \
+        .filter(MonthlyRollup.user_id == user_id) \
+        .group_by(MonthlyRollup.year).all()
+    return {int(y): total for y, total in rows}
+
+def _month_filter(year, month):
+    return (MonthlyRollup.year == year) & (MonthlyRollup.month == month)
+
+def get_month_totals(user_id, now=None):
+    now = now or datetime.now()
+    last_year, last_month = previous_month(now)
+
+    def sum_where(condition):
+        return func.coalesce(func.sum(case((condition, MonthlyRollup.total), else_=0)), 0)
+
+    recent_count, this_month, prev_month, this_year = db.session.query(
+        func.coalesce(func.sum(MonthlyRollup.count), 0),
+        sum_where(_month_filter(now.year, now.month)),
+        sum_where(_month_filter(last_year, last_month)),
+        sum_where(MonthlyRollup.year == now.year),
+    ).filter(MonthlyRollup.user_id == user_id,
+             MonthlyRollup.year >= now.year - 1).one()
+
+    if not recent_count:
+        return None
+    return {'this_month': this_month, 'last_month': prev_month, 'this_year': this_year}
+
+def get_month_breakdown(user_id, now=None):
+    now = now or datetime.now()
+    rows = db.session.query(MonthlyRollup.name, MonthlyRollup.total, MonthlyRollup.count) \
+        .filter(MonthlyRollup.user_id == user_id, _month_filter(now.year, now.month)).all()
+    return {name: (total, count) for name, total, count in rows}
+
+def get_expense_summary(user_id):
+    total, count = db.session.query(
+        func.coalesce(func.sum(MonthlyRollup.total), 0),
+        func.coalesce(func.sum(MonthlyRollup.count), 0),
+    ).filter(MonthlyRollup.user_id == user_id).one()
+    return total, count
+
+def get_dashboard_aggregates(user_id):
+    now = datetime.now()
+    return {
+        'name_totals': get_name_totals(user_id),
+        'yearly_totals': get_yearly_totals(user_id),
+        'month_totals': get_month_totals(user_id, now),
+        'month_breakdown': get_month_breakdown(user_id, now),
+    }
+
+AI_SUMMARY_MONTHS = 12
+AI_SUMMARY_TOP_CATEGORIES = 5
+
+def get_ai_summary(user_id, monthly_budget, now=None):
+    """Fixed-size spending summary used for both the AI prompt and its cache key.
+
+    Monthly totals for the last 12 months, the top categories over that
+    window, budget utilisation and a 3-vs-3 month trend. Amounts are whole
+    rupees so the hash only moves when the summary visibly does.
+    """
+    now = now or datetime.now()
+    months = [(now.year, now.month)]
+    while len(months) < AI_SUMMARY_MONTHS:
+        months.append(previous_month(datetime(*months[-1], 1)))
+    months.reverse()
+    first = months[0][0] * 12 + months[0][1]
+    last = now.year * 12 + now.month
+    month_index = MonthlyRollup.year * 12 + MonthlyRollup.month
+    in_window = (MonthlyRollup.user_id == user_id) & month_index.between(first, last)
+
+    rows = db.session.query(MonthlyRollup.year, MonthlyRollup.month, func.sum(MonthlyRollup.total)) \
+        .filter(in_window).group_by(MonthlyRollup.year, MonthlyRollup.month).all()
+    by_month = {(int(y), int(m)): total for y, m, total in rows}
+    monthly = [round(by_month.get(ym, 0)) for ym in months]
+
+    category_total = func.sum(MonthlyRollup.total)
+    top = db.session.query(MonthlyRollup.name, category_total).filter(in_window) \
+        .group_by(MonthlyRollup.name).order_by(category_total.desc(), MonthlyRollup.name) \
+        .limit(AI_SUMMARY_TOP_CATEGORIES).all()
+    window_total = sum(monthly)
+
+    recent, earlier = sum(monthly[-3:]) / 3, sum(monthly[-6:-3]) / 3
+    average = window_total / len(monthly)
+    return {
+        'monthly_totals': [[f"{y}-{m:02d}", total] for (y, m), total in zip(months, monthly)],
+        'top_categories': [[name[:40], round(total), round(100 * total / window_total) if window_total else 0]
+                           for name, total in top],
+        'monthly_average': round(average),
+        'budget_used_pct': round(100 * monthly[-1] / monthly_budget) if monthly_budget else None,
+        'average_budget_pct': round(100 * average / monthly_budget) if monthly_budget else None,
+        'trend_pct': round(100 * (recent - earlier) / earlier) if earlier else None,
+    }
 
 @app.route('/')
 def index():
@@ -68,14 +473,22 @@ def login():
         password = request.form['password']
         user = User.query.filter_by(email=email).first()
 
-        if user and user.check_password(password):
-            session['name'] = user.name
-            session['email'] = user.email
-            session['password'] = user.password
-            print('Logged in Sucessfully!')
+        try:
+            valid = user is not None and user.check_password(password)
+            if valid and user.rehash_password(password):
+                db.session.commit()
+                identity_cache.invalidate(user.id)
+        except HasherBusy:
+            return render_template('login.html', error='Too many sign-ins right now, please try again.'), 503
+
+        if valid:
+            # The cookie only carries the id; everything else is loaded per request
+            session.clear()
+            session['user_id'] = user.id
+            log.info("login", extra={'user_id': user.id})
             return redirect('/dashboard')
         else:
-            print('Invalid User')
+            log.info("login failed")
             return render_template('login.html',error='Invalid User')
 
     return render_template('login.html')
@@ -92,10 +505,13 @@ def register():
             flash('Email already registered!', 'error')
             return render_template('register.html', error='Email already registered')
 
-        newUser = User(name=name,email=email,password=password)
+        try:
+            newUser = User(name=name,email=email,password=password)
+        except HasherBusy:
+            return render_template('register.html', error='Too many sign-ups right now, please try again.'), 503
         db.session.add(newUser)
         db.session.commit()
-        print('User has been registered')
+        log.info("user registered", extra={'user_id': newUser.id})
         return redirect('/login')
     return render_template('register.html')
 
@@ -103,17 +519,17 @@ def register():
 
 @app.route('/profile', methods=['GET', 'POST'])
 def profile():
-    if not session.get('email'):
+    if g.user is None:
         return redirect('/login')
 
-    user = User.query.filter_by(email=session['email']).first()
-    details = UserDetails.query.filter_by(user_id=user.id).first()
+    user = g.user
+    details = g.details
 
     if not details:
         details = UserDetails(user_id=user.id, email=user.email)
         db.session.add(details)
+        bump_data_version(user.id)
         db.session.commit()
-        session['ai_dirty'] = True
 
     if request.method == 'POST':
         field = request.form.get('save_field')
@@ -127,114 +543,414 @@ def profile():
         else:
             setattr(details, field, value)
 
+        bump_data_version(user.id)
         db.session.commit()
-        session['ai_dirty'] = True
         flash(f"{field.replace('_', ' ').title()} updated!", "success")
         return redirect('/profile')
 
     return render_template('profile.html', user=user, details=details)
 
 
+def parse_expense(name, amount, date_string, desc):
+    """Validate raw form/CSV values; raises ValueError with a readable message."""
+    name = (name or '').strip()
+    if not name:
+        raise ValueError("name is required")
+    try:
+        amount = int(amount)
+    except (TypeError, ValueError):
+        raise ValueError(f"amount must be a whole number, got {amount!r}")
+    try:
+        date_obj = datetime.strptime((date_string or '').strip(), "%Y-%m-%d").date()
+    except ValueError:
+        raise ValueError(f"date must be YYYY-MM-DD, got {date_string!r}")
+    return {'name': name, 'amount': amount, 'date': date_obj, 'description': desc or ''}
+
 @app.route('/add_expenses', methods=['POST','GET'])
 def add_expenses():
-    if not session.get('name'):
+    if g.user is None:
         return redirect('/login')
-    user = User.query.filter_by(email=session['email']).first()
-    if session['name']:
-        if request.method == 'POST':
-            name = request.form['name']
-            amount = int(request.form['amount'])
-            date_string = request.form['date']
-            desc = request.form.get('desc')
-            date_obj = datetime.strptime(date_string, "%Y-%m-%d").date()
-
-            print("###",name,amount,date_string,desc)
-            newExpense = Expenses(name=name, amount=amount, date=date_obj, description=desc, user_id=user.id)
-            db.session.add(newExpense)
-            db.session.commit()
-            session['ai_dirty'] = True
-            print('Expense has been added')
-            return redirect('/add_expenses')
-        return render_template('add_expenses.html',user=user)
+    user = g.user
+    if request.method == 'POST':
+        fields = parse_expense(request.form['name'], request.form['amount'],
+                               request.form['date'], request.form.get('desc'))
+
+        newExpense = Expenses(user_id=user.id, **fields)
+        db.session.add(newExpense)
+        update_monthly_rollup([(user.id, fields['date'], fields['name'], fields['amount'])])
+        bump_data_version(user.id)
+        db.session.commit()
+        log.info("expense added", extra={'user_id': user.id, 'expense_id': newExpense.id})
+        return redirect('/add_expenses')
+    return render_template('add_expenses.html',user=user)
+
+# --- Bulk CSV import ---
+
+MAX_REPORTED_IMPORT_ERRORS = 100
+
+def import_expenses_csv(user_id, stream, batch_size=1000):
+    """Insert valid rows from a CSV text stream in executemany batches.
+
+    The caller owns the transaction: every batch is flushed into the same one,
+    and the monthly rollup is updated once per batch. Returns the number of
+    imported rows and a list of (line number, error) for rejected rows.
+    """
+    reader = csv.DictReader(stream)
+    missing = {'name', 'amount', 'date'} - set(reader.fieldnames or [])
+    if missing:
+        return 0, [(1, f"missing column(s): {', '.join(sorted(missing))}")]
+
+    imported, errors, batch = 0, [], []
+
+    def flush(batch):
+        db.session.execute(db.insert(Expenses), batch)
+        update_monthly_rollup([(user_id, r['date'], r['name'], r['amount']) for r in batch])
+
+    for row in reader:
+        try:
+            fields = parse_expense(row.get('name'), row.get('amount'), row.get('date'),
+                                   row.get('description', row.get('desc')))
+        except ValueError as e:
+            if len(errors) < MAX_REPORTED_IMPORT_ERRORS:
+                errors.append((reader.line_num, str(e)))
+            continue
+        fields['user_id'] = user_id
+        batch.append(fields)
+        if len(batch) >= batch_size:
+            flush(batch)
+            imported += len(batch)
+            batch = []
+    if batch:
+        flush(batch)
+        imported += len(batch)
+    return imported, errors
+
+@app.route('/import_expenses', methods=['POST'])
+def import_expenses():
+    if g.user is None:
+        return redirect('/login')
+    user = g.user
+
+    upload = request.files.get('file')
+    if not upload or not upload.filename:
+        flash('Choose a CSV file to import.', 'error')
+        return redirect('/add_expenses')
+
+    stream = io.TextIOWrapper(upload.stream, encoding='utf-8-sig', newline='')
+    try:
+        imported, errors = import_expenses_csv(user.id, stream, app.config['IMPORT_BATCH_SIZE'])
+    except (UnicodeDecodeError, csv.Error) as e:
+        db.session.rollback()
+        flash(f'Could not read CSV: {e}', 'error')
+        return redirect('/add_expenses')
+
+    if imported:
+        bump_data_version(user.id)
+    db.session.commit()
+    return render_template('add_expenses.html', user=user, imported=imported, import_errors=errors)
+
+# --- JSON batch API ---
+
+def parse_expense_batch(items):
+    """Validate a JSON list of expenses. Returns (parsed, errors)."""
+    parsed, errors = [], []
+    for index, item in enumerate(items):
+        if not isinstance(item, dict):
+            errors.append({'index': index, 'error': 'expense must be an object'})
+            continue
+        key = item.get('idempotency_key')
+        if key is not None and (not isinstance(key, str) or not 0 < len(key) <= 64):
+            errors.append({'index': index, 'error': 'idempotency_key must be a string of 1-64 characters'})
+            continue
+        try:
+            fields = parse_expense(item.get('name'), item.get('amount'), item.get('date'), item.get('description'))
+        except ValueError as e:
+            errors.append({'index': index, 'error': str(e)})
+            continue
+        fields['idempotency_key'] = key
+        parsed.append(fields)
+    return parsed, errors
+
+def insert_expense_batch(user_id, parsed):
+    """Insert a validated batch, skipping keys already stored for this user.
+
+    Returns one {'index', 'id', 'idempotency_key', 'duplicate'} entry per
+    input item, in order. Caller commits.
+    """
+    keys = {p['idempotency_key'] for p in parsed if p['idempotency_key']}
+    existing = {}
+    if keys:
+        existing = dict(db.session.query(Expenses.idempotency_key, Expenses.id)
+                        .filter(Expenses.user_id == user_id, Expenses.idempotency_key.in_(keys)).all())
+
+    results, created = [], {}
+    for index, fields in enumerate(parsed):
+        key = fields['idempotency_key']
+        if key in existing or key in created:
+            results.append((index, key, existing.get(key) or created[key], True))
+            continue
+        expense = Expenses(user_id=user_id, **fields)
+        db.session.add(expense)
+        results.append((index, key, expense, False))
+        if key:
+            created[key] = expense
+
+    new_expenses = [r[2] for r in results if not r[3]]
+    if new_expenses:
+        db.session.flush()
+        update_monthly_rollup([(user_id, e.date, e.name, e.amount) for e in new_expenses])
+        bump_data_version(user_id)
+
+    return [{'index': index, 'idempotency_key': key,
+             'id': obj if isinstance(obj, int) else obj.id, 'duplicate': duplicate}
+            for index, key, obj, duplicate in results]
+
+@app.route('/api/expenses/batch', methods=['POST'])
+def api_expenses_batch():
+    if g.user is None:
+        return jsonify(error='login required'), 401
+    user = g.user
+
+    payload = request.get_json(silent=True)
+    items = payload.get('expenses') if isinstance(payload, dict) else payload
+    if not isinstance(items, list) or not items:
+        return jsonify(error='expected a non-empty list of expenses'), 400
+    if len(items) > app.config['API_BATCH_MAX']:
+        return jsonify(error=f"at most {app.config['API_BATCH_MAX']} expenses per request"), 413
+
+    parsed, errors = parse_expense_batch(items)
+    if errors:
+        return jsonify(errors=errors), 400
+
+    try:
+        results = insert_expense_batch(user.id, parsed)
+        db.session.commit()
+    except IntegrityError:
+        # A concurrent retry stored one of our keys first; rerun against the stored rows
+        db.session.rollback()
+        results = insert_expense_batch(user.id, parsed)
+        db.session.commit()
+
+    created = sum(1 for r in results if not r['duplicate'])
+    return jsonify(created=created, duplicates=len(results) - created, results=results), 201 if created else 200
+
+# --- Keyset pagination for /expense_list ---
+
+EXPENSE_SORT_COLUMNS = {'amount': Expenses.amount, 'date': Expenses.date}
+
+def encode_cursor(expense, sort_by):
+    value = getattr(expense, sort_by) if sort_by in EXPENSE_SORT_COLUMNS else ''
+    if isinstance(value, date):
+        value = value.isoformat()
+    return f"{value}~{expense.id}"
+
+def decode_cursor(cursor, sort_by):
+    """Return (sort value, id) from a cursor, or None if it is malformed."""
+    try:
+        value, expense_id = cursor.rsplit('~', 1)
+        if sort_by == 'amount':
+            value = int(value)
+        elif sort_by == 'date':
+            value = date.fromisoformat(value)
+        return value, int(expense_id)
+    except (AttributeError, ValueError):
+        return None
+
+def page_expenses(user_id, sort_by, order, cursor=None, page_size=50):
+    """One page of a user's expenses, continuing after `cursor`.
+
+    Rows are ordered by the sort column with id as a tie-breaker, and the
+    next page starts strictly after the last (value, id) seen, so every page
+    is an index range scan no matter how deep the user has paged.
+    """
+    column = EXPENSE_SORT_COLUMNS.get(sort_by)
+    descending = column is not None and order == 'desc'
+    query = Expenses.query.filter_by(user_id=user_id)
+
+    after = decode_cursor(cursor, sort_by) if cursor else None
+    if after is not None:
+        value, last_id = after
+        if column is None:
+            query = query.filter(Expenses.id > last_id)
+        elif descending:
+            query = query.filter((column < value) | ((column == value) & (Expenses.id < last_id)))
+        else:
+            query = query.filter((column > value) | ((column == value) & (Expenses.id > last_id)))
+
+    if column is None:
+        ordering = [Expenses.id.asc()]
+    elif descending:
+        ordering = [column.desc(), Expenses.id.desc()]
+    else:
+        ordering = [column.asc(), Expenses.id.asc()]
+
+    rows = query.order_by(*ordering).limit(page_size + 1).all()
+    next_cursor = encode_cursor(rows[page_size - 1], sort_by) if len(rows) > page_size else None
+    return rows[:page_size], next_cursor
 
 @app.route('/expense_list', methods=['GET'])
 def expense_list():
-    if session.get('name'):
-        user = User.query.filter_by(email=session['email']).first()
+    if g.user is not None:
+        user = g.user
         sort_by = request.args.get('sort')
         order = request.args.get('order', 'asc')  # Defaults to ascending
-        
-        # Choose the column
-        if sort_by == 'amount':
-            sort_column = Expenses.amount
-        elif sort_by == 'date':
-            sort_column = Expenses.date
-        else:
-            sort_column = None
-        
-        # Build the query
-        if sort_column is not None:
-            if order == 'desc':
-                expenses = Expenses.query.filter_by(user_id=user.id).order_by(sort_column.desc()).all()
-            else:
-                expenses = Expenses.query.filter_by(user_id=user.id).order_by(sort_column.asc()).all()
-        else:
-            # expenses = Expenses.query.filter_by(user_id=user.id).all()
-            expenses = Expenses.query.filter_by(user_id=user.id).all()
+        cursor = request.args.get('after')
+        per_page = request.args.get('per_page', app.config['EXPENSE_PAGE_SIZE'], type=int)
+        per_page = max(1, min(per_page, app.config['EXPENSE_MAX_PAGE_SIZE']))
 
-                
-        total = sum(exp.amount for exp in expenses)
+        expenses, next_cursor = page_expenses(user.id, sort_by, order, cursor, per_page)
+        total, count = get_expense_summary(user.id)
 
-        return render_template('expense_list.html',user=user, expenses=expenses, total=total, sort_by=sort_by, order=order)
+        return render_template('expense_list.html', user=user, expenses=expenses, total=total, count=count,
+                               sort_by=sort_by, order=order, per_page=per_page,
+                               next_cursor=next_cursor, is_first_page=not cursor)
     return redirect('/login')
 
+def render_dashboard_fragments(user_id, monthly_budget):
+    aggregates = get_dashboard_aggregates(user_id)
+
+    gauge_this_month, gauge_this_year, gauge_month_vs_last = generate_gauge_charts(
+        monthly_budget_limit=monthly_budget, totals=aggregates['month_totals']
+    )
+    return {
+        'chart_div': generate_bar_chart(name_totals=aggregates['name_totals']),
+        'worm_chart_div': generate_worm_chart(yearly_totals=aggregates['yearly_totals']),
+        'pie_chart_div': generate_pie_chart(name_totals=aggregates['name_totals']),
+        'gauge_this_month': gauge_this_month,
+        'gauge_this_year': gauge_this_year,
+        'gauge_month_vs_last': gauge_month_vs_last,
+        'status_tiles': get_icon_status_data(monthly_budget=monthly_budget, breakdown=aggregates['month_breakdown']),
+    }
+
+def get_monthly_budget(details):
+    # Takes the request's g.details, already loaded by load_current_user
+    return details.monthly_budget if details and details.monthly_budget else 0
+
+def get_cached_fragment(key, build):
+    value = dashboard_cache.get(key)
+    if value is None:
+        value = build()
+        dashboard_cache.set(key, value)
+    return value
+
+def conditional_response(user, name, build, make_body=make_response):
+    """Serve `build()` unless the client already has this version of it.
+
+    The ETag depends only on the user's data version and the date, so a
+    revalidation costs one identity query and never touches the charts.
+    """
+    today = datetime.now().date()
+    etag = hashlib.sha1(f"{name}:{user.id}:{user.data_version}:{today}".encode()).hexdigest()
+    if request.if_none_match.contains(etag):
+        response = make_response('', 304)
+    else:
+        response = make_body(get_cached_fragment((name, user.id, user.data_version, today), build))
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
+
+def _single_gauge(kind):
+    def render(user_id, monthly_budget):
+        totals = get_month_totals(user_id)
+        if not totals:
+            return "<div>No gauge data available.</div>" if kind == 'this_month' else ""
+        return generate_gauge(kind, totals, monthly_budget)
+    return render
+
+# Each dashboard panel only runs the queries and Plotly work it needs;
+# each is called as render(user_id, monthly_budget)
+DASHBOARD_PANELS = {
+    'bar': lambda user_id, _: generate_bar_chart(name_totals=get_name_totals(user_id)),
+    'pie': lambda user_id, _: generate_pie_chart(name_totals=get_name_totals(user_id)),
+    'worm': lambda user_id, _: generate_worm_chart(yearly_totals=get_yearly_totals(user_id)),
+    'gauge_this_month': _single_gauge('this_month'),
+    'gauge_this_year': _single_gauge('this_year'),
+    'gauge_month_vs_last': _single_gauge('month_vs_last'),
+}
+
 @app.route('/dashboard', methods=['GET'])
 def dashboard():
-    if 'email' not in session:
+    if g.user is None:
         return redirect('/login')
 
-    user = User.query.filter_by(email=session['email']).first()
-    details = UserDetails.query.filter_by(user_id=user.id).first()
+    user = g.user
+    details = g.details
 
-    monthly_budget = details.monthly_budget if details and details.monthly_budget else 0
+    monthly_budget = get_monthly_budget(details)
 
-    expenses = Expenses.query.filter_by(user_id=user.id).all()
+    render_mode = request.args.get('render', app.config['DASHBOARD_RENDER_MODE'])
+    if render_mode not in ('server', 'lazy', 'client'):
+        render_mode = 'server'
 
-    chart_div = generate_bar_chart(expenses)
-    worm_chart_div = generate_worm_chart(expenses)
-    pie_chart_div = generate_pie_chart(expenses)
-
-    gauge_this_month, gauge_this_year, gauge_month_vs_last = generate_gauge_charts(
-        expenses, monthly_budget_limit=monthly_budget
-    )
+    # Charts and tiles only change when the user's data does (or the day rolls over)
+    today = datetime.now().date()
+    if render_mode == 'server':
+        fragments = get_cached_fragment((user.id, user.data_version, today),
+                                        lambda: render_dashboard_fragments(user.id, monthly_budget))
+    else:
+        # Charts are fetched separately (/dashboard/panel/* or /api/dashboard/charts);
+        # the shell only needs the status tiles
+        fragments = {'status_tiles': get_cached_fragment(
+            ('tiles', user.id, user.data_version, today),
+            lambda: get_icon_status_data(monthly_budget=monthly_budget, breakdown=get_month_breakdown(user.id))
+        )}
 
-    status_tiles = get_icon_status_data(expenses, monthly_budget=monthly_budget)
     latest_expenses = Expenses.query.filter_by(user_id=user.id).order_by(Expenses.date.desc()).limit(4).all()
     return render_template(
         'dashboard.html',
         user=user,
-        chart_div=chart_div,
-        worm_chart_div=worm_chart_div,
-        pie_chart_div=pie_chart_div,
         latest_expenses=latest_expenses,
-        gauge_this_month=gauge_this_month,
-        gauge_this_year=gauge_this_year,
-        gauge_month_vs_last=gauge_month_vs_last,
-        status_tiles=status_tiles,
-        monthly_budget=monthly_budget
+        monthly_budget=monthly_budget,
+        render_mode=render_mode,
+        **fragments
+    )
+
+@app.route('/dashboard/panel/<panel>', methods=['GET'])
+def dashboard_panel(panel):
+    if g.user is None:
+        return make_response('login required', 401)
+    render = DASHBOARD_PANELS.get(panel)
+    if render is None:
+        return make_response('unknown panel', 404)
+
+    user, monthly_budget = g.user, get_monthly_budget(g.details)
+    return conditional_response(user, panel, lambda: render(user.id, monthly_budget))
+
+def build_dashboard_chart_data(user_id, monthly_budget):
+    aggregates = get_dashboard_aggregates(user_id)
+    return {
+        'bar': bar_chart_data(aggregates['name_totals']),
+        'pie': pie_chart_data(aggregates['name_totals']),
+        'worm': worm_chart_data(aggregates['yearly_totals']),
+        'gauges': gauge_chart_data(aggregates['month_totals'], monthly_budget),
+    }
+
+@app.route('/api/dashboard/charts', methods=['GET'])
+def dashboard_chart_data():
+    if g.user is None:
+        return jsonify(error='login required'), 401
+
+    user = g.user
+    return conditional_response(
+        user, 'charts',
+        lambda: build_dashboard_chart_data(user.id, get_monthly_budget(g.details)),
+        make_body=lambda charts: jsonify(version=user.data_version, charts=charts)
     )
 
 @app.route('/download_txt', methods=['POST','GET'])
 def download_txt():
-    if 'email' not in session:
+    if g.user is None:
         return redirect('/login')
 
-    user = User.query.filter_by(email=session['email']).first()
-    details = UserDetails.query.filter_by(user_id=user.id).first()
-    expenses = Expenses.query.filter_by(user_id=user.id).all()
+    response = make_response(build_txt_report(g.user, g.details))
+    response.headers['Content-Type'] = 'text/plain'
+    response.headers['Content-Disposition'] = 'attachment; filename=fintracker_report'+datetime.now().strftime('%Y%m%d%H%M%S')+'.txt'
+    return response
 
-    total_spent = sum(e.amount for e in expenses)
-    latest_expenses = sorted(expenses, key=lambda x: x.date, reverse=True)[:5]
+def build_txt_report(user, details):
+    """The plain-text report body behind /download_txt."""
+    total_spent, total_entries = get_expense_summary(user.id)
+    latest_expenses = Expenses.query.filter_by(user_id=user.id).order_by(Expenses.date.desc()).limit(5).all()
 
     txt = f"--- FinTracker Report ---\n\n"
     txt += f"Name: {user.name}\nEmail: {user.email}\n\n"
@@ -248,10 +964,7 @@ def download_txt():
         txt += f"Financial Goal: {details.financial_goal or 'N/A'}\n"
 
     # Budget comparison
-    current_month = datetime.now().month
-    current_year = datetime.now().year
-    this_month_expenses = [e.amount for e in expenses if e.date.month == current_month and e.date.year == current_year]
-    spent_this_month = sum(this_month_expenses)
+    spent_this_month = sum(total for total, _ in get_month_breakdown(user.id).values())
 
     txt += f"\n--- Budget Comparison ---\n"
     txt += f"Spent This Month: ₹{spent_this_month}\n"
@@ -268,85 +981,449 @@ def download_txt():
 
     txt += f"\n--- Expense Summary ---\n"
     txt += f"Total Expenses: ₹{total_spent}\n"
-    txt += f"Total Entries: {len(expenses)}\n\n"
+    txt += f"Total Entries: {total_entries}\n\n"
 
     txt += f"--- Latest 5 Expenses ---\n"
     for e in latest_expenses:
         txt += f"{e.date.strftime('%Y-%m-%d')}: ₹{e.amount} for {e.name} ({e.description})\n"
+    return txt
+
+
+# --- Streaming full-history export ---
+
+EXPORT_FIELDS = ['date', 'name', 'amount', 'description']
+EXPORT_CHUNK_BYTES = 64 * 1024
+
+def iter_export_rows(user_id, start=None, end=None, batch_size=1000):
+    query = db.session.query(Expenses.date, Expenses.name, Expenses.amount, Expenses.description) \
+        .filter(Expenses.user_id == user_id)
+    if start:
+        query = query.filter(Expenses.date >= start)
+    if end:
+        query = query.filter(Expenses.date <= end)
+    # yield_per streams from a server-side cursor instead of buffering the result
+    return query.order_by(Expenses.date, Expenses.id).execution_options(yield_per=batch_size)
+
+def iter_csv(rows):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(EXPORT_FIELDS)
+    yield buffer.getvalue()
+    buffer.seek(0)
+    buffer.truncate()
+    for row in rows:
+        writer.writerow([row.date.isoformat(), row.name, row.amount, row.description])
+        if buffer.tell() >= EXPORT_CHUNK_BYTES:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+def iter_ndjson(rows):
+    chunk = []
+    size = 0
+    for row in rows:
+        line = json.dumps({'date': row.date.isoformat(), 'name': row.name,
+                           'amount': row.amount, 'description': row.description}, ensure_ascii=False) + '\n'
+        chunk.append(line)
+        size += len(line)
+        if size >= EXPORT_CHUNK_BYTES:
+            yield ''.join(chunk)
+            chunk, size = [], 0
+    yield ''.join(chunk)
+
+def iter_gzip(chunks):
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)  # wbits=31 -> gzip container
+    for chunk in chunks:
+        data = compressor.compress(chunk.encode('utf-8'))
+        if data:
+            yield data
+    yield compressor.flush()
+
+def parse_date_arg(name):
+    value = request.args.get(name)
+    return datetime.strptime(value, "%Y-%m-%d").date() if value else None
+
+@app.route('/export', methods=['GET'])
+def export_expenses():
+    if g.user is None:
+        return redirect('/login')
 
-    response = make_response(txt)
-    response.headers['Content-Type'] = 'text/plain'
-    response.headers['Content-Disposition'] = 'attachment; filename=fintracker_report'+datetime.now().strftime('%Y%m%d%H%M%S')+'.txt'
+    user = g.user
+    fmt = request.args.get('format', 'csv')
+    if fmt not in ('csv', 'ndjson'):
+        return make_response("Unsupported format, use csv or ndjson", 400)
+    try:
+        start, end = parse_date_arg('start'), parse_date_arg('end')
+    except ValueError:
+        return make_response("Dates must be in YYYY-MM-DD format", 400)
+
+    rows = iter_export_rows(user.id, start, end)
+    chunks = iter_csv(rows) if fmt == 'csv' else iter_ndjson(rows)
+    use_gzip = request.args.get('gzip') in ('1', 'true')
+    body = iter_gzip(chunks) if use_gzip else (chunk.encode('utf-8') for chunk in chunks)
+
+    response = Response(stream_with_context(body),
+                        mimetype='text/csv' if fmt == 'csv' else 'application/x-ndjson')
+    filename = f"fintracker_expenses{datetime.now().strftime('%Y%m%d%H%M%S')}.{fmt}"
+    response.headers['Content-Disposition'] = f'attachment; filename={filename}'
+    if use_gzip:
+        response.headers['Content-Encoding'] = 'gzip'
     return response
 
 
-import os
-import json
-import threading
-from ai import analyze_txt_content, generate_data_hash
-
-
-import markdown
-
-
-# CACHE_FILE = "ai_cache.json"
+from ai import (analyze_txt_content, local_analyze_txt_content, stream_txt_content,
+                local_stream_txt_content, generate_data_hash, render_markdown, estimate_tokens, response_digest)
+from ai import AIError, breaker as ai_breaker
+from ai_jobs import AIJobScheduler, TokenStreams, REJECTED
+from ai_store import SQLAIResultStore, import_json_cache_files
+
+
+app.config['AI_BACKEND'] = os.environ.get('AI_BACKEND', 'openrouter')  # or 'local'
+app.config['AI_WORKERS'] = int(os.environ.get('AI_WORKERS', 2))
+app.config['AI_QUEUE_SIZE'] = int(os.environ.get('AI_QUEUE_SIZE', 32))
+ai_scheduler = AIJobScheduler(workers=app.config['AI_WORKERS'], max_queue=app.config['AI_QUEUE_SIZE'])
+ai_streams = TokenStreams()
+app.config['AI_CACHE_TTL'] = int(os.environ.get('AI_CACHE_TTL', 7 * 24 * 3600))
+app.config['AI_CACHE_LRU_SIZE'] = int(os.environ.get('AI_CACHE_LRU_SIZE', 1024))
+# Cap on stored responses; least recently used go first when the store prunes,
+# which it does every AI_CACHE_PRUNE_EVERY writes (0 = only from ai-refresh)
+app.config['AI_CACHE_MAX_RESPONSES'] = int(os.environ.get('AI_CACHE_MAX_RESPONSES', 10000))
+app.config['AI_CACHE_PRUNE_EVERY'] = int(os.environ.get('AI_CACHE_PRUNE_EVERY', 100))
+# Round profile and summary amounts into bands so similar users share responses
+app.config['AI_BUCKET_INPUTS'] = os.environ.get('AI_BUCKET_INPUTS', '0') in ('1', 'true')
+# How long /ai/stream keeps a client connected waiting for its analysis
+app.config['AI_STREAM_TIMEOUT'] = int(os.environ.get('AI_STREAM_TIMEOUT', 120))
+# Defaults for `flask ai-refresh`
+app.config['AI_REFRESH_CONCURRENCY'] = int(os.environ.get('AI_REFRESH_CONCURRENCY', 4))
+app.config['AI_REFRESH_TOKEN_BUDGET'] = int(os.environ.get('AI_REFRESH_TOKEN_BUDGET', 200000))
+with app.app_context():
+    ai_store = SQLAIResultStore(db.engine, max_entries=app.config['AI_CACHE_LRU_SIZE'],
+                                ttl=app.config['AI_CACHE_TTL'],
+                                max_responses=app.config['AI_CACHE_MAX_RESPONSES'],
+                                prune_every=app.config['AI_CACHE_PRUNE_EVERY'])
+
+@app.cli.command('import-ai-cache')
+def import_ai_cache_command():
+    """Import legacy ai_cache_{id}.json files into the AI result store."""
+    imported = import_json_cache_files(ai_store, '.', render=render_markdown)
+    click.echo(f"Imported AI results for users: {imported}" if imported else "Nothing to import.")
+
+def run_ai_analysis(text):
+    if app.config['AI_BACKEND'] == 'local':
+        return local_analyze_txt_content(text)
+    return analyze_txt_content(text)
+
+def stream_ai_analysis(text):
+    if app.config['AI_BACKEND'] == 'local':
+        return local_stream_txt_content(text)
+    return stream_txt_content(text)
+
+
+# The profile fields build_ai_input puts in the prompt; only these go into the hash
+AI_PROFILE_FIELDS = ['annual_income', 'monthly_budget', 'financial_goal']
+
+def build_ai_input(profile, summary):
+    profile_summary = f"Income: ₹{profile['annual_income']}, Budget: ₹{profile['monthly_budget']}, Goal: {profile['financial_goal']}"
+    lines = [profile_summary,
+             "Monthly totals (last 12 months): " + ", ".join(f"{month}: ₹{total}" for month, total in summary['monthly_totals']),
+             f"Monthly average: ₹{summary['monthly_average']}"]
+    if summary['budget_used_pct'] is not None:
+        lines.append(f"Budget used this month: {summary['budget_used_pct']}% "
+                     f"(12-month average {summary['average_budget_pct']}%)")
+    if summary['trend_pct'] is not None:
+        lines.append(f"Trend (last 3 months vs previous 3): {summary['trend_pct']:+d}%")
+    if summary['top_categories']:
+        lines.append("Expense Categories: " + ", ".join(
+            f"{name} ₹{total} ({share}%)" for name, total, share in summary['top_categories']))
+    return "\n".join(lines)
+
+def bucket_amount(value):
+    # Two significant figures: 23,450 and 23,990 both become 23,000 / 24,000 bands
+    if not isinstance(value, (int, float)) or not value:
+        return value
+    return int(float(f"{value:.2g}"))
+
+def bucket_percent(value):
+    return None if value is None else int(round(value, -1))
+
+def bucket_ai_input(profile, summary):
+    """Coarsen the inputs so similar users (e.g. students on the same budget band) share a response.
+
+    Only what the prompt uses is kept, so equal buckets mean equal prompts.
+    """
+    profile = {'annual_income': bucket_amount(profile['annual_income']),
+               'monthly_budget': bucket_amount(profile['monthly_budget']),
+               'financial_goal': profile['financial_goal']}
+    summary = {
+        'monthly_totals': [[month, bucket_amount(total)] for month, total in summary['monthly_totals']],
+        'top_categories': [[name, bucket_amount(total), bucket_percent(share)]
+                           for name, total, share in summary['top_categories']],
+        'monthly_average': bucket_amount(summary['monthly_average']),
+        'budget_used_pct': bucket_percent(summary['budget_used_pct']),
+        'average_budget_pct': bucket_percent(summary['average_budget_pct']),
+        'trend_pct': bucket_percent(summary['trend_pct']),
+    }
+    return profile, summary
+
+def load_ai_input(user, details):
+    """(data hash, prompt text) for the user's profile and spending summary.
+
+    Both come from the same aggregate summary, so the prompt size is fixed
+    and the cache key covers the user's whole recent history.
+    """
+    profile_data = {field: getattr(details, field, None) or "Not set" for field in AI_PROFILE_FIELDS}
+    budget = float(details.monthly_budget) if details and details.monthly_budget else 0
+    summary = get_ai_summary(user.id, budget)
+    if app.config['AI_BUCKET_INPUTS']:
+        profile_data, summary = bucket_ai_input(profile_data, summary)
+    return generate_data_hash(profile_data, summary), build_ai_input(profile_data, summary)
+
+def fresh_ai_result(user_id, data_hash, cached):
+    """The user's up-to-date result, reusing a shared response when one matches, else None."""
+    if not ai_store.is_stale(cached, data_hash):
+        return cached
+    return ai_store.link(user_id, data_hash, response_digest(data_hash))
+
+def generate_ai_result(user_id, data_hash, digest, text):
+    """Background job: stream the analysis to any /ai/stream listeners, then store it."""
+    stream = ai_streams.open(digest)
+    try:
+        for chunk in stream_ai_analysis(text):
+            stream.append(chunk)
+        result = ''.join(stream.chunks)
+        if not result.strip():
+            raise AIError("No valid response received from model.")
+        # Render once here so every later page view is just a lookup
+        ai_store.put(user_id, data_hash, result, html=render_markdown(result), digest=digest)
+        stream.finish()
+    except Exception as e:
+        stream.finish(error=str(e))
+        raise
+    finally:
+        ai_streams.close(digest)
+
+def submit_ai_job(user_id, data_hash, text):
+    # One job per response digest at a time, even across users; a full queue sheds the request
+    digest = response_digest(data_hash)
+    return ai_scheduler.submit(digest, generate_ai_result, user_id, data_hash, digest, text)
+
+
+def refresh_ai_result(users, digest, text):
+    user_id, data_hash = users[0]
+    result = run_ai_analysis(text)
+    ai_store.put(user_id, data_hash, result, html=render_markdown(result), digest=digest)
+    for user_id, data_hash in users[1:]:
+        ai_store.link(user_id, data_hash, digest)
+
+def refresh_stale_ai_results(concurrency, token_budget, dry_run=False):
+    """Regenerate every stored analysis whose data hash (or TTL) is out of date.
+
+    Users whose inputs match an existing response are just pointed at it,
+    and users that share a digest share one call. At most `concurrency`
+    upstream calls run at once. Each call reserves its worst-case cost
+    from estimate_tokens, and work that no longer fits in `token_budget`
+    is left for the next run. Returns a summary dict.
+    """
+    summary = {'stale': 0, 'shared': 0, 'refreshed': 0, 'failed': 0, 'over_budget': 0, 'tokens': 0}
+    work = {}  # digest -> (prompt text, [(user_id, data_hash), ...])
+    for user, details in load_all_identities():
+        data_hash, text = load_ai_input(user, details)
+        cached = ai_store.get(user.id)
+        if not ai_store.is_stale(cached, data_hash):
+            continue
+        summary['stale'] += 1
+        digest = response_digest(data_hash)
+        if digest in work:
+            work[digest][1].append((user.id, data_hash))
+            continue
+        if not dry_run and fresh_ai_result(user.id, data_hash, cached) is not None:
+            summary['shared'] += 1
+            continue
+        cost = estimate_tokens(text)
+        if summary['tokens'] + cost > token_budget:
+            summary['over_budget'] += 1
+            continue
+        summary['tokens'] += cost
+        work[digest] = (text, [(user.id, data_hash)])
+
+    if dry_run or not work:
+        return summary
+
+    with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='ai-refresh') as pool:
+        futures = {pool.submit(refresh_ai_result, users, digest, text): users
+                   for digest, (text, users) in work.items()}
+        for future in as_completed(futures):
+            users = futures[future]
+            try:
+                future.result()
+                summary['refreshed'] += len(users)
+            except Exception as e:
+                summary['failed'] += len(users)
+                log.warning("AI refresh failed", extra={'users': [u for u, _ in users], 'error': str(e)})
+    return summary
+
+@app.cli.command('ai-refresh')
+@click.option('--concurrency', type=int, default=None, help='Parallel upstream calls (AI_REFRESH_CONCURRENCY).')
+@click.option('--token-budget', type=int, default=None, help='Estimated tokens to spend (AI_REFRESH_TOKEN_BUDGET).')
+@click.option('--dry-run', is_flag=True, help='Only report what would be refreshed.')
+def ai_refresh_command(concurrency, token_budget, dry_run):
+    """Precompute AI analyses for users whose data changed, e.g. from cron off-peak.
+
+    Also prunes expired and least recently used responses. The store prunes
+    itself every AI_CACHE_PRUNE_EVERY writes; with that set to 0, run this
+    from cron to keep the store bounded.
+    """
+    summary = refresh_stale_ai_results(concurrency or app.config['AI_REFRESH_CONCURRENCY'],
+                                       token_budget or app.config['AI_REFRESH_TOKEN_BUDGET'],
+                                       dry_run=dry_run)
+    click.echo(f"Stale: {summary['stale']}, shared: {summary['shared']}, refreshed: {summary['refreshed']}, "
+          f"failed: {summary['failed']}, over budget: {summary['over_budget']}, "
+          f"estimated tokens: {summary['tokens']}")
+    if not dry_run:
+        removed = ai_store.prune()
+        click.echo(f"Pruned {removed} cached responses.")
+
+
+def cached_analysis_html(result):
+    # Results stored before HTML was cached alongside them are rendered on the fly
+    return result.html if result.html is not None else render_markdown(result.response)
 
 @app.route('/ai')
 def ai():
-    if 'email' not in session:
+    if g.user is None:
         return redirect('/login')
 
-    user = User.query.filter_by(email=session['email']).first()
-    details = UserDetails.query.filter_by(user_id=user.id).first()
-    expenses = Expenses.query.filter_by(user_id=user.id).all()
-    CACHE_FILE = f"ai_cache_{user.id}.json"
-
-    profile_data = {field: getattr(details, field) or "Not set" for field in
-                    ['annual_income', 'monthly_budget', 'occupation', 'age', 'location', 'financial_goal']}
-    expense_data = [{"name": e.name, "amount": e.amount, "date": str(e.date), "desc": e.description} for e in expenses[:10]]
-
-    current_hash = generate_data_hash(profile_data, expense_data)
-    cache = {}
-    last_refreshed = None
-
-    if os.path.exists(CACHE_FILE):
-        with open(CACHE_FILE, 'r') as f:
-            cache = json.load(f)
-
-        # Get file modification time for "Last Refreshed"
-        last_refreshed = datetime.fromtimestamp(os.path.getmtime(CACHE_FILE)).strftime("%Y-%m-%d %H:%M:%S")
-
-        if cache.get('hash') == current_hash:
-            rendered_output = markdown.markdown(
-                cache.get('response', 'Generating new analysis...'),
-                extensions=['fenced_code', 'tables']
-            )
-            return render_template('ai.html', user=user, analysis=rendered_output, last_refreshed=last_refreshed)
-
-    cached_response = cache.get('response', "Generating new analysis...")
-    # if "Would you like" in cached_response:
-    #     cached_response = cached_response.rsplit("Would you like", 1)[0].strip()
-
-    #  AI will generate in the background
-    def background_ai_processing():
-        profile_summary = f"Income: ₹{details.annual_income}, Budget: ₹{details.monthly_budget}, Goal: {details.financial_goal or 'N/A'}"
-        expense_summary = f"Recent Expenses Total: ₹{sum(e['amount'] for e in expense_data)}"
-        text = profile_summary + "\n" + expense_summary
-
-        categories = list(set(e['desc'] for e in expense_data))
-        if categories:
-            text += f"\nExpense Categories: {', '.join(categories)}"
-
-        result = analyze_txt_content(text)
-
-        with open(CACHE_FILE, 'w') as f:
-            json.dump({'hash': current_hash, 'response': result}, f)
-
-    threading.Thread(target=background_ai_processing).start()
-    rendered_output = markdown.markdown(cached_response, extensions=['fenced_code', 'tables'])
+    user = g.user
+    current_hash, text = load_ai_input(user, g.details)
+    cached = ai_store.get(user.id)
+    fresh = fresh_ai_result(user.id, current_hash, cached)
+    ai_store.count_lookup(hit=fresh is not None)
+    if fresh is not None:
+        return render_template('ai.html', user=user, analysis=cached_analysis_html(fresh),
+                               last_refreshed=fresh.created_at.strftime("%Y-%m-%d %H:%M:%S"))
+    last_refreshed = cached.created_at.strftime("%Y-%m-%d %H:%M:%S") if cached else None
+
+    #  AI will generate in the background; the page follows it over /ai/stream
+    status = submit_ai_job(user.id, current_hash, text)
+    if cached is not None:
+        rendered_output = cached_analysis_html(cached)
+    elif status == REJECTED:
+        rendered_output = render_markdown("The AI assistant is busy right now. Please check back in a minute.")
+    else:
+        rendered_output = render_markdown("Generating new analysis...")
 
     #  even here, we pass last_refreshed if available
-    return render_template('ai.html', user=user, analysis=rendered_output, last_refreshed=last_refreshed)
+    return render_template('ai.html', user=user, analysis=rendered_output, last_refreshed=last_refreshed,
+                           stream_url=url_for('ai_stream') if status != REJECTED else None)
+
+def sse_event(event, **data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+@app.route('/ai/stream')
+def ai_stream():
+    """Server-Sent Events for the user's analysis.
+
+    Emits `token` events while the background job is generating and a final
+    `done` event with the rendered HTML. Listeners share the job's output, so
+    extra tabs or reconnects never cause another upstream call. If there is
+    nothing to follow (the job already finished) the stored result is sent.
+    """
+    if g.user is None:
+        return jsonify(error='login required'), 401
+
+    user = g.user
+    user_id = user.id
+    current_hash, text = load_ai_input(user, g.details)
+    key = response_digest(current_hash)
+    timeout = app.config['AI_STREAM_TIMEOUT']
+
+    def finished_event():
+        # Another user's job may have produced this response; link picks it up
+        result = fresh_ai_result(user_id, current_hash, ai_store.get(user_id))
+        if result is not None:
+            return sse_event('done', html=cached_analysis_html(result),
+                             refreshed=result.created_at.strftime("%Y-%m-%d %H:%M:%S"))
+        # The job failed; keep showing whatever the page already has
+        return sse_event('error', message="Could not generate a new analysis. Please try again later.")
+
+    def events():
+        if fresh_ai_result(user_id, current_hash, ai_store.get(user_id)) is not None:
+            yield finished_event()
+            return
+        if submit_ai_job(user_id, current_hash, text) == REJECTED:
+            yield sse_event('error', message="The AI assistant is busy right now. Please check back in a minute.")
+            return
+
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            stream = ai_streams.get(key)
+            if stream is None:
+                if not ai_scheduler.is_pending(key):
+                    break
+                stream = ai_streams.get(key, timeout=1)
+            if stream is None:
+                yield ": queued\n\n"  # keeps proxies from closing an idle connection
+                continue
+            sent = 0
+            while time.monotonic() < deadline:
+                chunks, done = stream.read(sent, timeout=15)
+                for chunk in chunks:
+                    yield sse_event('token', text=chunk)
+                sent += len(chunks)
+                if done:
+                    break
+                if not chunks:
+                    yield ": waiting\n\n"
+            break
+        yield finished_event()
+
+    response = Response(stream_with_context(events()), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+@app.route('/ai/jobs')
+def ai_jobs():
+    if g.user is None:
+        return make_response('login required', 401)
+    return jsonify(dict(ai_scheduler.stats(), upstream_circuit=ai_breaker.state, cache=ai_store.stats()))
+
+CIRCUIT_STATES = {'closed': 0, 'half-open': 1, 'open': 2}
+
+def metric_samples():
+    """(name, type, help, labels, value) for the caches and AI jobs, read at scrape time."""
+    jobs = ai_scheduler.stats()
+    cache = ai_store.stats()
+    samples = [
+        ('ai_cache_hits_total', 'counter', '/ai views served a cached analysis (own or shared).', {}, cache['hits']),
+        ('ai_cache_misses_total', 'counter', '/ai views that needed a new completion.', {}, cache['misses']),
+        ('ai_jobs_queued', 'gauge', 'AI jobs waiting for a worker.', {}, jobs['queue_depth']),
+        ('ai_jobs_in_flight', 'gauge', 'AI jobs running now.', {}, jobs['in_flight']),
+        ('ai_upstream_circuit_state', 'gauge', 'Upstream circuit breaker: 0 closed, 1 half-open, 2 open.', {},
+         CIRCUIT_STATES[ai_breaker.state]),
+    ]
+    if cache['hit_rate'] is not None:
+        samples.append(('ai_cache_hit_ratio', 'gauge', 'Share of /ai views served from cache.', {},
+                        cache['hit_rate']))
+    samples += [('ai_jobs_total', 'counter', 'Finished or refused AI jobs by outcome.', {'outcome': outcome},
+                 jobs[outcome]) for outcome in ('completed', 'failed', 'rejected', 'deduplicated')]
+    for name, cache in (('dashboard', dashboard_cache), ('identity', identity_cache)):
+        stats = cache.stats()
+        samples += [
+            ('cache_hits_total', 'counter', 'In-process cache hits.', {'cache': name}, stats['hits']),
+            ('cache_misses_total', 'counter', 'In-process cache misses.', {'cache': name}, stats['misses']),
+            ('cache_entries', 'gauge', 'In-process cache entries.', {'cache': name}, stats['entries']),
+        ]
+    return samples
+
+@app.route('/metrics')
+def metrics_endpoint():
+    if not app.config['METRICS_ENABLED']:
+        return make_response('metrics disabled', 404)
+    response = make_response(metrics.render(metric_samples()))
+    response.headers['Content-Type'] = 'text/plain; version=0.0.4; charset=utf-8'
+    return response
 
 
 if __name__ == '__main__':
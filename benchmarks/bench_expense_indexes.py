@@ -0,0 +1,92 @@
+"""Show the query plans and timings of the hot Expenses queries before and
+after the composite index migration.
+
+    python benchmarks/bench_expense_indexes.py --users 50 --rows 200000
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from sqlalchemy import create_engine, text
+
+from migrations import run_migrations
+
+BASELINE_SCHEMA = """
+CREATE TABLE expenses (
+    id INTEGER NOT NULL PRIMARY KEY,
+    user_id INTEGER NOT NULL,
+    name VARCHAR(100) NOT NULL,
+    amount INTEGER NOT NULL,
+    date DATE NOT NULL,
+    description VARCHAR(100) NOT NULL
+)
+"""
+
+QUERIES = {
+    "filter by user": "SELECT * FROM expenses WHERE user_id = :uid",
+    "latest 4": "SELECT * FROM expenses WHERE user_id = :uid ORDER BY date DESC LIMIT 4",
+    "sort by amount": "SELECT * FROM expenses WHERE user_id = :uid ORDER BY amount",
+    "totals by name": "SELECT name, SUM(amount) FROM expenses WHERE user_id = :uid GROUP BY name",
+}
+
+NAMES = ["Food", "Rent", "Transport", "Shopping", "Bills", "Health", "Travel", "Fun"]
+
+
+def populate(engine, users, rows, seed=42):
+    rng = random.Random(seed)
+    start = date(2018, 1, 1)
+    with engine.begin() as conn:
+        conn.execute(text(BASELINE_SCHEMA))
+        batch = []
+        for i in range(rows):
+            batch.append({
+                "uid": rng.randint(1, users),
+                "name": rng.choice(NAMES),
+                "amount": rng.randint(10, 5000),
+                "date": (start + timedelta(days=rng.randint(0, 2500))).isoformat(),
+            })
+            if len(batch) == 10000 or i == rows - 1:
+                conn.execute(text(
+                    "INSERT INTO expenses (user_id, name, amount, date, description) "
+                    "VALUES (:uid, :name, :amount, :date, '')"
+                ), batch)
+                batch = []
+
+
+def report(engine, label, user_id, repeat):
+    print(f"\n=== {label} ===")
+    with engine.connect() as conn:
+        for name, sql in QUERIES.items():
+            plan = conn.execute(text("EXPLAIN QUERY PLAN " + sql), {"uid": user_id}).fetchall()
+            started = time.perf_counter()
+            for _ in range(repeat):
+                conn.execute(text(sql), {"uid": user_id}).fetchall()
+            elapsed = (time.perf_counter() - started) / repeat * 1000
+            print(f"{name:<16} {elapsed:8.2f} ms   plan: {' | '.join(row[-1] for row in plan)}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--rows", type=int, default=200000)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        engine = create_engine(f"sqlite:///{os.path.join(tmp, 'bench.db')}")
+        populate(engine, args.users, args.rows)
+        report(engine, "before migrations", 1, args.repeat)
+        run_migrations(engine)
+        with engine.begin() as conn:
+            conn.execute(text("ANALYZE"))
+        report(engine, "after migrations", 1, args.repeat)
+
+
+if __name__ == "__main__":
+    main()
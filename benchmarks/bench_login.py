@@ -0,0 +1,81 @@
+"""Login password-check throughput and latency at different bcrypt costs and
+concurrency levels, through the same bounded hasher the app uses.
+
+    python benchmarks/bench_login.py --rounds 10 12 --concurrency 1 8 32 --workers 2
+"""
+import argparse
+import os
+import statistics
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from passwords import PasswordHasher, HasherBusy
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+
+def run(rounds, concurrency, workers, logins, max_pending):
+    hasher = PasswordHasher(rounds, workers, max_pending=max_pending, queue_timeout=30)
+    stored = hasher.hash('correct horse battery staple')
+    latencies, shed = [], [0]
+    lock = threading.Lock()
+    remaining = [logins]
+
+    def client():
+        while True:
+            with lock:
+                if remaining[0] == 0:
+                    return
+                remaining[0] -= 1
+            started = time.perf_counter()
+            try:
+                hasher.check('correct horse battery staple', stored)
+            except HasherBusy:
+                with lock:
+                    shed[0] += 1
+                continue
+            with lock:
+                latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=client) for _ in range(concurrency)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - started
+    hasher.shutdown()
+    return {
+        'logins/s': len(latencies) / elapsed,
+        'p50 ms': statistics.median(latencies) * 1000,
+        'p99 ms': percentile(latencies, 99) * 1000,
+        'shed': shed[0],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rounds', type=int, nargs='+', default=[10, 12])
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 8, 32])
+    parser.add_argument('--workers', type=int, default=max(1, (os.cpu_count() or 2) // 2),
+                        help='hasher threads (BCRYPT_MAX_WORKERS)')
+    parser.add_argument('--max-pending', type=int, default=64, help='BCRYPT_MAX_PENDING')
+    parser.add_argument('--logins', type=int, default=64, help='password checks per run')
+    args = parser.parse_args()
+
+    print(f"{'rounds':>6} {'clients':>7} {'logins/s':>9} {'p50 ms':>8} {'p99 ms':>8} {'shed':>5}")
+    for rounds in args.rounds:
+        for concurrency in args.concurrency:
+            r = run(rounds, concurrency, args.workers, args.logins, args.max_pending)
+            print(f"{rounds:>6} {concurrency:>7} {r['logins/s']:>9.1f} {r['p50 ms']:>8.1f} "
+                  f"{r['p99 ms']:>8.1f} {r['shed']:>5}")
+
+
+if __name__ == '__main__':
+    main()
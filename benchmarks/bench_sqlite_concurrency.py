@@ -0,0 +1,116 @@
+"""Mixed read/write throughput on a SQLite file with the default rollback
+journal and with the production pragmas from config.py (WAL etc.).
+
+Writers insert a few expenses per transaction, like add_expenses; readers
+run the dashboard's per-user totals query.
+
+    python benchmarks/bench_sqlite_concurrency.py --readers 8 --writers 2 --seconds 5
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from datetime import date, timedelta
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from sqlalchemy import create_engine, text
+from sqlalchemy.exc import OperationalError
+
+from config import database_config, sqlite_pragmas, apply_sqlite_pragmas
+from bench_expense_indexes import populate
+
+READ = "SELECT name, SUM(amount) FROM expenses WHERE user_id = :uid GROUP BY name"
+WRITE = ("INSERT INTO expenses (user_id, name, amount, date, description) "
+         "VALUES (:uid, :name, :amount, :date, '')")
+
+
+def make_engine(path, tuned):
+    if not tuned:
+        # SQLAlchemy defaults: rollback journal, FULL sync, 5 s driver lock wait
+        return create_engine(f"sqlite:///{path}")
+    options = database_config({'DATABASE_URL': f"sqlite:///{path}"})['SQLALCHEMY_ENGINE_OPTIONS']
+    engine = create_engine(f"sqlite:///{path}", **options)
+    apply_sqlite_pragmas(engine, sqlite_pragmas({}))
+    return engine
+
+
+def run(engine, readers, writers, seconds, users):
+    counts = {'reads': 0, 'writes': 0, 'errors': 0}
+    read_latencies = []
+    lock = threading.Lock()
+    deadline = time.perf_counter() + seconds
+
+    def reader(seed):
+        rng = random.Random(seed)
+        while time.perf_counter() < deadline:
+            started = time.perf_counter()
+            try:
+                with engine.connect() as conn:
+                    conn.execute(text(READ), {"uid": rng.randint(1, users)}).fetchall()
+            except OperationalError:
+                with lock:
+                    counts['errors'] += 1
+                continue
+            with lock:
+                counts['reads'] += 1
+                read_latencies.append(time.perf_counter() - started)
+
+    def writer(seed):
+        rng = random.Random(seed)
+        while time.perf_counter() < deadline:
+            rows = [{"uid": rng.randint(1, users), "name": "Food", "amount": rng.randint(10, 500),
+                     "date": (date(2024, 1, 1) + timedelta(days=rng.randint(0, 365))).isoformat()}
+                    for _ in range(3)]
+            try:
+                with engine.begin() as conn:
+                    conn.execute(text(WRITE), rows)
+            except OperationalError:
+                with lock:
+                    counts['errors'] += 1
+                continue
+            with lock:
+                counts['writes'] += 1
+
+    threads = [threading.Thread(target=reader, args=(i,)) for i in range(readers)]
+    threads += [threading.Thread(target=writer, args=(1000 + i,)) for i in range(writers)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    read_latencies.sort()
+    p99 = read_latencies[int(len(read_latencies) * 0.99)] * 1000 if read_latencies else float('nan')
+    return counts, p99
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--rows", type=int, default=100000)
+    parser.add_argument("--readers", type=int, default=8)
+    parser.add_argument("--writers", type=int, default=2)
+    parser.add_argument("--seconds", type=float, default=5)
+    args = parser.parse_args()
+
+    print(f"{'profile':<10} {'reads/s':>9} {'writes/s':>9} {'read p99 ms':>12} {'errors':>7}")
+    for label, tuned in (("default", False), ("tuned", True)):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'bench.db')
+            seed_engine = create_engine(f"sqlite:///{path}")
+            populate(seed_engine, args.users, args.rows)
+            with seed_engine.begin() as conn:
+                conn.execute(text("CREATE INDEX ix_expenses_user_name ON expenses (user_id, name)"))
+            seed_engine.dispose()
+
+            engine = make_engine(path, tuned)
+            counts, p99 = run(engine, args.readers, args.writers, args.seconds, args.users)
+            engine.dispose()
+        print(f"{label:<10} {counts['reads'] / args.seconds:>9.1f} {counts['writes'] / args.seconds:>9.1f} "
+              f"{p99:>12.2f} {counts['errors']:>7}")
+
+
+if __name__ == "__main__":
+    main()
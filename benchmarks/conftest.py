@@ -0,0 +1,187 @@
+"""Opt-in pytest benchmark suite for the dashboard chart builders and reports.
+
+    FINTRACKER_BENCH=1 python -m pytest benchmarks -q
+
+Skipped unless FINTRACKER_BENCH is set. Other settings:
+
+    BENCH_SIZES          expense counts to run at (default 1000,100000,1000000)
+    BENCH_REPEAT         timed runs per case (default: 5 at <=1k rows, 3 at <=100k, else 1)
+    BENCH_OUTPUT         where to write this run's results (default benchmarks/results.json)
+    BENCH_BASELINE       results file to compare against (default benchmarks/baseline.json)
+    BENCH_THRESHOLD      allowed slowdown / memory growth vs the baseline (default 0.25 = 25%)
+    BENCH_SAVE_BASELINE  set to 1 to write this run's results as the new baseline
+
+Each case records the median and min wall time of the timed runs, plus the
+peak traced allocation (tracemalloc) of one extra untimed run. A case fails
+when it is more than BENCH_THRESHOLD slower, or uses that much more memory,
+than its baseline entry.
+"""
+import json
+import os
+import platform
+import random
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+from collections import namedtuple
+from datetime import date, datetime
+
+import pytest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import seed_data
+
+HERE = os.path.dirname(__file__)
+ENABLED = bool(os.environ.get('FINTRACKER_BENCH'))
+SIZES = [int(s) for s in os.environ.get('BENCH_SIZES', '1000,100000,1000000').split(',')]
+OUTPUT = os.environ.get('BENCH_OUTPUT', os.path.join(HERE, 'results.json'))
+BASELINE = os.environ.get('BENCH_BASELINE', os.path.join(HERE, 'baseline.json'))
+THRESHOLD = float(os.environ.get('BENCH_THRESHOLD', 0.25))
+# The window ends today: the gauges, tiles and the report's "this month"
+# section read datetime.now(), so a fixed past date would leave them empty.
+# Sizes within a run share it; the same seed gives the same shape each day.
+END = date.today()
+
+if ENABLED:
+    # The report benchmark seeds real rows; keep them out of instance/database.db
+    _db_dir = tempfile.mkdtemp(prefix='fintracker-bench-')
+    os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(_db_dir, 'bench.db')}"
+    os.environ.setdefault('BCRYPT_ROUNDS', '4')
+
+# What graphs.py reads from an Expenses row, without the ORM overhead
+ExpenseRow = namedtuple('ExpenseRow', 'name amount date description')
+
+
+def pytest_collection_modifyitems(config, items):
+    if ENABLED:
+        return
+    skip = pytest.mark.skip(reason='benchmarks are opt-in: set FINTRACKER_BENCH=1')
+    for item in items:
+        if HERE in str(item.fspath):
+            item.add_marker(skip)
+
+
+def default_repeat(size):
+    if os.environ.get('BENCH_REPEAT'):
+        return int(os.environ['BENCH_REPEAT'])
+    return 5 if size <= 1000 else 3 if size <= 100000 else 1
+
+
+class BenchRecorder:
+    def __init__(self, baseline, threshold):
+        self.baseline = baseline
+        self.threshold = threshold
+        self.results = {}
+        self.written = []
+
+    def measure(self, name, size, fn):
+        """Time fn() and trace its peak memory; fail on a regression vs the baseline."""
+        fn()  # warm-up: imports, plotly validators, SQLite page cache
+        repeat = default_repeat(size)
+        timings = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            fn()
+            timings.append(time.perf_counter() - started)
+
+        tracemalloc.start()
+        try:
+            fn()
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+
+        key = f'{name}[{size}]'
+        result = {'name': name, 'size': size, 'repeat': repeat,
+                  'seconds': statistics.median(timings), 'min_seconds': min(timings), 'peak_bytes': peak}
+        self.results[key] = result
+        self._check(key, result)
+        return result
+
+    def _check(self, key, result):
+        base = self.baseline.get(key)
+        if base is None:
+            return
+        problems = []
+        limit = 1 + self.threshold
+        if result['seconds'] > base['seconds'] * limit:
+            problems.append(f"time {result['seconds']:.4f}s vs baseline {base['seconds']:.4f}s")
+        if result['peak_bytes'] > base['peak_bytes'] * limit:
+            problems.append(f"peak memory {result['peak_bytes']:,} B vs baseline {base['peak_bytes']:,} B")
+        if problems:
+            pytest.fail(f"{key} regressed more than {self.threshold:.0%}: " + '; '.join(problems))
+
+
+def load_results(path):
+    try:
+        with open(path) as f:
+            return json.load(f)['results']
+    except (OSError, ValueError, KeyError):
+        return {}
+
+
+recorder = BenchRecorder(load_results(BASELINE), THRESHOLD)
+
+
+@pytest.fixture(scope='session')
+def bench():
+    yield recorder
+    report = {
+        'meta': {'created_at': datetime.now().isoformat(timespec='seconds'),
+                 'python': platform.python_version(), 'platform': platform.platform(),
+                 'threshold': THRESHOLD, 'baseline': BASELINE if recorder.baseline else None},
+        'results': recorder.results,
+    }
+    paths = [OUTPUT] + ([BASELINE] if os.environ.get('BENCH_SAVE_BASELINE') else [])
+    for path in paths:
+        with open(path, 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+    recorder.written = paths
+
+
+def pytest_terminal_summary(terminalreporter):
+    if not recorder.results:
+        return
+    write = terminalreporter.write_line
+    terminalreporter.section('benchmarks')
+    write(f"{'case':<36} {'median s':>10} {'peak MiB':>9} {'vs base':>8}")
+    for key, r in sorted(recorder.results.items(), key=lambda kv: (kv[1]['size'], kv[0])):
+        base = recorder.baseline.get(key)
+        change = f"{r['seconds'] / base['seconds'] - 1:+.0%}" if base else '-'
+        write(f"{key:<36} {r['seconds']:>10.4f} {r['peak_bytes'] / 2**20:>9.1f} {change:>8}")
+    write(f"results written to {', '.join(recorder.written)}")
+
+
+@pytest.fixture(scope='session')
+def expense_rows():
+    """expense_rows(size) -> a cached list of `size` synthetic expense rows."""
+    cache = {}
+
+    def rows(size):
+        if size not in cache:
+            generated = seed_data.generate_expenses(random.Random(size), 1, size, END)
+            cache[size] = [ExpenseRow(r['name'], r['amount'], r['date'], r['description']) for r in generated]
+        return cache[size]
+    return rows
+
+
+@pytest.fixture(scope='session')
+def seeded_user():
+    """seeded_user(size) -> id of a user with `size` stored expenses (via flask seed)."""
+    from app import app, User
+    cache = {}
+
+    def user_id(size):
+        if size not in cache:
+            prefix = f'bench{size}'
+            result = app.test_cli_runner().invoke(args=[
+                'seed', '--users', '1', '--expenses', str(size), '--seed', str(size),
+                '--end', END.isoformat(), '--prefix', prefix])
+            assert result.exit_code == 0, result.output
+            with app.app_context():
+                cache[size] = User.query.filter_by(email=f'{prefix}-user-1@example.com').one().id
+        return cache[size]
+    return user_id
@@ -0,0 +1,251 @@
+"""HTTP load test: many logged-in users driving mixed traffic at app.py.
+
+Against an instance you started yourself (users from `flask seed`):
+
+    flask --app app seed --users 50 --expenses 2000 --prefix load
+    python benchmarks/loadtest.py --base-url http://127.0.0.1:5000 --users 50 --prefix load
+
+Or fully offline and reproducible: --spawn seeds a temporary database,
+starts fake_openai.py in place of OpenRouter and runs the app on a free
+port, then tears everything down:
+
+    python benchmarks/loadtest.py --spawn --users 20 --clients 16 --duration 30 \\
+        --ai-latency 1.5 --ai-error-rate 0.1
+
+Each client logs in as one seeded user and picks routes by --mix weights
+from its own seeded random generator; expense_list hits mostly follow the
+"Next page" cursor of the client's previous list page. The report gives
+per-route throughput, errors and p50/p95/p99 latency; --json writes it to
+a file.
+"""
+import argparse
+import html
+import json
+import os
+import random
+import re
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import date
+
+import requests
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, ROOT)
+
+import fake_openai
+
+DEFAULT_MIX = 'dashboard=5,expense_list=3,add_expenses=2,ai=1,download_txt=1'
+NAMES = ['Food', 'Transport', 'Shopping', 'Bills', 'Fun']
+SORTS = [None, 'date', 'amount']  # what /expense_list supports (app.EXPENSE_SORT_COLUMNS) plus id order
+NEXT_PAGE = re.compile(r'href="(/expense_list[^"]*after=[^"]*)"')
+
+
+def route_request(name, rng, state):
+    """(method, path, form data) for one hit of a route in the mix.
+
+    `state` is the client's own dict; expense_list keeps the "Next page" link
+    of its last response there, since the list is paged by an `after` cursor.
+    """
+    if name == 'dashboard':
+        return 'GET', '/dashboard?render=server', None
+    if name == 'expense_list':
+        next_page = state.pop('expense_next', None)
+        if next_page and rng.random() < 0.8:
+            return 'GET', next_page, None
+        sort = rng.choice(SORTS)
+        query = f"?sort={sort}&order={rng.choice(['asc', 'desc'])}" if sort else ''
+        return 'GET', f'/expense_list{query}', None
+    if name == 'add_expenses':
+        return 'POST', '/add_expenses', {
+            'name': rng.choice(NAMES), 'amount': str(rng.randint(10, 2000)),
+            'date': date.today().isoformat(), 'desc': 'load test'}
+    if name == 'ai':
+        return 'GET', '/ai', None
+    if name == 'download_txt':
+        return 'GET', '/download_txt', None
+    raise ValueError(f'unknown route {name!r}')
+
+
+def remember_response(name, response, state):
+    if name == 'expense_list' and response.ok:
+        match = NEXT_PAGE.search(response.text)
+        if match:
+            state['expense_next'] = html.unescape(match.group(1))
+
+
+def parse_mix(text):
+    mix = {}
+    for part in text.split(','):
+        name, _, weight = part.partition('=')
+        route_request(name.strip(), random.Random(), {})  # validates the name
+        mix[name.strip()] = float(weight or 1)
+    return mix
+
+
+def percentile(ordered, pct):
+    if not ordered:
+        return float('nan')
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+
+class Stats:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencies = {}
+        self.errors = {}
+
+    def record(self, route, seconds, ok):
+        with self.lock:
+            self.latencies.setdefault(route, []).append(seconds)
+            if not ok:
+                self.errors[route] = self.errors.get(route, 0) + 1
+
+    def report(self, elapsed):
+        rows = {}
+        with self.lock:
+            for route, values in sorted(self.latencies.items()):
+                ordered = sorted(values)
+                rows[route] = {
+                    'requests': len(ordered),
+                    'rps': len(ordered) / elapsed,
+                    'errors': self.errors.get(route, 0),
+                    'p50_ms': percentile(ordered, 50) * 1000,
+                    'p95_ms': percentile(ordered, 95) * 1000,
+                    'p99_ms': percentile(ordered, 99) * 1000,
+                }
+        return rows
+
+
+def run_client(index, args, mix, deadline, stats):
+    rng = random.Random(f'{args.seed}:{index}')
+    user = index % args.users + 1
+    session = requests.Session()
+    response = session.post(f'{args.base_url}/login', allow_redirects=False, timeout=args.timeout,
+                            data={'email': f'{args.prefix}-user-{user}@example.com', 'password': args.password})
+    if response.status_code != 302:
+        stats.record('login', 0, False)
+        return
+    routes, weights = list(mix), list(mix.values())
+    state = {}
+
+    while time.perf_counter() < deadline:
+        route = rng.choices(routes, weights)[0]
+        method, path, data = route_request(route, rng, state)
+        started = time.perf_counter()
+        try:
+            response = session.request(method, args.base_url + path, data=data,
+                                       allow_redirects=False, timeout=args.timeout)
+            ok = response.status_code < 400 and not response.headers.get('Location', '').endswith('/login')
+            remember_response(route, response, state)
+        except requests.RequestException:
+            ok = False
+        stats.record(route, time.perf_counter() - started, ok)
+        if args.think_time:
+            time.sleep(rng.expovariate(1 / args.think_time))
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def spawn(args, tmp):
+    """Seed a temporary database and start a fake AI upstream plus the app."""
+    upstream = fake_openai.start_in_thread(latency=args.ai_latency, token_delay=args.ai_token_delay,
+                                           error_rate=args.ai_error_rate, seed=args.seed)
+    env = dict(os.environ,
+               DATABASE_URL=f"sqlite:///{os.path.join(tmp, 'load.db')}",
+               OPENROUTER_BASE_URL=upstream.base_url, OPENROUTER_API_KEY='load-test',
+               BCRYPT_ROUNDS=str(args.bcrypt_rounds))
+    subprocess.run([sys.executable, '-m', 'flask', '--app', 'app', 'seed', '--users', str(args.users),
+                    '--expenses', str(args.expenses), '--seed', str(args.seed), '--prefix', args.prefix,
+                    '--password', args.password], cwd=ROOT, env=env, check=True)
+
+    port = free_port()
+    app = subprocess.Popen([sys.executable, '-m', 'flask', '--app', 'app', 'run', '--port', str(port),
+                            '--with-threads', '--no-reload', '--no-debugger'],
+                           cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    args.base_url = f'http://127.0.0.1:{port}'
+    for _ in range(100):
+        try:
+            requests.get(f'{args.base_url}/login', timeout=1)
+            break
+        except requests.RequestException:
+            time.sleep(0.1)
+    else:
+        app.terminate()
+        upstream.shutdown()
+        raise SystemExit('app did not start')
+    return app, upstream
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--base-url', default='http://127.0.0.1:5000')
+    parser.add_argument('--spawn', action='store_true', help='seed and start the app and a fake AI upstream')
+    parser.add_argument('--users', type=int, default=20, help='seeded users to log in as')
+    parser.add_argument('--prefix', default='load', help='flask seed --prefix of those users')
+    parser.add_argument('--password', default='password')
+    parser.add_argument('--clients', type=int, default=16, help='concurrent clients')
+    parser.add_argument('--duration', type=float, default=30, help='seconds of traffic')
+    parser.add_argument('--mix', default=DEFAULT_MIX, help='route=weight list')
+    parser.add_argument('--think-time', type=float, default=0, help='mean pause between requests (s)')
+    parser.add_argument('--timeout', type=float, default=30, help='per-request timeout (s)')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--json', help='also write the report to this file')
+    spawned = parser.add_argument_group('--spawn options')
+    spawned.add_argument('--expenses', type=int, default=2000, help='expenses per seeded user')
+    spawned.add_argument('--ai-latency', type=float, default=1.0, help='fake upstream time to first byte (s)')
+    spawned.add_argument('--ai-token-delay', type=float, default=0.01)
+    spawned.add_argument('--ai-error-rate', type=float, default=0.0)
+    spawned.add_argument('--bcrypt-rounds', type=int, default=4, help='cheap hashes so logins are not the test')
+    args = parser.parse_args()
+    mix = parse_mix(args.mix)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        app = upstream = None
+        if args.spawn:
+            app, upstream = spawn(args, tmp)
+        try:
+            stats = Stats()
+            started = time.perf_counter()
+            deadline = started + args.duration
+            clients = [threading.Thread(target=run_client, args=(i, args, mix, deadline, stats))
+                       for i in range(args.clients)]
+            for t in clients:
+                t.start()
+            for t in clients:
+                t.join()
+            elapsed = time.perf_counter() - started
+            routes = stats.report(elapsed)
+            upstream_requests = upstream.requests if upstream else None
+        finally:
+            if app:
+                app.terminate()
+                app.wait()
+            if upstream:
+                upstream.shutdown()
+
+    print(f"{'route':<14} {'requests':>8} {'req/s':>8} {'errors':>6} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}")
+    for route, r in routes.items():
+        print(f"{route:<14} {r['requests']:>8} {r['rps']:>8.1f} {r['errors']:>6} "
+              f"{r['p50_ms']:>8.1f} {r['p95_ms']:>8.1f} {r['p99_ms']:>8.1f}")
+    total = sum(r['requests'] for r in routes.values())
+    print(f"{total} requests in {elapsed:.1f}s ({total / elapsed:.1f}/s) from {args.clients} clients")
+    if upstream_requests is not None:
+        print(f"fake AI upstream received {upstream_requests} completion requests")
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'clients': args.clients, 'duration': elapsed, 'mix': mix, 'seed': args.seed,
+                       'upstream_requests': upstream_requests, 'routes': routes}, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
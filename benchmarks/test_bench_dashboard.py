@@ -0,0 +1,37 @@
+"""Dashboard chart builders and the text report at growing expense counts.
+
+The chart builders are fed plain expense rows, so their in-Python
+aggregation is part of what is timed; the report runs against a real
+seeded database.
+"""
+import pytest
+
+from conftest import SIZES
+import graphs
+
+CHARTS = {
+    'generate_bar_chart': graphs.generate_bar_chart,
+    'generate_pie_chart': graphs.generate_pie_chart,
+    'generate_worm_chart': graphs.generate_worm_chart,
+    'generate_gauge_charts': graphs.generate_gauge_charts,
+    'generate_sparkline': graphs.generate_sparkline,
+    'get_icon_status_data': graphs.get_icon_status_data,
+}
+
+
+@pytest.mark.parametrize('size', SIZES)
+@pytest.mark.parametrize('name', list(CHARTS))
+def test_chart(bench, expense_rows, name, size):
+    rows = expense_rows(size)
+    bench.measure(name, size, lambda: CHARTS[name](rows))
+
+
+@pytest.mark.parametrize('size', SIZES)
+def test_download_txt_report(bench, seeded_user, size):
+    from app import app, build_txt_report, load_identity
+    user_id = seeded_user(size)
+    with app.app_context():
+        user, details = load_identity(user_id)
+        report = build_txt_report(user, details)
+        assert f'Total Entries: {size}' in report
+        bench.measure('download_txt', size, lambda: build_txt_report(user, details))
@@ -0,0 +1,71 @@
+"""Database settings read from the environment.
+
+    DATABASE_URL             SQLAlchemy URI (default sqlite:///database.db, in instance/)
+    DB_POOL_SIZE             pooled connections kept open (default 5)
+    DB_MAX_OVERFLOW          extra connections allowed under load (default 10)
+    DB_POOL_TIMEOUT          seconds to wait for a free connection (default 30)
+    DB_POOL_RECYCLE          seconds before a connection is replaced, server DBs only (default 1800)
+    SQLITE_BUSY_TIMEOUT_MS   how long a writer waits for the lock (default 5000)
+    SQLITE_JOURNAL_MODE      default WAL, so readers don't block on writers
+    SQLITE_SYNCHRONOUS       default NORMAL, safe with WAL and far fewer fsyncs
+    SQLITE_CACHE_SIZE_KB     page cache per connection (default 20000)
+    SQLITE_MMAP_SIZE         bytes of the file to memory-map (default 256 MiB)
+"""
+import os
+
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
+
+DEFAULT_DATABASE_URI = 'sqlite:///database.db'
+
+
+def is_memory_sqlite(uri):
+    url = make_url(uri)
+    return url.get_backend_name() == 'sqlite' and url.database in (None, '', ':memory:')
+
+
+def database_config(environ=os.environ):
+    """SQLALCHEMY_DATABASE_URI and SQLALCHEMY_ENGINE_OPTIONS for app.config."""
+    uri = environ.get('DATABASE_URL', DEFAULT_DATABASE_URI)
+    sqlite = make_url(uri).get_backend_name() == 'sqlite'
+    options = {}
+    if not is_memory_sqlite(uri):
+        # An in-memory database is one connection, so there is no pool to size
+        options.update(
+            pool_size=int(environ.get('DB_POOL_SIZE', 5)),
+            max_overflow=int(environ.get('DB_MAX_OVERFLOW', 10)),
+            pool_timeout=float(environ.get('DB_POOL_TIMEOUT', 30)),
+        )
+    if sqlite:
+        # The driver's own lock wait, matching busy_timeout below
+        options['connect_args'] = {'timeout': int(environ.get('SQLITE_BUSY_TIMEOUT_MS', 5000)) / 1000}
+    else:
+        options['pool_recycle'] = int(environ.get('DB_POOL_RECYCLE', 1800))
+        options['pool_pre_ping'] = True
+    return {'SQLALCHEMY_DATABASE_URI': uri, 'SQLALCHEMY_ENGINE_OPTIONS': options}
+
+
+def sqlite_pragmas(environ=os.environ):
+    return {
+        # busy_timeout first, so switching to WAL waits for other processes' locks
+        'busy_timeout': int(environ.get('SQLITE_BUSY_TIMEOUT_MS', 5000)),
+        'journal_mode': environ.get('SQLITE_JOURNAL_MODE', 'WAL'),
+        'synchronous': environ.get('SQLITE_SYNCHRONOUS', 'NORMAL'),
+        'cache_size': -int(environ.get('SQLITE_CACHE_SIZE_KB', 20000)),  # negative = KiB
+        'mmap_size': int(environ.get('SQLITE_MMAP_SIZE', 256 * 1024 * 1024)),
+    }
+
+
+def apply_sqlite_pragmas(engine, pragmas):
+    """Run `pragmas` on every new connection of a SQLite engine; no-op otherwise."""
+    if engine.dialect.name != 'sqlite':
+        return
+
+    @event.listens_for(engine, 'connect')
+    def set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        try:
+            for name, value in pragmas.items():
+                cursor.execute(f'PRAGMA {name}={value}')
+        finally:
+            cursor.close()
@@ -0,0 +1,172 @@
+"""A small OpenAI-compatible chat completions server for local runs and tests.
+
+    python fake_openai.py --port 8001 --latency 0.5 --token-delay 0.02
+    OPENROUTER_BASE_URL=http://127.0.0.1:8001/v1 OPENROUTER_API_KEY=test flask run
+
+Serves POST /v1/chat/completions (plain and stream=True) with a canned
+reply. `latency` is the delay before the first byte, `token_delay` the gap
+between streamed tokens and `error_rate` the share of requests answered
+with a 500 or 429, so timeouts, retries and streaming can be exercised
+without a real upstream.
+"""
+import argparse
+import json
+import random
+import re
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+DEFAULT_REPLY = (
+    "### Budget Summary\n"
+    "- You are spending close to your monthly budget.\n\n"
+    "### Suggestions\n"
+    "1. Cap your largest category for the next month.\n"
+    "2. Automate a fixed transfer to savings on payday.\n"
+)
+
+
+class FakeOpenAIHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # keep-alive, like the real API
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+    def do_GET(self):
+        if self.path.rstrip('/') in ('/v1/models', '/models'):
+            self._send_json(200, {'object': 'list', 'data': [{'id': 'fake-model', 'object': 'model'}]})
+        else:
+            self._send_json(404, {'error': {'message': 'not found'}})
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+        if self.path.rstrip('/') not in ('/v1/chat/completions', '/chat/completions'):
+            self._send_json(404, {'error': {'message': 'not found'}})
+            return
+        try:
+            payload = json.loads(body or b'{}')
+        except ValueError:
+            self._send_json(400, {'error': {'message': 'invalid JSON'}})
+            return
+
+        server = self.server
+        with server.lock:
+            server.requests += 1
+            fail = server.random.random() < server.error_rate
+        time.sleep(server.latency)
+        if fail:
+            status = server.random.choice((429, 500))
+            self._send_json(status, {'error': {'message': f'fake upstream error {status}', 'code': status}},
+                            headers={'Retry-After': '0'} if status == 429 else None)
+            return
+
+        model = payload.get('model', 'fake-model')
+        if payload.get('stream'):
+            try:
+                self._stream(model)
+            except (BrokenPipeError, ConnectionResetError):
+                self.close_connection = True  # client gave up mid-stream, as a real one may
+        else:
+            self._send_json(200, {
+                'id': f'chatcmpl-{uuid.uuid4().hex}',
+                'object': 'chat.completion',
+                'created': int(time.time()),
+                'model': model,
+                'choices': [{'index': 0, 'finish_reason': 'stop',
+                             'message': {'role': 'assistant', 'content': server.reply}}],
+                'usage': {'prompt_tokens': 0, 'completion_tokens': len(tokenize(server.reply)),
+                          'total_tokens': len(tokenize(server.reply))},
+            })
+
+    def _stream(self, model):
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+        completion_id = f'chatcmpl-{uuid.uuid4().hex}'
+
+        def chunk(delta, finish_reason=None):
+            return {'id': completion_id, 'object': 'chat.completion.chunk', 'created': int(time.time()),
+                    'model': model, 'choices': [{'index': 0, 'delta': delta, 'finish_reason': finish_reason}]}
+
+        self._write_event(chunk({'role': 'assistant', 'content': ''}))
+        for token in tokenize(self.server.reply):
+            time.sleep(self.server.token_delay)
+            self._write_event(chunk({'content': token}))
+        self._write_event(chunk({}, 'stop'))
+        self._write_chunk(b'data: [DONE]\n\n')
+        self._write_chunk(b'')
+
+    def _write_event(self, data):
+        self._write_chunk(f'data: {json.dumps(data)}\n\n'.encode())
+
+    def _write_chunk(self, data):
+        self.wfile.write(f'{len(data):x}\r\n'.encode() + data + b'\r\n')
+        self.wfile.flush()
+
+    def _send_json(self, status, data, headers=None):
+        body = json.dumps(data).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def tokenize(text):
+    return re.findall(r'\S+\s*', text)
+
+
+def make_server(host='127.0.0.1', port=0, latency=0.0, token_delay=0.0, error_rate=0.0,
+                reply=DEFAULT_REPLY, seed=None, verbose=False):
+    """Create (but don't start) a fake server; port 0 picks a free port.
+
+    The base URL for an OpenAI client is in `server.base_url`, and
+    `server.requests` counts the chat completion requests received.
+    """
+    server = ThreadingHTTPServer((host, port), FakeOpenAIHandler)
+    server.daemon_threads = True
+    server.latency = latency
+    server.token_delay = token_delay
+    server.error_rate = error_rate
+    server.reply = reply
+    server.random = random.Random(seed)
+    server.verbose = verbose
+    server.lock = threading.Lock()
+    server.requests = 0
+    server.base_url = f'http://{host}:{server.server_address[1]}/v1'
+    return server
+
+
+def start_in_thread(**kwargs):
+    """Start a fake server on a daemon thread (for tests); call .shutdown() when done."""
+    server = make_server(**kwargs)
+    threading.Thread(target=server.serve_forever, name='fake-openai', daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8001)
+    parser.add_argument('--latency', type=float, default=0.5, help='seconds before the first byte')
+    parser.add_argument('--token-delay', type=float, default=0.02, help='seconds between streamed tokens')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='share of requests that fail (0-1)')
+    parser.add_argument('--seed', type=int, default=None)
+    args = parser.parse_args()
+
+    server = make_server(args.host, args.port, args.latency, args.token_delay, args.error_rate,
+                         seed=args.seed, verbose=True)
+    print(f"Fake OpenAI server on {server.base_url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
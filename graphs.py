@@ -1,13 +1,29 @@
 import plotly.graph_objects as go # type: ignore
-from plotly.offline import plot # type: ignore
-from collections import defaultdict
+from plotly.offline import plot as plotly_plot # type: ignore
+from collections import Counter, defaultdict
+import logging
 import pandas as pd # type: ignore
 from datetime import date,datetime
+from metrics import timed
 
-def generate_bar_chart(expenses):
+log = logging.getLogger('fintracker.graphs')
+
+
+@timed('plot')
+def plot(fig, **kwargs):
+    return plotly_plot(fig, **kwargs)
+
+
+def totals_by_name(expenses):
     data = defaultdict(int)
     for e in expenses:
         data[e.name] += e.amount
+    return data
+
+
+def generate_bar_chart(expenses=None, name_totals=None):
+    # name_totals is a {name: amount} mapping, e.g. from a SQL GROUP BY
+    data = name_totals if name_totals is not None else totals_by_name(expenses)
 
     names = list(data.keys())
     amounts = list(data.values())
@@ -25,11 +41,8 @@ def generate_bar_chart(expenses):
 
     return plot(fig,output_type='div', include_plotlyjs = False)
 
-def generate_pie_chart(expenses):
-
-    data = defaultdict(int)
-    for e in expenses:
-        data[e.name] += e.amount
+def generate_pie_chart(expenses=None, name_totals=None):
+    data = name_totals if name_totals is not None else totals_by_name(expenses)
 
     labels = list(data.keys())
     values = list(data.values())
@@ -55,11 +68,12 @@ def generate_pie_chart(expenses):
 
 
 
-def generate_worm_chart(expenses):
+@timed('pandas')
+def totals_by_year(expenses):
     # Filter valid dates
     valid_expenses = [e for e in expenses if isinstance(e.date, date) and e.date.year > 1900]
     if not valid_expenses:
-        return "<div>No valid data to display.</div>"
+        return {}
 
     # Create DataFrame
     df = pd.DataFrame({
@@ -69,10 +83,23 @@ def generate_worm_chart(expenses):
 
     df['year'] = df['date'].apply(lambda d: int(d.year))
     grouped = df.groupby('year', as_index=False)['amount'].sum()
+    return dict(zip(grouped['year'], grouped['amount']))
 
-    # Debug
-    print("DEBUG - Final Grouped Data:")
-    print(grouped)
+
+def generate_worm_chart(expenses=None, yearly_totals=None):
+    # yearly_totals is a {year: amount} mapping, e.g. from a SQL GROUP BY
+    if yearly_totals is None:
+        yearly_totals = totals_by_year(expenses)
+    yearly_totals = {int(y): float(a) for y, a in yearly_totals.items() if y and int(y) > 1900}
+    if not yearly_totals:
+        return "<div>No valid data to display.</div>"
+
+    with timed('pandas'):
+        grouped = pd.DataFrame({
+            'year': sorted(yearly_totals),
+            'amount': [yearly_totals[y] for y in sorted(yearly_totals)]
+        })
+    log.debug("worm chart data", extra={'yearly_totals': yearly_totals})
 
     # Create Scatter trace
     trace = go.Scatter(
@@ -194,8 +221,13 @@ def create_gauge(title, value, budget_limit=50000, width=150, height=150, ref=No
     return plot(fig, output_type='div', include_plotlyjs=False)
 
 
-def generate_gauge_charts(expenses, monthly_budget_limit=5000):
-    now = datetime.now()
+def previous_month(now):
+    return (now.year - 1, 12) if now.month == 1 else (now.year, now.month - 1)
+
+
+@timed('pandas')
+def month_totals(expenses, now=None):
+    now = now or datetime.now()
     df = pd.DataFrame([{
         'name': e.name,
         'amount': e.amount,
@@ -203,46 +235,69 @@ def generate_gauge_charts(expenses, monthly_budget_limit=5000):
     } for e in expenses if e.date.year >= now.year - 1])
 
     if df.empty:
-        return "<div>No gauge data available.</div>", "", ""
+        return None
 
     df['date'] = pd.to_datetime(df['date'], errors='coerce')
     df.dropna(subset=['date'], inplace=True)
     df['month'] = df['date'].dt.month
     df['year'] = df['date'].dt.year
 
-    curr_month = df[(df['year'] == now.year) & (df['month'] == now.month)]['amount'].sum()
-    last_month = df[(df['year'] == now.year) & (df['month'] == now.month - 1)]['amount'].sum()
-    curr_year = df[df['year'] == now.year]['amount'].sum()
+    last_year, last_month = previous_month(now)
+    return {
+        'this_month': df[(df['year'] == now.year) & (df['month'] == now.month)]['amount'].sum(),
+        'last_month': df[(df['year'] == last_year) & (df['month'] == last_month)]['amount'].sum(),
+        'this_year': df[df['year'] == now.year]['amount'].sum(),
+    }
+
 
-    # ✅ 1. Large gauge for "This Month" WITH budget
-    gauge_this_month = create_gauge("This Month", curr_month, monthly_budget_limit,
-                                    width=386, height=170, show_budget=True)
+GAUGES = ('this_month', 'this_year', 'month_vs_last')
 
-    # ✅ 2. Small gauge for "This Year" (no budget)
-    gauge_this_year = create_gauge("This Year", curr_year, curr_year,
-                                   width=180, height=135, show_budget=False)
 
+def generate_gauge(kind, totals, monthly_budget_limit=5000):
+    """Render one of the three dashboard gauges from month totals."""
+    curr_month = totals['this_month']
+    last_month = totals['last_month']
+    curr_year = totals['this_year']
+
+    if kind == 'this_month':
+        # ✅ 1. Large gauge for "This Month" WITH budget
+        return create_gauge("This Month", curr_month, monthly_budget_limit,
+                            width=386, height=170, show_budget=True)
+    if kind == 'this_year':
+        # ✅ 2. Small gauge for "This Year" (no budget)
+        return create_gauge("This Year", curr_year, curr_year,
+                            width=180, height=135, show_budget=False)
     # ✅ 3. Small gauge for "Month vs Last"
-    gauge_month_vs_last = create_gauge("Month vs Last", curr_month,
-                                       max(curr_month, last_month, 10000),
-                                       width=180, height=135,
-                                       ref=last_month,
-                                        show_budget=False)
+    return create_gauge("Month vs Last", curr_month,
+                        max(curr_month, last_month, 10000),
+                        width=180, height=135,
+                        ref=last_month,
+                        show_budget=False)
+
 
-    return gauge_this_month, gauge_this_year, gauge_month_vs_last
+def generate_gauge_charts(expenses=None, monthly_budget_limit=5000, totals=None):
+    # totals is a {'this_month', 'last_month', 'this_year'} mapping of sums
+    if totals is None:
+        totals = month_totals(expenses)
+
+    if not totals:
+        return "<div>No gauge data available.</div>", "", ""
+
+    return tuple(generate_gauge(kind, totals, monthly_budget_limit) for kind in GAUGES)
 
 
 def generate_sparkline(expenses):
-    df = pd.DataFrame([{
-        'amount': e.amount,
-        'date': e.date
-    } for e in expenses])
+    with timed('pandas'):
+        df = pd.DataFrame([{
+            'amount': e.amount,
+            'date': e.date
+        } for e in expenses])
 
-    if df.empty:
-        return "<div>No data for sparkline.</div>"
+        if df.empty:
+            return "<div>No data for sparkline.</div>"
 
-    df['date'] = pd.to_datetime(df['date'])
-    df.sort_values('date', inplace=True)
+        df['date'] = pd.to_datetime(df['date'])
+        df.sort_values('date', inplace=True)
 
     fig = go.Figure()
     fig.add_trace(go.Scatter(
@@ -266,21 +321,31 @@ def generate_sparkline(expenses):
     return plot(fig, output_type='div', include_plotlyjs=False)
 
 
-def get_icon_status_data(expenses, monthly_budget=25000):
-    from collections import Counter
-    from datetime import datetime
+def month_breakdown(expenses, now=None):
+    now = now or datetime.now()
+    breakdown = {}
+    for e in expenses:
+        if e.date.month == now.month and e.date.year == now.year:
+            total, count = breakdown.get(e.name, (0, 0))
+            breakdown[e.name] = (total + e.amount, count + 1)
+    return breakdown
+
+
+def get_icon_status_data(expenses=None, monthly_budget=25000, breakdown=None):
+    # breakdown is a {name: (total, count)} mapping for the current month
+    if breakdown is None:
+        breakdown = month_breakdown(expenses)
 
     now = datetime.now()
-    this_month_exp = [e for e in expenses if e.date.month == now.month and e.date.year == now.year]
-    total_spent = sum(e.amount for e in this_month_exp)
-    num_txns = len(this_month_exp)
+    total_spent = sum(total for total, _ in breakdown.values())
+    num_txns = sum(count for _, count in breakdown.values())
     daily_avg = round(total_spent / now.day, 2) if now.day else 0
 
     # Top category this month
-    cat_counter = Counter(e.name for e in this_month_exp)
+    cat_counter = Counter({name: count for name, (_, count) in breakdown.items()})
     top_category = cat_counter.most_common(1)
     top_cat_name = top_category[0][0] if top_category else "N/A"
-    top_cat_total = sum(e.amount for e in this_month_exp if e.name == top_cat_name)
+    top_cat_total = breakdown[top_cat_name][0] if top_category else 0
 
     budget_diff = total_spent - monthly_budget
     budget_status = f"₹{abs(budget_diff):,.0f} {'over 🔴' if budget_diff > 0 else 'under 🟢'}"
@@ -297,3 +362,38 @@ def get_icon_status_data(expenses, monthly_budget=25000):
         {"icon": "🎯", "label": "Budget Status", "value": budget_status},
         {"icon": "🔁", "label": "Most Frequent", "value": f"{freq_cat_name} ({freq_cat_count}×)"}
     ]
+
+
+# --- Compact payloads for client-side rendering (see static/charts.js) ---
+# Each payload names a layout id defined in charts.js and carries only the
+# data arrays, so the themes and gauge settings are shipped to the browser once.
+
+def _number(value):
+    return float(value) if value is not None else 0
+
+
+def bar_chart_data(name_totals):
+    return {'layout': 'bar', 'x': list(name_totals), 'y': [_number(v) for v in name_totals.values()]}
+
+
+def pie_chart_data(name_totals):
+    return {'layout': 'pie', 'labels': list(name_totals), 'values': [_number(v) for v in name_totals.values()]}
+
+
+def worm_chart_data(yearly_totals):
+    years = sorted(int(y) for y in yearly_totals if y and int(y) > 1900)
+    if not years:
+        return None
+    return {'layout': 'worm', 'x': years, 'y': [_number(yearly_totals[y]) for y in years]}
+
+
+def gauge_chart_data(totals, monthly_budget_limit=5000):
+    if not totals:
+        return None
+    curr_month, last_month, curr_year = (_number(totals[k]) for k in ('this_month', 'last_month', 'this_year'))
+    return {
+        'this_month': {'layout': 'gauge_month', 'value': curr_month, 'budget': _number(monthly_budget_limit)},
+        'this_year': {'layout': 'gauge_small', 'title': 'This Year', 'value': curr_year, 'budget': curr_year},
+        'month_vs_last': {'layout': 'gauge_small', 'title': 'Month vs Last', 'value': curr_month,
+                          'budget': max(curr_month, last_month, 10000), 'ref': last_month},
+    }
@@ -0,0 +1,55 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class IdentityCache:
+    """Short-lived per-process cache of the logged-in user's rows.
+
+    Entries expire after `ttl` seconds and are dropped explicitly once a
+    bump of the user's data version commits, so within one process a write is
+    visible on the next request; other processes catch up within the TTL.
+    A ttl of 0 disables the cache.
+    """
+
+    def __init__(self, ttl, max_entries=10000):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, user_id):
+        if not self.ttl:
+            return None
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is None or time.monotonic() - entry[1] >= self.ttl:
+                self._entries.pop(user_id, None)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(user_id)
+            self.hits += 1
+            return entry[0]
+
+    def set(self, user_id, value):
+        if not self.ttl:
+            return
+        with self._lock:
+            self._entries[user_id] = (value, time.monotonic())
+            self._entries.move_to_end(user_id)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, user_id):
+        with self._lock:
+            self._entries.pop(user_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            return {'entries': len(self._entries), 'hits': self.hits, 'misses': self.misses}
@@ -0,0 +1,50 @@
+import json
+import logging
+import sys
+from datetime import datetime, timezone
+
+# Attributes every LogRecord has; anything else came in through `extra=`
+_STANDARD = set(vars(logging.makeLogRecord({}))) | {'message', 'asctime'}
+
+
+def record_fields(record):
+    return {k: v for k, v in vars(record).items() if k not in _STANDARD}
+
+
+class JSONFormatter(logging.Formatter):
+    """One JSON object per line: time, level, logger, message and any `extra` fields."""
+
+    def format(self, record):
+        entry = {
+            'time': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+            **record_fields(record),
+        }
+        if record.exc_info:
+            entry['exc_info'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+class KeyValueFormatter(logging.Formatter):
+    """Readable lines with the `extra` fields appended as key=value pairs."""
+
+    def __init__(self):
+        super().__init__('%(asctime)s %(levelname)s %(name)s %(message)s')
+
+    def format(self, record):
+        line = super().format(record)
+        fields = ' '.join(f'{k}={v!r}' if isinstance(v, str) and ' ' in v else f'{k}={v}'
+                          for k, v in record_fields(record).items())
+        return f'{line} {fields}' if fields else line
+
+
+def configure_logging(level='INFO', fmt='text', stream=None):
+    """Send the app's loggers to stderr as text (key=value) or JSON lines."""
+    handler = logging.StreamHandler(stream or sys.stderr)
+    handler.setFormatter(JSONFormatter() if fmt == 'json' else KeyValueFormatter())
+    root = logging.getLogger('fintracker')
+    root.handlers[:] = [handler]
+    root.setLevel(level.upper() if isinstance(level, str) else level)
+    return root
@@ -0,0 +1,149 @@
+"""Per-request stage timing (Server-Timing) and Prometheus-text metrics.
+
+A request gets a RequestTiming on flask.g; code wraps its expensive parts in
+`with timed('plot'):` (or uses it as a decorator) and the time lands in that
+stage. SQL is timed by engine events, templates by Flask's render signals.
+Outside a request (CLI, worker threads) timed() does nothing.
+"""
+import threading
+import time
+from collections import defaultdict
+from contextlib import ContextDecorator
+
+from flask import g, has_request_context
+from sqlalchemy import event
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class RequestTiming:
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.stages = {}  # name -> [seconds, count]
+
+    def add(self, stage, seconds):
+        entry = self.stages.setdefault(stage, [0.0, 0])
+        entry[0] += seconds
+        entry[1] += 1
+
+    def elapsed(self):
+        return time.perf_counter() - self.started
+
+    def server_timing(self, total):
+        """The Server-Timing header value, durations in milliseconds."""
+        parts = [f'{stage};dur={seconds * 1000:.1f};desc="{count}x"'
+                 for stage, (seconds, count) in self.stages.items()]
+        parts.append(f'total;dur={total * 1000:.1f}')
+        return ', '.join(parts)
+
+
+def current_timing():
+    return g.get('timing') if has_request_context() else None
+
+
+class timed(ContextDecorator):
+    """Add the time spent in a block (or function) to the current request's `stage`."""
+
+    def __init__(self, stage):
+        self.stage = stage
+        self._started = threading.local()
+
+    def __enter__(self):
+        self._started.value = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        timing = current_timing()
+        if timing is not None:
+            timing.add(self.stage, time.perf_counter() - self._started.value)
+        return False
+
+
+def instrument_engine(engine, stage='sql'):
+    """Time every statement run on `engine` during a request."""
+
+    @event.listens_for(engine, 'before_cursor_execute')
+    def before(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('query_started', []).append(time.perf_counter())
+
+    @event.listens_for(engine, 'after_cursor_execute')
+    def after(conn, cursor, statement, parameters, context, executemany):
+        started = conn.info['query_started'].pop()
+        timing = current_timing()
+        if timing is not None:
+            timing.add(stage, time.perf_counter() - started)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(names, values, extra=None):
+    pairs = list(zip(names, values)) + ([extra] if extra else [])
+    return '{' + ','.join(f'{k}="{_escape(v)}"' for k, v in pairs) + '}' if pairs else ''
+
+
+def _number(value):
+    return '+Inf' if value == float('inf') else repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Histogram:
+    def __init__(self, name, help, labels, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(labels)
+        self.buckets = tuple(buckets)
+        self._series = {}  # label values -> [bucket counts..., sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, labels, value):
+        key = tuple(labels)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0] * len(self.buckets) + [0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            series = sorted(self._series.items())
+        for key, values in series:
+            for bound, count in zip(self.buckets, values):
+                lines.append(f'{self.name}_bucket{_labels(self.label_names, key, ("le", _number(bound)))} {count}')
+            lines.append(f'{self.name}_bucket{_labels(self.label_names, key, ("le", "+Inf"))} {values[-1]}')
+            lines.append(f'{self.name}_sum{_labels(self.label_names, key)} {_number(values[-2])}')
+            lines.append(f'{self.name}_count{_labels(self.label_names, key)} {values[-1]}')
+        return lines
+
+
+class Metrics:
+    """Request and stage histograms plus whatever gauges/counters the app reports."""
+
+    def __init__(self, prefix='fintracker', buckets=DEFAULT_BUCKETS):
+        self.prefix = prefix
+        self.requests = Histogram(f'{prefix}_request_duration_seconds', 'Time to produce a response.',
+                                  ('route', 'method', 'status'), buckets)
+        self.stages = Histogram(f'{prefix}_stage_duration_seconds', 'Time per request spent in each stage.',
+                                ('route', 'stage'), buckets)
+
+    def observe(self, route, method, status, total, timing):
+        self.requests.observe((route, method, status), total)
+        for stage, (seconds, _) in timing.stages.items():
+            self.stages.observe((route, stage), seconds)
+
+    def render(self, samples=()):
+        """Prometheus text: the histograms, then `samples` of (name, type, help, labels, value)."""
+        lines = self.requests.render() + self.stages.render()
+        grouped = defaultdict(list)
+        for name, kind, help, labels, value in samples:
+            grouped[(f'{self.prefix}_{name}', kind, help)].append((labels, value))
+        for (name, kind, help), series in grouped.items():
+            lines += [f'# HELP {name} {help}', f'# TYPE {name} {kind}']
+            for labels, value in series:
+                lines.append(f'{name}{_labels(labels.keys(), labels.values())} {_number(value)}')
+        return '\n'.join(lines) + '\n'
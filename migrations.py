@@ -0,0 +1,196 @@
+from contextlib import contextmanager
+from datetime import datetime
+from sqlalchemy import (Column, DateTime, ForeignKey, Integer, MetaData, String, Table, Text,
+                        column, extract, func, inspect, select, table, text)
+
+# Versioned schema migrations. db.create_all() only creates missing tables,
+# so anything that changes an existing table (indexes, new columns) goes here.
+# Each migration runs in its own transaction and is recorded in schema_version.
+# Every worker process migrates at startup, so each transaction first takes a
+# database-wide write lock and re-reads the version (see schema_lock).
+
+MIGRATIONS = []
+
+
+def migration(version, description):
+    def decorator(fn):
+        MIGRATIONS.append((version, description, fn))
+        MIGRATIONS.sort(key=lambda m: m[0])
+        return fn
+    return decorator
+
+
+def dialect_insert(dialect_name):
+    """INSERT construct with on_conflict_do_update() for the given dialect."""
+    if dialect_name == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert
+    return insert
+
+
+def has_column(conn, table, column):
+    return any(c['name'] == column for c in inspect(conn).get_columns(table))
+
+
+def needs_column(conn, table, column):
+    # A missing table is left to db.create_all(), which creates it complete
+    return inspect(conn).has_table(table) and not has_column(conn, table, column)
+
+
+@migration(1, "Composite indexes on expenses")
+def add_expense_indexes(conn):
+    conn.execute(text("CREATE INDEX IF NOT EXISTS ix_expenses_user_date ON expenses (user_id, date)"))
+    conn.execute(text("CREATE INDEX IF NOT EXISTS ix_expenses_user_amount ON expenses (user_id, amount)"))
+    conn.execute(text("CREATE INDEX IF NOT EXISTS ix_expenses_user_name ON expenses (user_id, name)"))
+
+
+@migration(2, "Monthly rollup table backfilled from expenses")
+def add_monthly_rollup(conn):
+    metadata = MetaData()
+    Table('user', metadata, Column('id', Integer, primary_key=True))  # FK target only
+    rollup = Table(
+        'monthly_rollup', metadata,
+        Column('user_id', Integer, ForeignKey('user.id'), primary_key=True),
+        Column('year', Integer, primary_key=True),
+        Column('month', Integer, primary_key=True),
+        Column('name', String(100), primary_key=True),
+        Column('total', Integer, nullable=False, default=0),
+        Column('count', Integer, nullable=False, default=0),
+    )
+    rollup.create(conn, checkfirst=True)
+
+    expenses = table('expenses', column('id'), column('user_id'), column('name'),
+                     column('amount'), column('date'))
+    year, month = extract('year', expenses.c.date), extract('month', expenses.c.date)
+    conn.execute(rollup.delete())
+    conn.execute(rollup.insert().from_select(
+        ['user_id', 'year', 'month', 'name', 'total', 'count'],
+        select(expenses.c.user_id, year, month, expenses.c.name,
+               func.sum(expenses.c.amount), func.count(expenses.c.id))
+        .group_by(expenses.c.user_id, year, month, expenses.c.name)
+    ))
+
+
+@migration(3, "Per-user data version")
+def add_user_data_version(conn):
+    if needs_column(conn, 'user', 'data_version'):
+        conn.execute(text('ALTER TABLE "user" ADD COLUMN data_version INTEGER NOT NULL DEFAULT 0'))
+
+
+@migration(4, "Idempotency keys on expenses")
+def add_expense_idempotency_key(conn):
+    if needs_column(conn, 'expenses', 'idempotency_key'):
+        conn.execute(text("ALTER TABLE expenses ADD COLUMN idempotency_key VARCHAR(64)"))
+    conn.execute(text(
+        "CREATE UNIQUE INDEX IF NOT EXISTS ux_expenses_user_idempotency_key "
+        "ON expenses (user_id, idempotency_key)"
+    ))
+
+
+@migration(5, "AI result store")
+def add_ai_results(conn):
+    Table(
+        'ai_results', MetaData(),
+        Column('user_id', Integer, primary_key=True),
+        Column('data_hash', String(64), nullable=False),
+        Column('response', Text, nullable=False),
+        Column('created_at', DateTime, nullable=False),
+    ).create(conn, checkfirst=True)
+
+
+@migration(6, "Rendered HTML for AI results")
+def add_ai_result_html(conn):
+    if needs_column(conn, 'ai_results', 'html'):
+        conn.execute(text("ALTER TABLE ai_results ADD COLUMN html TEXT"))
+
+
+@migration(7, "Content-addressed AI responses shared between users")
+def split_ai_results(conn):
+    metadata = MetaData()
+    responses = Table(
+        'ai_responses', metadata,
+        Column('digest', String(64), primary_key=True),
+        Column('response', Text, nullable=False),
+        Column('html', Text, nullable=True),
+        Column('created_at', DateTime, nullable=False),
+        Column('last_used_at', DateTime, nullable=False, index=True),
+    )
+    user_results = Table(
+        'ai_user_results', metadata,
+        Column('user_id', Integer, primary_key=True),
+        Column('data_hash', String(64), nullable=False),
+        Column('digest', String(64), nullable=False, index=True),
+    )
+    metadata.create_all(conn)
+
+    if not inspect(conn).has_table('ai_results'):
+        return
+    # Old per-user rows become responses keyed by their data hash, so they
+    # keep being shown until the user's next analysis replaces them
+    old = table('ai_results', column('user_id'), column('data_hash'), column('response'),
+                column('html'), column('created_at'))
+    conn.execute(responses.insert().from_select(
+        ['digest', 'response', 'html', 'created_at', 'last_used_at'],
+        select(old.c.data_hash, func.max(old.c.response), func.max(old.c.html),
+               func.max(old.c.created_at), func.max(old.c.created_at)).group_by(old.c.data_hash)
+    ))
+    conn.execute(user_results.insert().from_select(
+        ['user_id', 'data_hash', 'digest'], select(old.c.user_id, old.c.data_hash, old.c.data_hash)
+    ))
+    conn.execute(text("DROP TABLE ai_results"))
+
+
+def _ensure_version_table(conn):
+    conn.execute(text(
+        "CREATE TABLE IF NOT EXISTS schema_version ("
+        "version INTEGER PRIMARY KEY, description VARCHAR(200), applied_at VARCHAR(32))"
+    ))
+
+
+def _lock(conn):
+    if conn.dialect.name == 'sqlite':
+        # Take the write lock now rather than at the first write, so two
+        # processes can't both read the same version and then both migrate
+        conn.exec_driver_sql("BEGIN IMMEDIATE")
+    elif conn.dialect.name == 'postgresql':
+        conn.execute(text("SELECT pg_advisory_xact_lock(724311)"))
+
+
+@contextmanager
+def schema_lock(engine):
+    """A transaction holding the schema write lock; concurrent callers wait their turn."""
+    with engine.begin() as conn:
+        _lock(conn)
+        yield conn
+
+
+def current_version(engine):
+    with engine.begin() as conn:
+        _ensure_version_table(conn)
+        return _read_version(conn)
+
+
+def _read_version(conn):
+    return conn.execute(text("SELECT COALESCE(MAX(version), 0) FROM schema_version")).scalar()
+
+
+def run_migrations(engine):
+    """Apply every pending migration in order and return the versions applied.
+
+    Safe to run from several processes at once: each migration re-checks the
+    version under the lock, so whoever gets there second skips it.
+    """
+    applied = []
+    for number, description, fn in MIGRATIONS:
+        with schema_lock(engine) as conn:
+            _ensure_version_table(conn)
+            if number <= _read_version(conn):
+                continue
+            fn(conn)
+            conn.execute(
+                text("INSERT INTO schema_version (version, description, applied_at) VALUES (:v, :d, :t)"),
+                {"v": number, "d": description, "t": datetime.now().isoformat(timespec='seconds')}
+            )
+        applied.append(number)
+    return applied
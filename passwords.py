@@ -0,0 +1,57 @@
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import bcrypt
+
+_COST = re.compile(r'^\$2[abxy]?\$(\d{2})\$')
+
+
+class HasherBusy(Exception):
+    """More hashes are waiting than max_pending allows."""
+
+
+def hash_cost(hashed):
+    """The bcrypt cost factor of a stored hash, or None if it isn't one."""
+    match = _COST.match(hashed or '')
+    return int(match.group(1)) if match else None
+
+
+class PasswordHasher:
+    """bcrypt hashing on a small bounded thread pool.
+
+    bcrypt releases the GIL, so at most `max_workers` hashes burn CPU at once
+    no matter how many requests are logging in; the rest queue. Once
+    `max_pending` are queued or running, hash()/check() wait up to
+    `queue_timeout` seconds for a slot and then raise HasherBusy, so a login
+    storm is shed instead of piling up behind the pool.
+    """
+
+    def __init__(self, rounds=12, max_workers=2, max_pending=64, queue_timeout=5):
+        self.rounds = rounds
+        self.max_workers = max_workers
+        self.queue_timeout = queue_timeout
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='bcrypt')
+        self._slots = threading.BoundedSemaphore(max_pending)
+
+    def hash(self, password):
+        salt = bcrypt.gensalt(self.rounds)
+        return self._run(bcrypt.hashpw, password.encode('utf-8'), salt).decode('utf-8')
+
+    def check(self, password, hashed):
+        return self._run(bcrypt.checkpw, password.encode('utf-8'), hashed.encode('utf-8'))
+
+    def needs_rehash(self, hashed):
+        cost = hash_cost(hashed)
+        return cost is not None and cost != self.rounds
+
+    def _run(self, fn, *args):
+        if not self._slots.acquire(timeout=self.queue_timeout):
+            raise HasherBusy()
+        try:
+            return self._executor.submit(fn, *args).result()
+        finally:
+            self._slots.release()
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False)
@@ -0,0 +1,99 @@
+"""Deterministic synthetic users and expenses for load testing (`flask seed`).
+
+Every value comes from the random.Random the caller passes in, so the same
+seed always produces the same rows and benchmark runs can be compared.
+"""
+import bisect
+import itertools
+import math
+from datetime import date, timedelta
+
+# name: (share of transactions, median amount, spread of log(amount), descriptions)
+CATEGORIES = {
+    'Food':      (0.32, 250, 0.7, ['lunch', 'groceries', 'dinner out', 'coffee', '']),
+    'Transport': (0.18, 120, 0.8, ['bus', 'metro', 'cab', 'fuel', '']),
+    'Shopping':  (0.12, 1200, 1.0, ['clothes', 'electronics', 'gift', '']),
+    'Bills':     (0.10, 1500, 0.5, ['electricity', 'phone', 'internet', 'water']),
+    'Fun':       (0.10, 600, 0.9, ['movie', 'concert', 'games', '']),
+    'Health':    (0.06, 800, 1.1, ['pharmacy', 'doctor', 'gym', '']),
+    'Travel':    (0.04, 6000, 1.0, ['flight', 'hotel', 'train', '']),
+    'Education': (0.03, 2500, 0.8, ['books', 'course', '']),
+}
+# Rent: one fixed payment per month, in its first RENT_DAYS days
+RENT_DAYS = 5
+
+OCCUPATIONS = ['Engineer', 'Teacher', 'Designer', 'Nurse', 'Student', 'Accountant', 'Sales', 'Freelancer']
+LOCATIONS = ['Bengaluru', 'Mumbai', 'Delhi', 'Pune', 'Chennai', 'Hyderabad', 'Kolkata']
+GOALS = ['Build an emergency fund', 'Save for a house', 'Pay off a loan', 'Travel more', 'Retire early']
+
+
+def generate_user(rng, index, prefix='seed'):
+    """A user's name, email and profile fields; income is log-normal around 9 lakh."""
+    annual_income = round(rng.lognormvariate(math.log(900000), 0.5), -3)
+    return {
+        'name': f'{prefix.title()} User {index}',
+        'email': f'{prefix}-user-{index}@example.com',
+        'annual_income': annual_income,
+        'monthly_budget': round(annual_income / 12 * rng.uniform(0.4, 0.8), -2),
+        'occupation': rng.choice(OCCUPATIONS),
+        'age': rng.randint(21, 65),
+        'location': rng.choice(LOCATIONS),
+        'financial_goal': rng.choice(GOALS),
+    }
+
+
+def rent_dates(rng, start, end):
+    """One rent day per month from `start` to `end`, kept inside that window."""
+    dates = []
+    month = date(start.year, start.month, 1)
+    while month <= end:
+        dates.append(min(end, max(start, month.replace(day=rng.randint(1, RENT_DAYS)))))
+        month = date(month.year + month.month // 12, month.month % 12 + 1, 1)
+    return dates
+
+
+def generate_expenses(rng, user_id, count, end, months=24):
+    """Yield `count` expense dicts for one user over the `months` before `end`.
+
+    Category frequencies and log-normal amounts follow CATEGORIES; rent is a
+    fixed amount paid once a month, early in it (only the latest months get
+    one if `count` is too small for all). Dates are spread over the window,
+    weighted towards weekends, so per-month totals look like real spending.
+    """
+    start = end - timedelta(days=round(months * 30.44))
+    days = [start + timedelta(days=d) for d in range((end - start).days + 1)]
+    last = len(days) - 1
+    names = list(CATEGORIES)
+    cumulative = list(itertools.accumulate(CATEGORIES[n][0] for n in names))
+    params = [(n, math.log(CATEGORIES[n][1]), CATEGORIES[n][2], CATEGORIES[n][3]) for n in names]
+    rent = int(round(rng.lognormvariate(math.log(15000), 0.4), -2))
+    rents = rent_dates(rng, start, end)
+    rents = rents[len(rents) - min(count, len(rents)):]
+    # Spread the rent rows evenly through the output
+    rent_rows = {i * count // len(rents): day for i, day in enumerate(rents)} if rents else {}
+    random_, lognormvariate = rng.random, rng.lognormvariate
+
+    for i in range(count):
+        if i in rent_rows:
+            yield {'user_id': user_id, 'name': 'Rent', 'amount': rent,
+                   'date': rent_rows[i], 'description': 'monthly rent'}
+            continue
+        name, mu, sigma, descriptions = params[bisect.bisect(cumulative, random_() * cumulative[-1])]
+        index = int(random_() * last)
+        weekday = days[index].weekday()
+        if weekday < 5 and random_() < 0.3:
+            index = min(last, index + 5 - weekday)  # nudge towards the weekend
+        yield {'user_id': user_id, 'name': name,
+               'amount': max(1, int(lognormvariate(mu, sigma))),
+               'date': days[index], 'description': descriptions[int(random_() * len(descriptions))]}
+
+
+def batched(rows, size):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
@@ -0,0 +1,32 @@
+// Follows /ai/stream while a new analysis is being generated: tokens are shown
+// as plain text as they arrive, then replaced by the server-rendered HTML.
+
+export function streamAnalysis(url, output, refreshed) {
+  const source = new EventSource(url);
+  let text = '';
+
+  source.addEventListener('token', (event) => {
+    if (!text) output.classList.add('streaming');
+    text += JSON.parse(event.data).text;
+    output.textContent = text;
+  });
+
+  source.addEventListener('done', (event) => {
+    const { html, refreshed: at } = JSON.parse(event.data);
+    output.classList.remove('streaming');
+    output.innerHTML = html;
+    if (refreshed && at) refreshed.textContent = `Last refreshed: ${at}`;
+    source.close();
+  });
+
+  // Server-sent `error` events carry a message; connection errors don't
+  source.addEventListener('error', (event) => {
+    source.close();
+    if (event.data) {
+      const note = document.createElement('p');
+      note.className = 'stream-error';
+      note.textContent = JSON.parse(event.data).message;
+      output.prepend(note);
+    }
+  });
+}
@@ -0,0 +1,128 @@
+// Client-side rendering for the dashboard charts.
+// The server sends compact data payloads (see graphs.py *_chart_data) that
+// name one of the layouts below; the themes live here so they are cached once.
+
+const THEME = {
+  paper_bgcolor: '#1a3d63',
+  plot_bgcolor: '#1a3d63',
+  font: { color: 'white' },
+};
+
+const AXIS = {
+  tickfont: { size: 10, color: 'white' },
+  showgrid: true,
+  gridcolor: 'rgba(255, 255, 255, 0.12)',
+  gridwidth: 1,
+  zeroline: true,
+  zerolinecolor: 'white',
+  zerolinewidth: 2,
+  linecolor: 'white',
+  linewidth: 2,
+};
+
+const GAUGE_MAX = 50000;
+
+function formatRupees(value) {
+  return Math.round(value).toLocaleString('en-IN');
+}
+
+function gauge({ title, value, budget, ref, showBudget, width, height }) {
+  let subtitle = '';
+  if (showBudget) {
+    const diff = value - budget;
+    const usedPct = budget ? (value / budget) * 100 : 0;
+    subtitle = diff > 0
+      ? `<br><span style='font-size:11px;color:red;'>📈 ₹${formatRupees(diff)} over (${usedPct.toFixed(1)}%)</span>`
+      : `<br><span style='font-size:11px;color:lime;'>📉 ₹${formatRupees(Math.abs(diff))} under (${usedPct.toFixed(1)}%)</span>`;
+  }
+  const trace = {
+    type: 'indicator',
+    mode: ref !== undefined ? 'gauge+number+delta' : 'gauge+number',
+    value,
+    title: { text: `<b>${title}</b>${subtitle}`, font: { size: 13, color: 'white' } },
+    domain: { x: [0, 1], y: [0, 1] },
+    gauge: {
+      axis: { range: [0, GAUGE_MAX], tickwidth: 1, tickcolor: 'white' },
+      bar: { color: value <= budget ? 'lime' : 'red', thickness: 0.55 },
+      bgcolor: 'white',
+      steps: [],
+    },
+  };
+  if (ref !== undefined) {
+    trace.delta = {
+      reference: ref,
+      increasing: { color: 'red', symbol: '▲' },
+      decreasing: { color: 'lime', symbol: '▼' },
+      valueformat: ',',
+    };
+  }
+  if (showBudget) {
+    trace.gauge.threshold = { line: { color: 'blue', width: 3 }, thickness: 0.75, value: budget };
+  }
+  const layout = { ...THEME, margin: { t: 50, b: 20, l: 10, r: 10 }, width, height };
+  return [[trace], layout];
+}
+
+export const LAYOUTS = {
+  bar: (d) => [
+    [{ type: 'bar', x: d.x, y: d.y, marker: { color: 'cyan' } }],
+    { ...THEME, title: 'Expenses by Name', height: 400, xaxis: { title: 'Name' }, yaxis: { title: 'Amount' } },
+  ],
+  pie: (d) => [
+    [{
+      type: 'pie', labels: d.labels, values: d.values, hole: 0.4,
+      textinfo: 'label+percent', insidetextorientation: 'radial',
+      marker: { line: { color: 'white', width: 1 } },
+    }],
+    { ...THEME, title: 'Expense Distribution' },
+  ],
+  worm: (d) => [
+    [{
+      type: 'scatter', x: d.x, y: d.y, mode: 'lines+markers', name: 'Annual Expenses',
+      line: { shape: 'linear', color: 'lime', width: 3 },
+      marker: { size: 10, color: 'cyan', line: { width: 1, color: 'black' } },
+      hovertemplate: 'Year: %{x}<br>Amount: ₹%{y:,.0f}<extra></extra>',
+    }],
+    {
+      ...THEME,
+      title: { text: 'Total Expenses Per Year', x: 0.5, xanchor: 'center', pad: { t: 0, b: 0 } },
+      autosize: true,
+      height: 200,
+      margin: { l: 50, r: 40, t: 50, b: 50 },
+      xaxis: { ...AXIS, title: { text: 'Year', font: { color: 'white' } }, type: 'linear', tickmode: 'linear', dtick: 1 },
+      yaxis: { ...AXIS, title: { text: 'Amount (₹)', font: { color: 'white' } }, tickformat: ',', range: [0, Math.max(...d.y) * 1.2] },
+    },
+  ],
+  gauge_month: (d) => gauge({ title: 'This Month', value: d.value, budget: d.budget, showBudget: true, width: 386, height: 170 }),
+  gauge_small: (d) => gauge({ title: d.title, value: d.value, budget: d.budget, ref: d.ref, showBudget: false, width: 180, height: 135 }),
+};
+
+const EMPTY_MESSAGES = {
+  worm: 'No valid data to display.',
+  gauge: 'No gauge data available.',
+};
+
+export function renderChart(element, payload, emptyMessage) {
+  if (!element) return;
+  if (!payload) {
+    element.textContent = emptyMessage || '';
+    return;
+  }
+  const [data, layout] = LAYOUTS[payload.layout](payload);
+  window.Plotly.newPlot(element, data, layout);
+}
+
+export async function renderDashboard(url) {
+  const response = await fetch(url, { credentials: 'same-origin' });
+  if (!response.ok) return;
+  const { charts } = await response.json();
+  const el = (id) => document.getElementById(id);
+
+  renderChart(el('chart-bar'), charts.bar);
+  renderChart(el('chart-pie'), charts.pie);
+  renderChart(el('chart-worm'), charts.worm, EMPTY_MESSAGES.worm);
+  const gauges = charts.gauges || {};
+  renderChart(el('chart-gauge-month'), gauges.this_month, EMPTY_MESSAGES.gauge);
+  renderChart(el('chart-gauge-year'), gauges.this_year);
+  renderChart(el('chart-gauge-vs-last'), gauges.month_vs_last);
+}
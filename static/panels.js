@@ -0,0 +1,27 @@
+// Lazy dashboard panels: each chart placeholder fetches its own HTML fragment,
+// so one slow chart never holds up the page or the other panels.
+
+function runScripts(container) {
+  // Scripts inserted through innerHTML don't execute; Plotly divs need theirs to.
+  container.querySelectorAll('script').forEach((old) => {
+    const script = document.createElement('script');
+    script.text = old.text;
+    old.replaceWith(script);
+  });
+}
+
+export async function loadPanel(element) {
+  try {
+    // The browser revalidates with If-None-Match and reuses its copy on 304
+    const response = await fetch(element.dataset.panelUrl, { credentials: 'same-origin' });
+    if (!response.ok) throw new Error(response.statusText);
+    element.innerHTML = await response.text();
+    runScripts(element);
+  } catch (err) {
+    element.textContent = 'Could not load chart.';
+  }
+}
+
+export function loadPanels(root) {
+  return Promise.all([...root.querySelectorAll('.lazy-panel')].map(loadPanel));
+}
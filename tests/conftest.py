@@ -0,0 +1,18 @@
+import os
+import shutil
+import tempfile
+
+_db_dir = None
+
+
+def pytest_configure(config):
+    # Runs before any test module imports app, so the app (and its startup
+    # migrations) only ever see a throwaway database, never instance/database.db
+    global _db_dir
+    _db_dir = tempfile.mkdtemp(prefix='fintracker-tests-')
+    os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(_db_dir, 'test.db')}"
+
+
+def pytest_unconfigure(config):
+    if _db_dir:
+        shutil.rmtree(_db_dir, ignore_errors=True)
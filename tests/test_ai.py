@@ -1,10 +1,16 @@
 import pytest
+import time
 from unittest.mock import patch, MagicMock
 import sys
 import os
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
-from ai import analyze_txt_content, generate_data_hash
+import ai
+import fake_openai
+import openai
+from openai import OpenAI
+from ai import (AIError, CircuitBreaker, CircuitOpenError, analyze_txt_content, stream_txt_content,
+                generate_data_hash, render_markdown)
 
 # Mock data for hash test
 mock_profile = {
@@ -47,14 +53,78 @@ def test_analyze_txt_content_no_valid_response(mock_create):
     mock_response.choices = [MagicMock(message=None)]  # No message
     mock_create.return_value = mock_response
 
-    result = analyze_txt_content("test input without valid message")
-    
-    assert result == "❌ AI Error: No valid response received from model."
+    # Never returned as text, so it can't end up cached as an analysis
+    with pytest.raises(AIError, match="No valid response"):
+        analyze_txt_content("test input without valid message")
     mock_create.assert_called_once()
 
 @patch("ai.client.chat.completions.create")
 def test_analyze_txt_content_error(mock_create):
-    mock_create.side_effect = Exception("Simulated failure")
-    result = analyze_txt_content("test")
-    
-    assert result.startswith("❌ AI Error")
+    mock_create.side_effect = openai.AuthenticationError(
+        "bad key", response=MagicMock(status_code=401, headers={}), body=None)
+    with pytest.raises(AIError):
+        analyze_txt_content("test")
+    mock_create.assert_called_once()  # not retried
+
+
+def test_render_markdown_keeps_formatting_and_strips_html():
+    html = render_markdown("**Save** more\n\n<script>alert(1)</script>\n\n[x](javascript:alert(1))")
+    assert "<strong>Save</strong>" in html
+    assert "<script>" not in html
+    assert "javascript:" not in html
+
+
+@pytest.fixture
+def fake_upstream():
+    server = fake_openai.start_in_thread(seed=1)
+    with patch('ai.client', OpenAI(base_url=server.base_url, api_key='test', max_retries=0)), \
+         patch('ai.breaker', CircuitBreaker(failure_threshold=2, reset_after=60)), \
+         patch('ai.AI_BACKOFF_BASE', 0):
+        yield server
+    server.shutdown()
+
+def test_stream_txt_content_yields_tokens_from_upstream(fake_upstream):
+    chunks = list(stream_txt_content("Income: 1000"))
+    assert len(chunks) > 1
+    assert ''.join(chunks) == fake_openai.DEFAULT_REPLY
+
+def test_stream_txt_content_rejects_blank_reply(fake_upstream):
+    fake_upstream.reply = '  \n'
+    with pytest.raises(AIError):
+        list(stream_txt_content("Income: 1000"))
+
+def test_stream_txt_content_raises_upstream_errors(fake_upstream):
+    fake_upstream.error_rate = 1.0
+    with pytest.raises(AIError):
+        list(stream_txt_content("Income: 1000"))
+
+def test_upstream_errors_are_retried_then_trip_the_breaker(fake_upstream):
+    fake_upstream.error_rate = 1.0
+    with pytest.raises(AIError):
+        analyze_txt_content("a")
+    assert fake_upstream.requests == ai.AI_MAX_RETRIES + 1
+
+    with pytest.raises(AIError):
+        analyze_txt_content("b")
+    assert ai.breaker.state == 'open'
+
+    # While open, calls fail fast without reaching upstream
+    requests = fake_upstream.requests
+    with pytest.raises(CircuitOpenError):
+        analyze_txt_content("c")
+    assert fake_upstream.requests == requests
+
+def test_retry_recovers_from_transient_errors(fake_upstream):
+    fake_upstream.error_rate = 0.5  # seeded: the first request fails, a retry succeeds
+    assert analyze_txt_content("a") == fake_openai.DEFAULT_REPLY
+    assert fake_upstream.requests > 1
+
+def test_circuit_breaker_half_open_allows_one_trial():
+    breaker = CircuitBreaker(failure_threshold=1, reset_after=0.05)
+    breaker.record_failure()
+    assert not breaker.allow()
+    time.sleep(0.06)
+    assert breaker.allow()
+    assert not breaker.allow()  # only one trial at a time
+    breaker.record_success()
+    assert breaker.state == 'closed' and breaker.allow()
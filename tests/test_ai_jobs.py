@@ -0,0 +1,82 @@
+import os
+import sys
+import threading
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from ai_jobs import AIJobScheduler, TokenStreams, QUEUED, DUPLICATE, REJECTED
+from ai import local_analyze_txt_content
+
+def test_duplicate_keys_run_once():
+    scheduler = AIJobScheduler(workers=1, max_queue=4)
+    release = threading.Event()
+    calls = []
+
+    def job(tag):
+        release.wait(5)
+        calls.append(tag)
+
+    assert scheduler.submit((1, 'h'), job, 'a') == QUEUED
+    assert scheduler.submit((1, 'h'), job, 'b') == DUPLICATE
+    release.set()
+    scheduler.join()
+
+    assert calls == ['a']
+    assert scheduler.stats()['deduplicated'] == 1
+    # Once finished, the same key can be scheduled again
+    assert scheduler.submit((1, 'h'), job, 'c') == QUEUED
+    scheduler.join()
+    assert calls == ['a', 'c']
+
+def test_full_queue_sheds_new_jobs():
+    scheduler = AIJobScheduler(workers=1, max_queue=1)
+    started, release = threading.Event(), threading.Event()
+
+    def blocker():
+        started.set()
+        release.wait(5)
+
+    scheduler.submit('running', blocker)
+    started.wait(5)
+    assert scheduler.submit('queued', lambda: None) == QUEUED
+    assert scheduler.submit('shed', lambda: None) == REJECTED
+
+    stats = scheduler.stats()
+    assert stats['in_flight'] == 1
+    assert stats['queue_depth'] == 1
+    assert stats['rejected'] == 1
+    release.set()
+    scheduler.join()
+
+def test_failed_job_is_counted_and_releases_key():
+    scheduler = AIJobScheduler(workers=1, max_queue=2)
+
+    def boom():
+        raise RuntimeError("upstream down")
+
+    scheduler.submit('k', boom)
+    scheduler.join()
+    assert scheduler.stats()['failed'] == 1
+    assert not scheduler.is_pending('k')
+
+def test_local_analyzer_is_deterministic():
+    text = "Income: ₹100\nBudget: ₹10"
+    result = local_analyze_txt_content(text)
+    assert result == local_analyze_txt_content(text)
+    assert "- Income: ₹100" in result
+
+
+def test_token_stream_is_shared_by_late_listeners():
+    streams = TokenStreams()
+    assert streams.get('k', timeout=0.01) is None
+
+    stream = streams.open('k')
+    stream.append('Hello ')
+    late = streams.get('k')
+    stream.append('there')
+
+    assert late.read(0, timeout=1) == (['Hello ', 'there'], False)
+    assert late.read(2, timeout=0.01) == ([], False)  # timed out, still running
+    stream.finish()
+    streams.close('k')
+    assert late.read(2, timeout=1) == ([], True)
+    assert streams.get('k') is None
@@ -0,0 +1,98 @@
+import os
+import sys
+import json
+from datetime import datetime, timedelta
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import pytest
+from sqlalchemy import create_engine
+
+from ai_store import MemoryAIResultStore, SQLAIResultStore, metadata, import_json_cache_files
+
+@pytest.fixture
+def sql_store():
+    engine = create_engine('sqlite://')
+    metadata.create_all(engine)
+    return SQLAIResultStore(engine, front_ttl=0)
+
+def test_sql_store_upserts_latest_result(sql_store):
+    assert sql_store.get(1) is None
+    sql_store.put(1, 'h1', 'first')
+    sql_store.put(1, 'h2', 'second')
+    result = sql_store.get(1)
+    assert (result.data_hash, result.response) == ('h2', 'second')
+    assert isinstance(result.created_at, datetime)
+
+def test_lru_front_serves_without_backend_and_evicts():
+    store = MemoryAIResultStore(max_entries=1, front_ttl=60)
+    store.put(1, 'h', 'one')
+    store._users.clear()                # backend gone; front still answers
+    assert store.get(1).response == 'one'
+    store.put(2, 'h', 'two')            # evicts user 1 from the front
+    assert store.get(1) is None
+
+def test_is_stale_on_hash_change_and_ttl():
+    store = MemoryAIResultStore(ttl=60)
+    fresh = store.put(1, 'h', 'x')
+    assert not store.is_stale(fresh, 'h')
+    assert store.is_stale(fresh, 'other')
+    assert store.is_stale(None, 'h')
+    old = store.put(2, 'h', 'x', created_at=datetime.now() - timedelta(seconds=120))
+    assert store.is_stale(old, 'h')
+
+def test_import_json_cache_files(tmp_path, sql_store):
+    (tmp_path / 'ai_cache_7.json').write_text(json.dumps({'hash': 'abc', 'response': 'legacy'}))
+    (tmp_path / 'ai_cache.json').write_text(json.dumps({'hash': 'x', 'response': 'no user id'}))
+    (tmp_path / 'ai_cache_8.json').write_text('not json')
+
+    assert import_json_cache_files(sql_store, str(tmp_path)) == [7]
+    assert sql_store.get(7).response == 'legacy'
+    # Running it again doesn't clobber the stored (same-age) result
+    assert import_json_cache_files(sql_store, str(tmp_path)) == []
+
+
+@pytest.fixture(params=['memory', 'sql'])
+def store(request, sql_store):
+    return MemoryAIResultStore(ttl=60, front_ttl=0) if request.param == 'memory' else sql_store
+
+def test_users_with_the_same_digest_share_one_response(store):
+    store.ttl = 60
+    store.put(1, 'h-a', 'shared answer', html='<p>shared answer</p>', digest='d1')
+
+    assert store.link(2, 'h-b', 'missing') is None
+    linked = store.link(2, 'h-b', 'd1')
+    assert (linked.response, linked.html, linked.digest) == ('shared answer', '<p>shared answer</p>', 'd1')
+    assert store.get(2).data_hash == 'h-b'
+    assert not store.is_stale(store.get(2), 'h-b')
+
+def test_stats_count_only_recorded_lookups(store):
+    store.link(1, 'h', 'missing')  # lookups inside the store don't count
+    assert store.stats()['hit_rate'] is None
+    store.count_lookup(hit=False)
+    store.count_lookup(hit=True)
+    assert (store.stats()['hits'], store.stats()['misses'], store.stats()['hit_rate']) == (1, 1, 0.5)
+
+def test_expired_responses_are_not_shared_and_get_pruned(store):
+    store.ttl = 60
+    store.put(1, 'h', 'old', digest='old', created_at=datetime.now() - timedelta(seconds=120))
+    store.put(1, 'h', 'new', digest='new')
+    assert store.link(2, 'h', 'old') is None
+
+    assert store.prune() == 1
+    assert store.link(2, 'h', 'new').response == 'new'
+
+def test_prune_keeps_most_recently_used(store):
+    for i in range(3):
+        store.put(i, f'h{i}', f'r{i}', digest=f'd{i}')
+    store.link(9, 'h0', 'd0')  # d0 is now the most recently used
+    assert store.prune(max_responses=2) == 1
+    assert store.get(1) is None  # its response was evicted; it will be regenerated
+    assert store.get(0).response == 'r0'
+
+def test_put_prunes_every_n_writes(store):
+    store.max_responses, store.prune_every = 2, 3
+    store.put(1, 'h1', 'r1', digest='d1')
+    store.put(2, 'h2', 'r2', digest='d2')
+    store.put(3, 'h3', 'r3', digest='d3')  # third write prunes d1
+    assert store.get(1) is None
+    assert store.get(3).response == 'r3'
@@ -6,7 +6,10 @@ from datetime import date,datetime
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
     
 from flask import session
-from app import app as flask_app,User, Expenses
+from app import app as flask_app,User, Expenses, dashboard_cache, identity_cache
+from unittest.mock import patch
+from ai_store import MemoryAIResultStore
+from ai import response_digest
 # import app as app_module
 # flask_app = app_module.app
 # User = app_module.User
@@ -15,7 +18,8 @@ from app import app as flask_app,User, Expenses
 def client():
     flask_app.config['TESTING'] = True
     flask_app.config['WTF_CSRF_ENABLED'] = False
-    with flask_app.test_client() as client:
+    # Tests log in with mocked identities, which can't be snapshotted into the cache
+    with patch.object(identity_cache, 'ttl', 0), flask_app.test_client() as client:
         with flask_app.app_context():
             yield client
 
@@ -89,12 +93,15 @@ from unittest.mock import patch, MagicMock, mock_open
 from flask import template_rendered
 
 def test_login_post_success_mock(client):
-    mock_user = MagicMock()
+    mock_user = MagicMock(id=5)
     mock_user.name = 'Test User'
     mock_user.email = 'test@example.com'
     mock_user.password = 'hashed_pw'
     mock_user.check_password.return_value = True
 
+    with client.session_transaction() as sess:
+        sess['password'] = 'left over from an old login'
+
     with patch('app.User.query') as mock_query:
         mock_query.filter_by.return_value.first.return_value = mock_user
         response = client.post('/login', data={
@@ -105,6 +112,10 @@ def test_login_post_success_mock(client):
         assert response.status_code == 302
         assert '/dashboard' in response.location
 
+    # Only the id goes in the cookie -- never the password hash
+    with client.session_transaction() as sess:
+        assert dict(sess) == {'user_id': 5}
+
 
 def test_login_post_invalid_user_mock(client):
     with patch('app.User.query') as mock_query:
@@ -156,17 +167,15 @@ def test_register_post_new_user(client):
 
 def test_profile_get_flow(client):
     with client.session_transaction() as sess:
-        sess['email'] = 'mock@example.com'
+        sess['user_id'] = 1
 
-    with patch('app.User.query') as mock_user_query, \
-         patch('app.UserDetails.query') as mock_details_query, \
+    with patch('app.load_identity') as mock_identity, \
          patch('app.db.session.add') as mock_add, \
          patch('app.db.session.commit') as mock_commit, \
          patch('app.render_template') as mock_render:
 
         mock_user = MagicMock(id=1, email='mock@example.com')
-        mock_user_query.filter_by.return_value.first.return_value = mock_user
-        mock_details_query.filter_by.return_value.first.return_value = None
+        mock_identity.return_value = (mock_user, None)
 
         mock_render.return_value = "rendered"
 
@@ -180,10 +189,9 @@ def test_profile_get_flow(client):
 
 def test_profile_post_flow(client):
     with client.session_transaction() as sess:
-        sess['email'] = 'mock@example.com'
+        sess['user_id'] = 1
 
-    with patch('app.User.query') as mock_user_query, \
-         patch('app.UserDetails.query') as mock_details_query, \
+    with patch('app.load_identity') as mock_identity, \
          patch('app.db.session.commit') as mock_commit, \
          patch('app.redirect') as mock_redirect, \
          patch('app.flash') as mock_flash:
@@ -191,8 +199,7 @@ def test_profile_post_flow(client):
         mock_user = MagicMock(id=1, email='mock@example.com')
         mock_details = MagicMock()
 
-        mock_user_query.filter_by.return_value.first.return_value = mock_user
-        mock_details_query.filter_by.return_value.first.return_value = mock_details
+        mock_identity.return_value = (mock_user, mock_details)
         mock_redirect.return_value = "redirected"
 
         response = client.post('/profile', data={
@@ -206,10 +213,9 @@ def test_profile_post_flow(client):
 
 def test_profile_post_annual_income_field(client):
     with client.session_transaction() as sess:
-        sess['email'] = 'mock@example.com'
+        sess['user_id'] = 1
 
-    with patch('app.User.query') as mock_user_query, \
-         patch('app.UserDetails.query') as mock_details_query, \
+    with patch('app.load_identity') as mock_identity, \
          patch('app.db.session.commit'), \
          patch('app.redirect') as mock_redirect, \
          patch('app.flash'):
@@ -217,8 +223,7 @@ def test_profile_post_annual_income_field(client):
         mock_user = MagicMock(id=1, email='mock@example.com')
         mock_details = MagicMock()
 
-        mock_user_query.filter_by.return_value.first.return_value = mock_user
-        mock_details_query.filter_by.return_value.first.return_value = mock_details
+        mock_identity.return_value = (mock_user, mock_details)
         mock_redirect.return_value = "redirected"
 
         client.post('/profile', data={
@@ -231,10 +236,9 @@ def test_profile_post_annual_income_field(client):
 
 def test_profile_post_other_field(client):
     with client.session_transaction() as sess:
-        sess['email'] = 'mock@example.com'
+        sess['user_id'] = 1
 
-    with patch('app.User.query') as mock_user_query, \
-         patch('app.UserDetails.query') as mock_details_query, \
+    with patch('app.load_identity') as mock_identity, \
          patch('app.db.session.commit'), \
          patch('app.redirect') as mock_redirect, \
          patch('app.flash'):
@@ -242,8 +246,7 @@ def test_profile_post_other_field(client):
         mock_user = MagicMock(id=1, email='mock@example.com')
         mock_details = MagicMock()
 
-        mock_user_query.filter_by.return_value.first.return_value = mock_user
-        mock_details_query.filter_by.return_value.first.return_value = mock_details
+        mock_identity.return_value = (mock_user, mock_details)
         mock_redirect.return_value = "redirected"
 
         client.post('/profile', data={
@@ -256,16 +259,15 @@ def test_profile_post_other_field(client):
 
 def test_add_expense_post_valid_data(client):
     with client.session_transaction() as sess:
-        sess['name'] = 'TestUser'
-        sess['email'] = 'test@example.com'
+        sess['user_id'] = 1
 
-    with patch('app.User.query') as mock_user_query, \
+    with patch('app.load_identity') as mock_identity, \
         patch('app.Expenses') as mock_expense_cls, \
         patch('app.db.session.add') as mock_add, \
         patch('app.db.session.commit') as mock_commit:
 
         mock_user = MagicMock(id=1)
-        mock_user_query.filter_by.return_value.first.return_value = mock_user
+        mock_identity.return_value = (mock_user, None)
         response = client.post('/add_expenses', data={
             'name': 'Groceries',
             'amount': '250',
@@ -281,12 +283,11 @@ def test_add_expense_post_valid_data(client):
 
 def test_add_expense_get_form_render(client):
     with client.session_transaction() as sess:
-        sess['name'] = 'TestUser'
-        sess['email'] = 'test@example.com'
+        sess['user_id'] = 1
 
-    with patch('app.User.query') as mock_user_query:
+    with patch('app.load_identity') as mock_identity:
         mock_user = MagicMock()
-        mock_user_query.filter_by.return_value.first.return_value = mock_user
+        mock_identity.return_value = (mock_user, None)
 
         response = client.get('/add_expenses')
         assert response.status_code == 200
@@ -294,8 +295,7 @@ def test_add_expense_get_form_render(client):
 
 def test_expense_list_sort_by_amount_asc(client):
     with client.session_transaction() as sess:
-        sess['email'] = 'test@example.com'
-        sess['name'] = 'Test User'
+        sess['user_id'] = 1
 
     mock_user = MagicMock(id=1, email='test@example.com')
 
@@ -304,18 +304,17 @@ def test_expense_list_sort_by_amount_asc(client):
     mock_expense2 = MagicMock(amount=200)
     mock_expenses = [mock_expense1, mock_expense2]
 
-    with patch('app.User.query') as mock_user_query, \
+    with patch('app.load_identity') as mock_identity, \
          patch('app.Expenses.query') as mock_exp_query, \
+         patch('app.get_expense_summary', return_value=(300, 2)), \
          patch('app.render_template') as mock_render:
 
         # Mock user lookup
-        mock_user_query.filter_by.return_value.first.return_value = mock_user
+        mock_identity.return_value = (mock_user, None)
 
-        # Chain: Expenses.query.filter_by().order_by().all()
+        # Chain: Expenses.query.filter_by().order_by().limit().all()
         mock_filter = MagicMock()
-        mock_order_by = MagicMock()
-        mock_order_by.all.return_value = mock_expenses
-        mock_filter.order_by.return_value = mock_order_by
+        mock_filter.order_by.return_value.limit.return_value.all.return_value = mock_expenses
         mock_exp_query.filter_by.return_value = mock_filter
 
         # Final HTML output stub
@@ -326,13 +325,17 @@ def test_expense_list_sort_by_amount_asc(client):
         # 🔍 Assertions
         mock_exp_query.filter_by.assert_called_once_with(user_id=mock_user.id)
         mock_filter.order_by.assert_called_once()  # Confirm sort
+        mock_filter.order_by.return_value.limit.assert_called_once_with(51)  # page size + 1
         mock_render.assert_called_once()           # Confirm page rendered
+        kwargs = mock_render.call_args[1]
+        assert kwargs['expenses'] == mock_expenses
+        assert kwargs['total'] == 300 and kwargs['count'] == 2
+        assert kwargs['next_cursor'] is None
 
 
 def test_expense_list_sort_by_date(client):
     with client.session_transaction() as sess:
-        sess['email'] = 'test@example.com'
-        sess['name'] = 'Test User'
+        sess['user_id'] = 1
 
     mock_user = MagicMock(id=1, email='test@example.com')
 
@@ -340,11 +343,12 @@ def test_expense_list_sort_by_date(client):
     mock_expense2 = MagicMock(date=datetime(2025, 7, 2))
     mock_expenses = [mock_expense2, mock_expense1]
 
-    with patch('app.User.query') as mock_user_query, \
+    with patch('app.load_identity') as mock_identity, \
          patch('app.Expenses.query') as mock_exp_query, \
+         patch('app.get_expense_summary', return_value=(0, 2)), \
          patch('app.render_template') as mock_render:
 
-        mock_user_query.filter_by.return_value.first.return_value = mock_user
+        mock_identity.return_value = (mock_user, None)
 
         # Chain mocking
         mock_filtered = MagicMock()
@@ -352,7 +356,7 @@ def test_expense_list_sort_by_date(client):
 
         mock_ordered = MagicMock()
         mock_filtered.order_by.return_value = mock_ordered
-        mock_ordered.all.return_value = mock_expenses
+        mock_ordered.limit.return_value.all.return_value = mock_expenses
 
         mock_render.return_value = 'rendered'
 
@@ -360,59 +364,85 @@ def test_expense_list_sort_by_date(client):
 
         # Assert that sort was used correctly
         mock_filtered.order_by.assert_called_once()
-        mock_filtered.order_by.return_value.all.assert_called_once()
+        mock_ordered.limit.return_value.all.assert_called_once()
         mock_render.assert_called_once()
 
 def test_expense_list_invalid_sort_key(client):
     with client.session_transaction() as sess:
-        sess['name'], sess['email'] = 'TestUser', 'test@example.com'
+        sess['user_id'] = 1
 
-    with patch('app.User.query') as uq, patch('app.Expenses.query') as eq, patch('app.render_template') as rt:
-        uq.filter_by.return_value.first.return_value = MagicMock()
-        eq.all.return_value = [MagicMock(amount=100), MagicMock(amount=200)]
+    with patch('app.load_identity') as identity, patch('app.Expenses.query') as eq, \
+         patch('app.get_expense_summary', return_value=(300, 2)), patch('app.render_template') as rt:
+        identity.return_value = (MagicMock(), None)
+        eq.filter_by.return_value.order_by.return_value.limit.return_value.all.return_value = [MagicMock(amount=100), MagicMock(amount=200)]
         rt.return_value = b'rendered'
         assert client.get('/expense_list?sort=xyz').data == b'rendered'
 
 
+def test_page_expenses_walks_every_row_once(db_rollback):
+    from app import page_expenses
+    db = db_rollback
+    user = User(name='Pager', email='pager-test@example.com', password='x')
+    db.session.add(user)
+    db.session.flush()
+    amounts = [50, 10, 50, 30, 10, 50, 20]
+    db.session.add_all([Expenses(name=f'e{i}', amount=a, date=date(2025, 1, 1 + i), description='', user_id=user.id)
+                        for i, a in enumerate(amounts)])
+    db.session.flush()
+
+    for sort_by, order in [('amount', 'asc'), ('amount', 'desc'), ('date', 'desc'), (None, 'asc')]:
+        seen, cursor = [], None
+        while True:
+            page, cursor = page_expenses(user.id, sort_by, order, cursor, page_size=3)
+            seen.extend(page)
+            if cursor is None:
+                break
+        assert len(seen) == len(amounts)
+        assert len({e.id for e in seen}) == len(amounts)
+        if sort_by == 'amount':
+            keys = [(e.amount, e.id) for e in seen]
+            assert keys == sorted(keys, reverse=(order == 'desc'))
+
+
+def test_decode_cursor_rejects_garbage():
+    from app import decode_cursor
+    assert decode_cursor('2025-01-02~7', 'date') == (date(2025, 1, 2), 7)
+    assert decode_cursor('abc~7', 'amount') is None
+    assert decode_cursor('no-separator', 'amount') is None
 
 
 def test_ai_falls_back_to_background_processing(client):
-    from io import StringIO
-
     with client.session_transaction() as sess:
-        sess['email'] = 'test@example.com'
+        sess['user_id'] = 1
 
     mock_user = MagicMock(id=1, email="test@example.com")
     mock_details = MagicMock()
 
-    with patch('app.User.query') as uq, \
-         patch('app.UserDetails.query') as dq, \
+    with patch('app.load_identity') as identity, \
          patch('app.Expenses.query') as eq, \
          patch('app.generate_data_hash', return_value="xyz456"), \
-         patch('app.os.path.exists', return_value=False), \
-         patch('app.analyze_txt_content', return_value='Mocked Summary'), \
+         patch('app.ai_store', MemoryAIResultStore()) as store, \
+         patch('app.stream_txt_content', return_value=iter(['Mocked ', 'Summary'])), \
          patch('app.render_template') as rt, \
-         patch('app.markdown.markdown', return_value="mocked html"), \
-         patch('app.threading.Thread') as mt, \
-         patch('builtins.open', return_value=StringIO()) as mo:
+         patch('app.ai_scheduler.submit') as submit:
 
-        uq.filter_by.return_value.first.return_value = mock_user
-        dq.filter_by.return_value.first.return_value = mock_details
+        identity.return_value = (mock_user, mock_details)
         eq.all.return_value = []
         rt.return_value = b'rendered fallback'
         mock_user.id = 1
-        client.get('/ai')  # triggers thread
+        client.get('/ai')  # queues the background job
 
-        mt.call_args[1]['target']()  # manually run background
-        mo.assert_any_call(f'ai_cache_{mock_user.id}.json', 'w')
-        # mo.assert_called_with('ai_cache.json', 'w')
+        key, job, *args = submit.call_args[0]
+        assert key == response_digest("xyz456")
+        job(*args)  # manually run background
+        assert store.get(1).data_hash == "xyz456"
+        assert store.get(1).response == 'Mocked Summary'
         assert rt.called
 
 
 def test_download_txt_route(client):
     with client.session_transaction() as sess:
-        sess['email'] = 'test@example.com'
-        sess['name'] = 'Test User'
+        sess['user_id'] = 1
 
     mock_user = MagicMock(name="Test User", id=1, email="test@example.com")
 
@@ -451,98 +481,87 @@ def test_download_txt_route(client):
     mock_expense4 = MagicMock(name="Lunch", amount=400, date=datetime(2025, 7, 4), description="Food")
     mock_expense5 = MagicMock(name="Metro", amount=300, date=datetime(2025, 7, 5), description="Transport")
 
-    with patch('app.User.query') as uq, \
-         patch('app.UserDetails.query') as dq, \
-         patch('app.Expenses.query') as eq:
-
-        uq.filter_by.return_value.first.return_value = mock_user
-
-        # --- First: Over Budget ---
-        dq.filter_by.return_value.first.return_value = mock_details_over
-        eq.filter_by.return_value.all.return_value = [mock_expense1, mock_expense2]
+    def report_for(details, expenses, spent_this_month):
+        with patch('app.load_identity') as identity, \
+             patch('app.Expenses.query') as eq, \
+             patch('app.get_expense_summary', return_value=(sum(e.amount for e in expenses), len(expenses))), \
+             patch('app.get_month_breakdown', return_value={'All': (spent_this_month, len(expenses))}):
+            identity.return_value = (mock_user, details)
+            eq.filter_by.return_value.order_by.return_value.limit.return_value.all.return_value = expenses
+            return client.get('/download_txt').data.decode()
 
-        res1 = client.get('/download_txt')
-        txt1 = res1.data.decode()
-        assert "❌ Over Budget" in txt1
-        assert "Coffee" in txt1 and "Books" in txt1
+    # --- First: Over Budget ---
+    txt1 = report_for(mock_details_over, [mock_expense1, mock_expense2], 1300)
+    assert "❌ Over Budget" in txt1
+    assert "Coffee" in txt1 and "Books" in txt1
+    assert "Total Entries: 2" in txt1
 
-        # --- Second: No Budget ---
-        dq.filter_by.return_value.first.return_value = mock_details_none
-        eq.filter_by.return_value.all.return_value = [mock_expense3]
+    # --- Second: No Budget ---
+    txt2 = report_for(mock_details_none, [mock_expense3], 100)
+    assert "Monthly budget not set." in txt2
+    assert "Snacks" in txt2
 
-        res2 = client.get('/download_txt')
-        txt2 = res2.data.decode()
-        assert "Monthly budget not set." in txt2
-        assert "Snacks" in txt2
-
-        # --- Third: Within Budget ---
-        dq.filter_by.return_value.first.return_value = mock_details_within
-        eq.filter_by.return_value.all.return_value = [mock_expense4, mock_expense5]
-
-        res3 = client.get('/download_txt')
-        txt3 = res3.data.decode()
-        assert "✅ Within Budget" in txt3
-        assert "Lunch" in txt3 and "Metro" in txt3
+    # --- Third: Within Budget ---
+    txt3 = report_for(mock_details_within, [mock_expense4, mock_expense5], 700)
+    assert "✅ Within Budget" in txt3
+    assert "Lunch" in txt3 and "Metro" in txt3
 
 
 
 def test_ai_background_writes_cache_with_categories(client):
     with client.session_transaction() as s:
-        s['email'] = 'x@example.com'
-
-    dummy_expense = {
-        "name": "Coffee",
-        "amount": 100.0,
-        "date": "2025-07-01",
-        "description": "Food"
-    }
+        s['user_id'] = 42
 
     mock_user = MagicMock(id=42, email="x@example.com")
     mock_details = MagicMock()
     mock_details.annual_income = 1000000
     mock_details.monthly_budget = 5000
     mock_details.financial_goal = "Save"
+    summary = {
+        'monthly_totals': [['2025-06', 900], ['2025-07', 100]],
+        'top_categories': [['Food', 100, 100]],
+        'monthly_average': 500,
+        'budget_used_pct': 2,
+        'average_budget_pct': 10,
+        'trend_pct': -89,
+    }
 
-    with patch('app.User.query') as uq, \
-         patch('app.UserDetails.query') as dq, \
-         patch('app.Expenses.query') as eq, \
-         patch('app.generate_data_hash', return_value='abc'), \
-         patch('app.os.path.exists', return_value=False), \
+    with patch('app.load_identity', return_value=(mock_user, mock_details)), \
+         patch('app.get_ai_summary', return_value=summary), \
+         patch('app.generate_data_hash', return_value='abc') as data_hash, \
+         patch('app.ai_store', MemoryAIResultStore()) as store, \
          patch('app.render_template'), \
-         patch('app.analyze_txt_content', side_effect=lambda p: p) as mock_ai, \
-         patch('builtins.open', mock_open()) as mo, \
-         patch('app.threading.Thread') as mt:
-
-        uq.filter_by.return_value.first.return_value = mock_user
-        dq.filter_by.return_value.first.return_value = mock_details
-
-        # ✅ Patch .filter_by().all()
-        eq.filter_by.return_value.all.return_value = [MagicMock(**dummy_expense)]
+         patch('app.stream_txt_content', side_effect=lambda p: iter([p])) as mock_ai, \
+         patch('app.ai_scheduler.submit') as submit:
 
         client.get('/ai')
-        mt.call_args[1]['target']()  # run the background thread manually
+        key, job, *args = submit.call_args[0]
+        job(*args)  # run the background job manually
 
-        mo.assert_any_call(f'ai_cache_{mock_user.id}.json', 'w')
+        assert store.get(mock_user.id).data_hash == 'abc'
+        assert '<p>' in store.get(mock_user.id).html
+        # The summary is what gets hashed, not raw expense rows
+        assert data_hash.call_args[0][1] == summary
 
         prompt = mock_ai.call_args[0][0]
         print("Prompt used:\n", prompt)
 
-        assert "Expense Categories:" in prompt
-        assert "Food" in prompt
-        assert "Recent Expenses Total: ₹100.0" in prompt
+        assert "Expense Categories: Food ₹100 (100%)" in prompt
+        assert "2025-07: ₹100" in prompt
+        assert "Budget used this month: 2%" in prompt
+        assert "Trend (last 3 months vs previous 3): -89%" in prompt
 
 def test_dashboard_route_authenticated(client):
     with client.session_transaction() as sess:
-        sess['email'] = 'test@example.com'
+        sess['user_id'] = 1
 
     mock_user = MagicMock(id=1, email='test@example.com')
     mock_details = MagicMock(monthly_budget=5000)
-    mock_expenses = [MagicMock(), MagicMock()]
     mock_latest_expenses = [MagicMock() for _ in range(4)]
 
-    with patch('app.User.query') as uq, \
-         patch('app.UserDetails.query') as dq, \
+    with patch('app.load_identity') as identity, \
          patch('app.Expenses.query') as eq, \
+         patch('app.get_dashboard_aggregates') as agg, \
          patch('app.generate_bar_chart', return_value='<div>bar</div>'), \
          patch('app.generate_worm_chart', return_value='<div>worm</div>'), \
          patch('app.generate_pie_chart', return_value='<div>pie</div>'), \
@@ -550,11 +569,10 @@ def test_dashboard_route_authenticated(client):
          patch('app.get_icon_status_data', return_value=['tile1', 'tile2']), \
          patch('app.render_template') as rt:
 
-        uq.filter_by.return_value.first.return_value = mock_user
-        dq.filter_by.return_value.first.return_value = mock_details
+        identity.return_value = (mock_user, mock_details)
 
-        # Mock for Expenses.query.filter_by().all()
-        eq.filter_by.return_value.all.return_value = mock_expenses
+        agg.return_value = {'name_totals': {'Food': 500}, 'yearly_totals': {2025: 500},
+                            'month_totals': None, 'month_breakdown': {}}
 
         # Mock for Expenses.query.filter_by().order_by().limit().all()
         mock_filter = MagicMock()
@@ -567,8 +585,9 @@ def test_dashboard_route_authenticated(client):
 
 
         rt.return_value = 'rendered'
+        dashboard_cache.clear()
 
-        res = client.get('/dashboard')
+        res = client.get('/dashboard?render=server')
 
         assert res.data == b'rendered'
         rt.assert_called_once_with(
@@ -582,32 +601,761 @@ def test_dashboard_route_authenticated(client):
             gauge_this_year='g2',
             gauge_month_vs_last='g3',
             status_tiles=['tile1', 'tile2'],
-            monthly_budget=5000
+            monthly_budget=5000,
+            render_mode='server'
         )
 
 
 def test_ai_strips_would_you_like_prompt(client):
     with client.session_transaction() as sess:
-        sess['email'] = 'test@example.com'
+        sess['user_id'] = 1
 
-    fake_cached_data = {
-        "hash": "abc123",
-        "response": "Here are your insights. Would you like to export them?"
-    }
+    store = MemoryAIResultStore()
+    store.put(1, "abc123", "Here are your insights. Would you like to export them?",
+              created_at=datetime(2024, 7, 3, 10, 0, 0))
 
-    with patch('app.User.query') as uq, \
-         patch('app.UserDetails.query') as dq, \
+    with patch('app.load_identity') as identity, \
          patch('app.Expenses.query.all', return_value=[]), \
          patch('app.generate_data_hash', return_value="abc123"), \
-         patch('app.os.path.exists', return_value=True), \
-         patch('app.os.path.getmtime', return_value=1720000000), \
-         patch('builtins.open', mock_open(read_data=json.dumps(fake_cached_data))), \
-         patch('app.markdown.markdown') as md, \
+         patch('app.ai_store', store), \
+         patch('app.ai_scheduler.submit') as submit, \
+         patch('app.render_markdown') as md, \
          patch('app.render_template') as rt:
 
         mock_user = MagicMock(id=1, email='test@example.com')
-        uq.filter_by.return_value.first.return_value = mock_user
-        dq.filter_by.return_value.first.return_value = MagicMock()
+        identity.return_value = (mock_user, MagicMock())
         rt.return_value = b'done'
+        store.ttl = None
         res = client.get('/ai')
         assert res.data == b'done'
+        submit.assert_not_called()
+        assert rt.call_args[1]['last_refreshed'] == '2024-07-03 10:00:00'
+
+
+def test_ai_hit_serves_cached_html_without_rendering(client):
+    with client.session_transaction() as sess:
+        sess['user_id'] = 1
+
+    store = MemoryAIResultStore()
+    store.put(1, "h", "**raw**", html="<p><strong>raw</strong></p>")
+
+    with patch('app.load_identity') as identity, \
+         patch('app.Expenses.query'), \
+         patch('app.generate_data_hash', return_value="h"), \
+         patch('app.ai_store', store), \
+         patch('app.render_markdown') as md, \
+         patch('app.render_template', return_value='done') as rt:
+        identity.return_value = (MagicMock(id=1), MagicMock())
+        client.get('/ai')
+
+        md.assert_not_called()
+        assert rt.call_args[1]['analysis'] == "<p><strong>raw</strong></p>"
+
+
+@pytest.fixture
+def db_rollback():
+    from app import db
+    with flask_app.app_context():
+        yield db
+        db.session.rollback()
+
+
+def test_dashboard_aggregates_from_sql(db_rollback):
+    from app import get_dashboard_aggregates, update_monthly_rollup
+    db = db_rollback
+    now = datetime.now()
+    user = User(name='Agg', email='agg-test@example.com', password='x')
+    db.session.add(user)
+    db.session.flush()
+    rows = [('Food', 200, now.date()), ('Food', 300, now.date()), ('Rent', 1000, date(2020, 1, 5))]
+    db.session.add_all([Expenses(name=n, amount=a, date=d, description='', user_id=user.id) for n, a, d in rows])
+    update_monthly_rollup([(user.id, d, n, a) for n, a, d in rows])
+    db.session.flush()
+
+    agg = get_dashboard_aggregates(user.id)
+
+    assert agg['name_totals'] == {'Food': 500, 'Rent': 1000}
+    assert agg['yearly_totals'] == {now.year: 500, 2020: 1000}
+    assert agg['month_totals']['this_month'] == 500
+    assert agg['month_totals']['this_year'] == 500
+    assert agg['month_breakdown'] == {'Food': (500, 2)}
+
+
+def test_ai_summary_is_fixed_size_and_windowed(db_rollback):
+    from app import get_ai_summary, update_monthly_rollup
+    db = db_rollback
+    user = User(name='Summary', email='ai-summary-test@example.com', password='x')
+    db.session.add(user)
+    db.session.flush()
+    now = datetime(2025, 3, 15)
+    rows = [('Rent', 1000, date(2025, 3, 1)), ('Food', 200, date(2025, 3, 2)), ('Food', 100.4, date(2025, 2, 2)),
+            ('Bus', 50, date(2024, 12, 5)), ('Travel', 5000, date(2024, 3, 1))]  # last one is outside the window
+    update_monthly_rollup([(user.id, d, n, a) for n, a, d in rows])
+    db.session.flush()
+
+    summary = get_ai_summary(user.id, 1000, now)
+
+    assert len(summary['monthly_totals']) == 12
+    assert summary['monthly_totals'][0] == ['2024-04', 0]
+    assert summary['monthly_totals'][-3:] == [['2025-01', 0], ['2025-02', 100], ['2025-03', 1200]]
+    assert summary['top_categories'] == [['Rent', 1000, 74], ['Food', 300, 22], ['Bus', 50, 4]]
+    assert summary['budget_used_pct'] == 120
+    assert summary['trend_pct'] == 2500  # 1300 over the last 3 months vs 50 before
+    # More history outside the window doesn't change the summary (or its hash)
+    update_monthly_rollup([(user.id, date(2023, 1, 1), 'Old', 999)])
+    db.session.flush()
+    assert get_ai_summary(user.id, 1000, now) == summary
+
+
+def test_rebuild_monthly_rollups_matches_incremental(db_rollback):
+    from app import MonthlyRollup, rebuild_monthly_rollups, update_monthly_rollup, get_expense_summary
+    db = db_rollback
+    user = User(name='Roll', email='rollup-test@example.com', password='x')
+    db.session.add(user)
+    db.session.flush()
+    rows = [('Food', 200, date(2025, 7, 1)), ('Food', 50, date(2025, 7, 9)), ('Bus', 30, date(2025, 8, 2))]
+    db.session.add_all([Expenses(name=n, amount=a, date=d, description='', user_id=user.id) for n, a, d in rows])
+    update_monthly_rollup([(user.id, d, n, a) for n, a, d in rows])
+    db.session.flush()
+
+    def snapshot():
+        return sorted((r.year, r.month, r.name, r.total, r.count)
+                      for r in MonthlyRollup.query.filter_by(user_id=user.id))
+
+    incremental = snapshot()
+    assert incremental == [(2025, 7, 'Food', 250, 2), (2025, 8, 'Bus', 30, 1)]
+    assert get_expense_summary(user.id) == (280, 3)
+
+    with patch('app.db.session.commit'):
+        rebuild_monthly_rollups(user.id)
+    assert snapshot() == incremental
+
+
+def test_dashboard_reuses_cached_fragments_until_data_version_changes(client):
+    with client.session_transaction() as sess:
+        sess['user_id'] = 1
+
+    mock_user = MagicMock(id=7, email='test@example.com', data_version=1)
+    fragments = {'chart_div': 'bar', 'worm_chart_div': 'worm', 'pie_chart_div': 'pie',
+                 'gauge_this_month': 'g1', 'gauge_this_year': 'g2', 'gauge_month_vs_last': 'g3',
+                 'status_tiles': []}
+
+    with patch('app.load_identity') as identity, \
+         patch('app.Expenses.query'), \
+         patch('app.render_dashboard_fragments', return_value=fragments) as render, \
+         patch('app.render_template', return_value='rendered'):
+        identity.return_value = (mock_user, MagicMock(monthly_budget=5000))
+        dashboard_cache.clear()
+
+        client.get('/dashboard?render=server')
+        client.get('/dashboard?render=server')
+        assert render.call_count == 1
+
+        mock_user.data_version = 2
+        client.get('/dashboard?render=server')
+        assert render.call_count == 2
+
+
+def _seed_export_user(db):
+    user = User(name='Export', email='export-test@example.com', password='x')
+    db.session.add(user)
+    db.session.flush()
+    db.session.add_all([
+        Expenses(name='Food', amount=120, date=date(2025, 1, 5), description='lunch, office', user_id=user.id),
+        Expenses(name='Rent', amount=9000, date=date(2025, 2, 1), description='Feb', user_id=user.id),
+        Expenses(name='Bus', amount=40, date=date(2025, 3, 9), description='', user_id=user.id),
+    ])
+    db.session.flush()
+    return user
+
+
+def test_export_streams_csv_with_date_filter(client):
+    from app import db
+    user = _seed_export_user(db)
+    with client.session_transaction() as sess:
+        sess['user_id'] = user.id
+
+    res = client.get('/export?format=csv&start=2025-01-01&end=2025-02-28')
+    assert res.status_code == 200
+    assert res.is_streamed
+    lines = res.get_data(as_text=True).splitlines()
+    assert lines == ['date,name,amount,description',
+                     '2025-01-05,Food,120,"lunch, office"',
+                     '2025-02-01,Rent,9000,Feb']
+
+
+def test_export_ndjson_gzip(client):
+    import gzip
+    from app import db
+    user = _seed_export_user(db)
+    with client.session_transaction() as sess:
+        sess['user_id'] = user.id
+
+    res = client.get('/export?format=ndjson&gzip=1')
+    assert res.headers['Content-Encoding'] == 'gzip'
+    records = [json.loads(line) for line in gzip.decompress(res.data).decode().splitlines()]
+    assert [r['name'] for r in records] == ['Food', 'Rent', 'Bus']
+    assert records[1] == {'date': '2025-02-01', 'name': 'Rent', 'amount': 9000, 'description': 'Feb'}
+
+
+def test_export_rejects_bad_arguments(client):
+    with client.session_transaction() as sess:
+        sess['user_id'] = 1
+    with patch('app.load_identity') as identity:
+        identity.return_value = (MagicMock(id=1), None)
+        assert client.get('/export?format=xml').status_code == 400
+        assert client.get('/export?start=01-02-2025').status_code == 400
+
+
+def test_import_expenses_csv_batches_and_reports_errors(client):
+    from io import BytesIO
+    from app import db, MonthlyRollup
+    user = User(name='Importer', email='import-test@example.com', password='x')
+    db.session.add(user)
+    db.session.flush()
+    with client.session_transaction() as sess:
+        sess['user_id'] = user.id
+
+    csv_body = (
+        "name,amount,date,description\n"
+        "Food,120,2025-01-05,lunch\n"
+        "Food,abc,2025-01-06,bad amount\n"
+        "Rent,9000,2025-02-01,\n"
+        "Bus,40,05/03/2025,bad date\n"
+        "Food,80,2025-01-20,dinner\n"
+    ).encode()
+
+    with patch('app.db.session.commit') as commit, \
+         patch.dict(flask_app.config, {'IMPORT_BATCH_SIZE': 2}), \
+         patch('app.render_template', return_value='rendered') as rt:
+        client.post('/import_expenses', data={'file': (BytesIO(csv_body), 'bank.csv')},
+                    content_type='multipart/form-data')
+
+        commit.assert_called_once()
+        kwargs = rt.call_args[1]
+        assert kwargs['imported'] == 3
+        assert [line for line, _ in kwargs['import_errors']] == [3, 5]
+        assert 'amount' in kwargs['import_errors'][0][1]
+
+        assert Expenses.query.filter_by(user_id=user.id).count() == 3
+        food = db.session.get(MonthlyRollup, (user.id, 2025, 1, 'Food'))
+        assert (food.total, food.count) == (200, 2)
+
+
+def test_import_expenses_missing_columns():
+    from io import StringIO
+    from app import import_expenses_csv
+    with flask_app.app_context():
+        imported, errors = import_expenses_csv(1, StringIO("title,cost\nx,1\n"))
+    assert imported == 0
+    assert 'missing column' in errors[0][1]
+
+
+def test_api_batch_is_idempotent_across_retries(client):
+    from app import db
+    user = User(name='Api', email='api-test@example.com', password='x')
+    db.session.add(user)
+    db.session.flush()
+    with client.session_transaction() as sess:
+        sess['user_id'] = user.id
+
+    payload = {'expenses': [
+        {'name': 'Food', 'amount': 120, 'date': '2025-01-05', 'description': 'lunch', 'idempotency_key': 'k1'},
+        {'name': 'Bus', 'amount': 40, 'date': '2025-01-06', 'idempotency_key': 'k2'},
+        {'name': 'Food', 'amount': 120, 'date': '2025-01-05', 'idempotency_key': 'k1'},
+        {'name': 'Tea', 'amount': 10, 'date': '2025-01-07'},
+    ]}
+
+    with patch('app.db.session.commit'):
+        first = client.post('/api/expenses/batch', json=payload)
+        assert first.status_code == 201
+        body = first.get_json()
+        assert body['created'] == 3 and body['duplicates'] == 1
+        assert body['results'][2]['id'] == body['results'][0]['id']
+
+        retry = client.post('/api/expenses/batch', json={'expenses': payload['expenses'][:2]})
+        assert retry.status_code == 200
+        assert retry.get_json()['duplicates'] == 2
+
+    assert Expenses.query.filter_by(user_id=user.id).count() == 3
+
+
+def test_api_batch_rejects_invalid_items_without_writing(client):
+    with client.session_transaction() as sess:
+        sess['user_id'] = 1
+    with patch('app.load_identity') as identity, patch('app.db.session.commit') as commit:
+        identity.return_value = (MagicMock(id=1), None)
+        res = client.post('/api/expenses/batch', json=[
+            {'name': 'Food', 'amount': 'ten', 'date': '2025-01-05'},
+            {'name': 'Bus', 'amount': 40, 'date': '2025-01-06', 'idempotency_key': 7},
+        ])
+        assert res.status_code == 400
+        assert [e['index'] for e in res.get_json()['errors']] == [0, 1]
+        commit.assert_not_called()
+
+
+def test_api_batch_requires_login(client):
+    assert client.post('/api/expenses/batch', json=[]).status_code == 401
+
+
+def test_dashboard_client_render_skips_plotly(client):
+    with client.session_transaction() as sess:
+        sess['user_id'] = 1
+
+    with patch('app.load_identity') as identity, \
+         patch('app.Expenses.query'), \
+         patch('app.get_month_breakdown', return_value={'Food': (500, 2)}), \
+         patch('app.render_dashboard_fragments') as render, \
+         patch('app.render_template', return_value='rendered') as rt:
+        identity.return_value = (MagicMock(id=8, data_version=1), MagicMock(monthly_budget=1000))
+        dashboard_cache.clear()
+
+        client.get('/dashboard?render=client')
+
+        render.assert_not_called()
+        kwargs = rt.call_args[1]
+        assert kwargs['render_mode'] == 'client'
+        assert len(kwargs['status_tiles']) == 6
+
+
+def test_dashboard_chart_data_endpoint(client):
+    with client.session_transaction() as sess:
+        sess['user_id'] = 1
+
+    aggregates = {'name_totals': {'Food': 500, 'Bus': 40}, 'yearly_totals': {2025: 540},
+                  'month_totals': {'this_month': 540, 'last_month': 100, 'this_year': 540},
+                  'month_breakdown': {}}
+    with patch('app.load_identity') as identity, \
+         patch('app.get_dashboard_aggregates', return_value=aggregates):
+        identity.return_value = (MagicMock(id=9, data_version=3), MagicMock(monthly_budget=1000))
+        dashboard_cache.clear()
+
+        body = client.get('/api/dashboard/charts').get_json()
+
+    assert body['version'] == 3
+    charts = body['charts']
+    assert charts['bar'] == {'layout': 'bar', 'x': ['Food', 'Bus'], 'y': [500.0, 40.0]}
+    assert charts['worm']['x'] == [2025]
+    assert charts['gauges']['this_month']['budget'] == 1000.0
+    assert charts['gauges']['month_vs_last']['ref'] == 100.0
+
+
+def test_charts_js_is_served_with_long_cache(client):
+    res = client.get('/static/charts.js?v=1')
+    assert res.status_code == 200
+    assert res.cache_control.max_age == flask_app.config['STATIC_JS_MAX_AGE']
+    res.close()
+
+
+def test_static_js_version_follows_file_contents(tmp_path, monkeypatch):
+    from app import static_version
+    script = tmp_path / 'panels.js'
+    script.write_text('export const a = 1;')
+    monkeypatch.setattr(flask_app, 'static_folder', str(tmp_path))
+    first = static_version('panels.js')
+    script.write_text('export const a = 2;')
+    os.utime(script, (1, 1))  # a new mtime, as any edit gives it
+    assert static_version('panels.js') != first
+
+
+def test_lazy_dashboard_shell_renders_without_charts(client):
+    from app import static_version
+    with client.session_transaction() as sess:
+        sess['user_id'] = 1
+
+    with patch('app.load_identity') as identity, \
+         patch('app.Expenses.query'), \
+         patch('app.get_month_breakdown', return_value={}), \
+         patch('app.render_dashboard_fragments') as render:
+        identity.return_value = (MagicMock(id=10, data_version=1), MagicMock(monthly_budget=1000))
+        dashboard_cache.clear()
+
+        res = client.get('/dashboard?render=lazy')
+
+        render.assert_not_called()
+        html = res.get_data(as_text=True)
+        for panel in ['bar', 'pie', 'worm', 'gauge_this_month', 'gauge_this_year', 'gauge_month_vs_last']:
+            assert f'data-panel-url="/dashboard/panel/{panel}"' in html
+        assert f"/static/panels.js?v={static_version('panels.js')}" in html
+
+
+def test_dashboard_panel_returns_304_when_unchanged(client):
+    with client.session_transaction() as sess:
+        sess['user_id'] = 1
+
+    mock_user = MagicMock(id=11, data_version=4)
+    with patch('app.load_identity') as identity, \
+         patch('app.get_name_totals', return_value={'Food': 100}) as totals:
+        identity.return_value = (mock_user, None)
+        dashboard_cache.clear()
+
+        first = client.get('/dashboard/panel/bar')
+        assert first.status_code == 200
+        assert first.get_data(as_text=True).startswith('<div')
+        etag = first.headers['ETag']
+
+        again = client.get('/dashboard/panel/bar', headers={'If-None-Match': etag})
+        assert again.status_code == 304
+        assert totals.call_count == 1
+
+        mock_user.data_version = 5
+        changed = client.get('/dashboard/panel/bar', headers={'If-None-Match': etag})
+        assert changed.status_code == 200
+        assert changed.headers['ETag'] != etag
+
+
+def test_gauge_panel_uses_the_loaded_budget(client):
+    with client.session_transaction() as sess:
+        sess['user_id'] = 1
+
+    with patch('app.load_identity', return_value=(MagicMock(id=12, data_version=1), MagicMock(monthly_budget=900))), \
+         patch('app.get_month_totals', return_value={'this_month': 300}), \
+         patch('app.UserDetails.query') as details_query, \
+         patch('app.generate_gauge', return_value='<div>gauge</div>') as gauge:
+        dashboard_cache.clear()
+        assert client.get('/dashboard/panel/gauge_this_month').status_code == 200
+        gauge.assert_called_once_with('this_month', {'this_month': 300}, 900)
+        details_query.filter_by.assert_not_called()
+
+
+def test_static_files_skip_the_user_lookup(client):
+    with client.session_transaction() as sess:
+        sess['user_id'] = 1
+
+    with patch('app.identity_cache.get', return_value=None), patch('app.load_identity') as identity:
+        assert client.get('/static/dashboard.css').status_code == 200
+        identity.assert_not_called()
+
+
+def test_dashboard_panel_unknown_and_logged_out(client):
+    assert client.get('/dashboard/panel/bar').status_code == 401
+    with client.session_transaction() as sess:
+        sess['user_id'] = 1
+    with patch('app.load_identity') as identity:
+        identity.return_value = (MagicMock(id=1), None)
+        assert client.get('/dashboard/panel/nope').status_code == 404
+
+
+def test_ai_sheds_load_when_queue_full(client):
+    with client.session_transaction() as sess:
+        sess['user_id'] = 1
+
+    with patch('app.load_identity') as identity, \
+         patch('app.Expenses.query'), \
+         patch('app.ai_store', MemoryAIResultStore()), \
+         patch('app.generate_data_hash', return_value='h'), \
+         patch('app.ai_scheduler.submit', return_value='rejected'), \
+         patch('app.render_template') as rt:
+        identity.return_value = (MagicMock(id=1), MagicMock())
+        rt.return_value = 'rendered'
+        client.get('/ai')
+        assert 'busy' in rt.call_args[1]['analysis']
+
+
+def test_ai_jobs_endpoint_exposes_scheduler_stats(client):
+    assert client.get('/ai/jobs').status_code == 401
+
+    with client.session_transaction() as sess:
+        sess['user_id'] = 1
+    with patch('app.load_identity', return_value=(MagicMock(id=1), None)):
+        stats = client.get('/ai/jobs').get_json()
+    assert {'queue_depth', 'in_flight', 'rejected', 'deduplicated', 'upstream_circuit'} <= set(stats)
+
+
+def sse_events(response):
+    events = []
+    for block in response.get_data(as_text=True).split('\n\n'):
+        lines = dict(line.split(': ', 1) for line in block.splitlines() if not line.startswith(':'))
+        if 'event' in lines:
+            events.append((lines['event'], json.loads(lines['data'])))
+    return events
+
+def test_ai_stream_requires_login(client):
+    assert client.get('/ai/stream').status_code == 401
+
+def test_ai_stream_sends_tokens_then_stored_html(client):
+    with client.session_transaction() as sess:
+        sess['user_id'] = 1
+
+    store = MemoryAIResultStore()
+    upstream = MagicMock(side_effect=lambda text: iter(['**Spend** ', 'less']))
+    with patch('app.load_identity') as identity, \
+         patch('app.Expenses.query'), \
+         patch('app.generate_data_hash', return_value='h1'), \
+         patch('app.ai_store', store), \
+         patch('app.stream_txt_content', upstream):
+        identity.return_value = (MagicMock(id=7), MagicMock())
+
+        response = client.get('/ai/stream')
+        assert response.mimetype == 'text/event-stream'
+        events = sse_events(response)
+
+        kinds = [kind for kind, _ in events]
+        assert kinds[-1] == 'done'
+        tokens = ''.join(data['text'] for kind, data in events if kind == 'token')
+        assert tokens in ('', '**Spend** less')  # empty if the job beat us to it
+        assert '<strong>Spend</strong>' in events[-1][1]['html']
+        assert store.get(7).response == '**Spend** less'
+
+        # A fresh result is served straight from the store
+        assert sse_events(client.get('/ai/stream'))[0][0] == 'done'
+        assert upstream.call_count == 1
+
+def test_ai_stream_reports_failure_without_storing(client):
+    with client.session_transaction() as sess:
+        sess['user_id'] = 1
+
+    store = MemoryAIResultStore()
+    with patch('app.load_identity') as identity, \
+         patch('app.Expenses.query'), \
+         patch('app.generate_data_hash', return_value='h2'), \
+         patch('app.ai_store', store), \
+         patch('app.stream_txt_content', side_effect=RuntimeError('upstream down')):
+        identity.return_value = (MagicMock(id=8), MagicMock())
+
+        events = sse_events(client.get('/ai/stream'))
+        assert events[-1][0] == 'error'
+        assert store.get(8) is None
+
+def test_ai_stream_rejects_empty_completion(client):
+    with client.session_transaction() as sess:
+        sess['user_id'] = 1
+
+    store = MemoryAIResultStore()
+    with patch('app.load_identity') as identity, \
+         patch('app.Expenses.query'), \
+         patch('app.generate_data_hash', return_value='h3'), \
+         patch('app.ai_store', store), \
+         patch('app.stream_txt_content', side_effect=lambda text: iter(['', '  \n'])):
+        identity.return_value = (MagicMock(id=9), MagicMock())
+
+        events = sse_events(client.get('/ai/stream'))
+        assert events[-1][0] == 'error'
+        assert store.get(9) is None
+
+
+def test_ai_refresh_command_regenerates_stale_users_within_budget(client):
+    from ai import AIError
+    store = MemoryAIResultStore()
+    store.put(1, 'fresh-1', 'up to date')
+    store.put(2, 'old-2', 'outdated')
+    users = [MagicMock(id=i) for i in (1, 2, 3, 4)]
+
+    def analysis(text):
+        if text == 'prompt-4':
+            raise AIError('upstream down')
+        return f'analysis of {text}'
+
+    with patch('app.load_all_identities', return_value=[(u, None) for u in users]), \
+         patch('app.load_ai_input', side_effect=lambda u, d: (f'fresh-{u.id}', f'prompt-{u.id}')), \
+         patch('app.estimate_tokens', return_value=100), \
+         patch('app.ai_store', store), \
+         patch('app.run_ai_analysis', side_effect=analysis) as run:
+        runner = flask_app.test_cli_runner()
+
+        result = runner.invoke(args=['ai-refresh', '--token-budget', '250', '--dry-run'])
+        assert 'Stale: 3' in result.output and 'over budget: 1' in result.output
+        run.assert_not_called()
+
+        result = runner.invoke(args=['ai-refresh', '--concurrency', '2', '--token-budget', '1000'])
+        assert 'refreshed: 2, failed: 1' in result.output
+        assert store.get(2).response == 'analysis of prompt-2'
+        assert store.get(3).data_hash == 'fresh-3'
+        assert store.get(4) is None  # errors are never stored
+        assert store.get(1).response == 'up to date'
+
+
+def test_ai_serves_another_users_matching_response_without_upstream_call(client):
+    with client.session_transaction() as sess:
+        sess['user_id'] = 1
+
+    store = MemoryAIResultStore()
+    store.put(1, 'same-inputs', '**shared**', html='<p>shared</p>', digest=response_digest('same-inputs'))
+
+    with patch('app.load_identity') as identity, \
+         patch('app.load_ai_input', return_value=('same-inputs', 'prompt')), \
+         patch('app.ai_store', store), \
+         patch('app.ai_scheduler.submit') as submit, \
+         patch('app.render_template', return_value='done') as rt:
+        identity.return_value = (MagicMock(id=2), None)
+        client.get('/ai')
+
+        submit.assert_not_called()
+        assert rt.call_args[1]['analysis'] == '<p>shared</p>'
+        assert store.get(2).digest == response_digest('same-inputs')
+        assert store.stats()['hits'] == 1
+
+
+def test_ai_counts_one_miss_then_one_hit(client):
+    with client.session_transaction() as sess:
+        sess['user_id'] = 1
+
+    store = MemoryAIResultStore()
+    with patch('app.load_identity', return_value=(MagicMock(id=3), None)), \
+         patch('app.load_ai_input', return_value=('inputs', 'prompt')), \
+         patch('app.ai_store', store), \
+         patch('app.ai_scheduler.submit', return_value='rejected'), \
+         patch('app.render_template', return_value='done'):
+        client.get('/ai')
+        sse_events(client.get('/ai/stream'))  # the stream's own checks aren't lookups
+        store.put(3, 'inputs', 'analysis', digest=response_digest('inputs'))
+        client.get('/ai')
+
+        assert (store.stats()['hits'], store.stats()['misses'], store.stats()['hit_rate']) == (1, 1, 0.5)
+
+
+def test_bucketed_inputs_match_for_similar_users():
+    from app import bucket_ai_input, build_ai_input
+
+    def inputs(income, food, share):
+        profile = {'annual_income': income, 'monthly_budget': 5000.0, 'occupation': 'Student',
+                   'age': 21, 'location': 'Pune', 'financial_goal': 'Save'}
+        summary = {'monthly_totals': [['2025-07', food]], 'top_categories': [['Food', food, share]],
+                   'monthly_average': food, 'budget_used_pct': 61, 'average_budget_pct': 58, 'trend_pct': None}
+        return bucket_ai_input(profile, summary)
+
+    a, b = inputs(120000.0, 3040, 99), inputs(121000.0, 2990, 100)
+    assert a == b
+    assert 'Student' not in json.dumps(a)  # not in the prompt, so not in the key either
+    assert "Income: ₹120000" in build_ai_input(*a)
+    assert inputs(300000.0, 3040, 99) != a
+
+
+def test_ai_input_hash_ignores_fields_outside_the_prompt():
+    from app import load_ai_input
+    summary = {'monthly_totals': [['2025-07', 3000]], 'top_categories': [], 'monthly_average': 3000,
+               'budget_used_pct': None, 'average_budget_pct': None, 'trend_pct': None}
+
+    def details(**extra):
+        return MagicMock(annual_income=120000.0, monthly_budget=5000.0, financial_goal='Save', **extra)
+
+    with patch('app.get_ai_summary', return_value=summary), \
+         patch.dict(flask_app.config, {'AI_BUCKET_INPUTS': False}):
+        user = MagicMock(id=1)
+        a = load_ai_input(user, details(occupation='Student', age=21, location='Pune'))
+        b = load_ai_input(user, details(occupation='Engineer', age=40, location='Delhi'))
+        assert a == b
+        assert load_ai_input(user, MagicMock(annual_income=120000.0, monthly_budget=5000.0,
+                                             financial_goal='Retire'))[0] != a[0]
+
+
+def test_current_user_is_cached_until_data_version_bump(client):
+    from app import db, bump_data_version, load_identity, _invalidate_committed_identities
+    user = _seed_export_user(db)
+    with client.session_transaction() as sess:
+        sess['user_id'] = user.id
+
+    with patch.object(identity_cache, 'ttl', 60), \
+            patch('app.load_identity', wraps=load_identity) as identity:
+        identity_cache.clear()
+        assert client.get('/export?format=csv').status_code == 200
+        assert client.get('/export?format=csv').status_code == 200
+        assert identity.call_count == 1
+
+        bump_data_version(user.id)
+        _invalidate_committed_identities(db.session)  # what committing does; the row is test-only
+        assert client.get('/export?format=csv').status_code == 200
+        assert identity.call_count == 2
+    identity_cache.clear()
+
+
+def test_identity_is_invalidated_after_the_bump_commits(client):
+    from app import db, bump_data_version
+    # No user 42: the bumps update nothing, so committing them leaves the database as it was
+    with patch.object(identity_cache, 'ttl', 60):
+        identity_cache.clear()
+        bump_data_version(42)
+        # A concurrent request caches the row it can still see (the old version)
+        identity_cache.set(42, ('old row', None))
+        assert identity_cache.get(42) is not None
+        db.session.commit()
+        assert identity_cache.get(42) is None
+
+        bump_data_version(42)
+        db.session.rollback()
+        identity_cache.set(42, ('current row', None))
+        db.session.commit()  # nothing pending after the rollback
+        assert identity_cache.get(42) is not None
+    identity_cache.clear()
+
+
+def test_login_rehashes_password_when_cost_changes(client):
+    from app import db, password_hasher
+    from passwords import hash_cost
+    with patch.object(password_hasher, 'rounds', 4):
+        user = User(name='Rehash', email='rehash-test@example.com', password='secret')
+    db.session.add(user)
+    db.session.flush()
+
+    with patch.object(password_hasher, 'rounds', 5), patch('app.db.session.commit') as commit:
+        res = client.post('/login', data={'email': 'rehash-test@example.com', 'password': 'secret'})
+    assert res.status_code == 302
+    commit.assert_called_once()
+    assert hash_cost(user.password) == 5
+    assert user.check_password('secret')
+    db.session.rollback()
+
+
+def test_login_sheds_load_when_hasher_is_busy(client):
+    from passwords import HasherBusy
+    mock_user = MagicMock(id=5)
+    mock_user.check_password.side_effect = HasherBusy()
+    with patch('app.User.query') as mock_query:
+        mock_query.filter_by.return_value.first.return_value = mock_user
+        res = client.post('/login', data={'email': 'a@example.com', 'password': 'x'})
+    assert res.status_code == 503
+    with client.session_transaction() as sess:
+        assert 'user_id' not in sess
+
+
+def test_seed_command_bulk_inserts_and_updates_rollups(client):
+    with patch('app.db.session.commit'), \
+         patch('app.update_monthly_rollup') as rollup, \
+         patch('app.password_hasher') as hasher:
+        hasher.hash.return_value = 'hashed'
+        result = flask_app.test_cli_runner().invoke(args=[
+            'seed', '--users', '2', '--expenses', '15', '--batch-size', '10',
+            '--end', '2025-06-30', '--prefix', 'seedtest'])
+    assert '2/2 users, 30 expenses' in result.output
+    assert [len(call.args[0]) for call in rollup.call_args_list] == [10, 5, 10, 5]
+    hasher.hash.assert_called_once_with('password')
+
+
+def test_responses_carry_server_timing_and_feed_metrics(client):
+    res = client.get('/login')
+    timing = res.headers['Server-Timing']
+    assert 'template;dur=' in timing and 'total;dur=' in timing
+
+    body = client.get('/metrics').get_data(as_text=True)
+    assert 'fintracker_request_duration_seconds_count{route="login",method="GET",status="200"}' in body
+    assert 'fintracker_stage_duration_seconds_count{route="login",stage="template"}' in body
+    assert 'fintracker_ai_cache_hits_total' in body
+    assert 'fintracker_ai_jobs_total{outcome="completed"}' in body
+
+
+def test_metrics_report_ai_cache_hit_ratio(client):
+    with client.session_transaction() as sess:
+        sess['user_id'] = 1
+
+    store = MemoryAIResultStore()
+    with patch('app.load_identity', return_value=(MagicMock(id=4), None)), \
+         patch('app.load_ai_input', return_value=('metric-inputs', 'prompt')), \
+         patch('app.ai_store', store), \
+         patch('app.ai_scheduler.submit', return_value='rejected'), \
+         patch('app.render_template', return_value='done'):
+        client.get('/ai')
+        store.put(4, 'metric-inputs', 'analysis', digest=response_digest('metric-inputs'))
+        client.get('/ai')
+
+        body = client.get('/metrics').get_data(as_text=True)
+    assert 'fintracker_ai_cache_hits_total 1\n' in body
+    assert 'fintracker_ai_cache_misses_total 1\n' in body
+    assert 'fintracker_ai_cache_hit_ratio 0.5\n' in body
+
+
+def test_sql_time_is_reported_as_a_stage(client):
+    from app import db
+    user = _seed_export_user(db)
+    with client.session_transaction() as sess:
+        sess['user_id'] = user.id
+    assert 'sql;dur=' in client.get('/export?format=csv').headers['Server-Timing']
@@ -0,0 +1,38 @@
+import os
+import sys
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from sqlalchemy import create_engine, text
+
+from config import database_config, sqlite_pragmas, apply_sqlite_pragmas, DEFAULT_DATABASE_URI
+
+def test_defaults_to_sqlite_file_with_pool_and_lock_timeout():
+    config = database_config({})
+    assert config['SQLALCHEMY_DATABASE_URI'] == DEFAULT_DATABASE_URI
+    options = config['SQLALCHEMY_ENGINE_OPTIONS']
+    assert options['pool_size'] == 5
+    assert options['connect_args'] == {'timeout': 5.0}
+    assert 'pool_recycle' not in options
+
+def test_reads_uri_and_pool_settings_from_environment():
+    config = database_config({'DATABASE_URL': 'postgresql://u@db/fin', 'DB_POOL_SIZE': '20',
+                              'DB_POOL_TIMEOUT': '2', 'DB_POOL_RECYCLE': '600'})
+    options = config['SQLALCHEMY_ENGINE_OPTIONS']
+    assert config['SQLALCHEMY_DATABASE_URI'] == 'postgresql://u@db/fin'
+    assert (options['pool_size'], options['pool_timeout'], options['pool_recycle']) == (20, 2.0, 600)
+    assert 'connect_args' not in options
+
+def test_in_memory_sqlite_gets_no_pool_options():
+    options = database_config({'DATABASE_URL': 'sqlite://'})['SQLALCHEMY_ENGINE_OPTIONS']
+    assert 'pool_size' not in options
+
+def test_pragmas_applied_on_every_connection(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'p.db'}")
+    apply_sqlite_pragmas(engine, sqlite_pragmas({'SQLITE_BUSY_TIMEOUT_MS': '1234'}))
+    for _ in range(2):
+        with engine.connect() as conn:
+            assert conn.execute(text('PRAGMA journal_mode')).scalar() == 'wal'
+            assert conn.execute(text('PRAGMA synchronous')).scalar() == 1  # NORMAL
+            assert conn.execute(text('PRAGMA busy_timeout')).scalar() == 1234
+            assert conn.execute(text('PRAGMA cache_size')).scalar() == -20000
+        engine.dispose()
@@ -0,0 +1,31 @@
+import os
+import sys
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from fragment_cache import FragmentCache, estimate_size
+
+def test_get_returns_cached_value_and_counts_hits():
+    cache = FragmentCache(max_bytes=1000)
+    assert cache.get('k') is None
+    cache.set('k', {'chart_div': '<div>x</div>'})
+    assert cache.get('k') == {'chart_div': '<div>x</div>'}
+    assert cache.stats()['hits'] == 1
+    assert cache.stats()['misses'] == 1
+
+def test_evicts_least_recently_used_when_over_cap():
+    cache = FragmentCache(max_bytes=25)
+    cache.set('a', 'x' * 10)
+    cache.set('b', 'y' * 10)
+    cache.get('a')              # 'b' is now least recently used
+    cache.set('c', 'z' * 10)
+    assert cache.get('b') is None
+    assert cache.get('a') == 'x' * 10
+    assert cache.stats()['bytes'] <= 25
+
+def test_oversized_value_is_not_cached():
+    cache = FragmentCache(max_bytes=5)
+    cache.set('big', 'x' * 10)
+    assert cache.get('big') is None
+
+def test_estimate_size_walks_nested_values():
+    assert estimate_size([{'label': 'ab', 'value': 'cde'}]) == len('label') + 2 + len('value') + 3
@@ -3,7 +3,8 @@ from unittest.mock import MagicMock
 from types import SimpleNamespace
 from graphs import (
     generate_bar_chart, generate_pie_chart, generate_worm_chart,
-    generate_gauge_charts, generate_sparkline, get_icon_status_data
+    generate_gauge_charts, generate_sparkline, get_icon_status_data,
+    bar_chart_data, pie_chart_data, worm_chart_data, gauge_chart_data
 )
 from datetime import date
 
@@ -63,3 +64,30 @@ def test_create_gauge_under_branch():
     from graphs import create_gauge
     out = create_gauge("Gauge", 10000, 50000, show_budget=True)
     assert "under" in out 
+
+def test_charts_accept_preaggregated_totals():
+    assert generate_bar_chart(name_totals={"Food": 500}).startswith("<div")
+    assert generate_pie_chart(name_totals={"Food": 500}).startswith("<div")
+    assert generate_worm_chart(yearly_totals={2024: 100, 2025: 200}).startswith("<div")
+    assert "No valid data" in generate_worm_chart(yearly_totals={})
+
+def test_gauges_and_tiles_accept_preaggregated_totals():
+    totals = {"this_month": 300, "last_month": 100, "this_year": 900}
+    gm, gy, gvsl = generate_gauge_charts(monthly_budget_limit=500, totals=totals)
+    assert all(x.startswith("<div") for x in [gm, gy, gvsl])
+    assert "No gauge data" in generate_gauge_charts(totals=None, expenses=[])[0]
+
+    tiles = get_icon_status_data(monthly_budget=1000, breakdown={"Food": (500, 2), "Bus": (50, 3)})
+    values = {t["label"]: t["value"] for t in tiles}
+    assert values["Total This Month"] == "₹550"
+    assert values["Transactions"] == "5"
+    assert values["Top Category"] == "Bus: ₹50"
+
+def test_compact_chart_payloads():
+    assert pie_chart_data({"Food": 500}) == {"layout": "pie", "labels": ["Food"], "values": [500.0]}
+    assert bar_chart_data({})["x"] == []
+    assert worm_chart_data({2025: 10, 2024: 5}) == {"layout": "worm", "x": [2024, 2025], "y": [5.0, 10.0]}
+    assert worm_chart_data({}) is None
+    assert gauge_chart_data(None) is None
+    gauges = gauge_chart_data({"this_month": 300, "last_month": 20000, "this_year": 900}, 500)
+    assert gauges["month_vs_last"]["budget"] == 20000
@@ -0,0 +1,37 @@
+import os
+import sys
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from unittest.mock import patch
+
+from identity_cache import IdentityCache
+
+def test_get_returns_value_until_ttl_expires():
+    cache = IdentityCache(ttl=5)
+    with patch('identity_cache.time.monotonic', return_value=100.0):
+        cache.set(1, 'row')
+        assert cache.get(1) == 'row'
+    with patch('identity_cache.time.monotonic', return_value=105.0):
+        assert cache.get(1) is None
+    assert cache.stats() == {'entries': 0, 'hits': 1, 'misses': 1}
+
+def test_invalidate_drops_entry():
+    cache = IdentityCache(ttl=5)
+    cache.set(1, 'row')
+    cache.invalidate(1)
+    assert cache.get(1) is None
+
+def test_zero_ttl_disables_cache():
+    cache = IdentityCache(ttl=0)
+    cache.set(1, 'row')
+    assert cache.get(1) is None
+    assert cache.stats()['entries'] == 0
+
+def test_evicts_least_recently_used_past_max_entries():
+    cache = IdentityCache(ttl=60, max_entries=2)
+    cache.set(1, 'a')
+    cache.set(2, 'b')
+    cache.get(1)
+    cache.set(3, 'c')
+    assert cache.get(2) is None
+    assert cache.get(1) == 'a'
@@ -0,0 +1,57 @@
+import os
+import sys
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import io
+import json
+import logging
+
+from flask import Flask, g
+
+from logs import configure_logging
+from metrics import Histogram, Metrics, RequestTiming, timed
+
+def test_histogram_buckets_are_cumulative():
+    hist = Histogram('t_seconds', 'Test.', ('route',), buckets=(0.1, 1))
+    hist.observe(('a',), 0.05)
+    hist.observe(('a',), 0.5)
+    lines = hist.render()
+    assert 't_seconds_bucket{route="a",le="0.1"} 1' in lines
+    assert 't_seconds_bucket{route="a",le="1"} 2' in lines
+    assert 't_seconds_bucket{route="a",le="+Inf"} 2' in lines
+    assert 't_seconds_count{route="a"} 2' in lines
+
+def test_timed_adds_to_the_request_stage_only_inside_a_request():
+    with timed('plot'):
+        pass  # no request: nothing to record, no error
+
+    app = Flask(__name__)
+    with app.test_request_context():
+        g.timing = RequestTiming()
+        with timed('plot'):
+            pass
+        with timed('plot'):
+            pass
+        assert g.timing.stages['plot'][1] == 2
+        header = g.timing.server_timing(0.0123)
+    assert header.startswith('plot;dur=') and header.endswith('total;dur=12.3')
+
+def test_render_groups_samples_and_escapes_labels():
+    metrics = Metrics(prefix='x')
+    timing = RequestTiming()
+    timing.add('sql', 0.002)
+    metrics.observe('dashboard', 'GET', 200, 0.01, timing)
+    text = metrics.render([('hits_total', 'counter', 'Hits.', {'cache': 'a"b'}, 3),
+                           ('hits_total', 'counter', 'Hits.', {'cache': 'c'}, 4)])
+    assert 'x_stage_duration_seconds_count{route="dashboard",stage="sql"} 1' in text
+    assert text.count('# TYPE x_hits_total counter') == 1
+    assert 'x_hits_total{cache="a\\"b"} 3' in text
+
+def test_json_log_lines_carry_extra_fields():
+    stream = io.StringIO()
+    configure_logging('INFO', 'json', stream=stream)
+    logging.getLogger('fintracker.test').info('expense added', extra={'user_id': 7})
+    logging.getLogger('fintracker.test').debug('hidden')
+    entry = json.loads(stream.getvalue())
+    assert (entry['message'], entry['user_id'], entry['level']) == ('expense added', 7, 'INFO')
+    configure_logging()
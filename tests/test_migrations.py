@@ -0,0 +1,118 @@
+import os
+import sys
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import pytest
+from sqlalchemy import create_engine, inspect, text
+
+from migrations import run_migrations, current_version, MIGRATIONS
+
+BASELINE_USER = """
+CREATE TABLE user (
+    id INTEGER NOT NULL PRIMARY KEY,
+    name VARCHAR(100) NOT NULL,
+    email VARCHAR(100) UNIQUE,
+    password VARCHAR(100) NOT NULL
+)
+"""
+
+BASELINE_EXPENSES = """
+CREATE TABLE expenses (
+    id INTEGER NOT NULL PRIMARY KEY,
+    user_id INTEGER NOT NULL,
+    name VARCHAR(100) NOT NULL,
+    amount INTEGER NOT NULL,
+    date DATE NOT NULL,
+    description VARCHAR(100) NOT NULL
+)
+"""
+
+@pytest.fixture
+def engine():
+    engine = create_engine('sqlite://')
+    with engine.begin() as conn:
+        conn.execute(text(BASELINE_USER))
+        conn.execute(text(BASELINE_EXPENSES))
+    return engine
+
+def test_run_migrations_adds_expense_indexes(engine):
+    applied = run_migrations(engine)
+
+    assert applied == [m[0] for m in MIGRATIONS]
+    indexes = {ix['name']: ix['column_names'] for ix in inspect(engine).get_indexes('expenses')}
+    assert indexes['ix_expenses_user_date'] == ['user_id', 'date']
+    assert indexes['ix_expenses_user_amount'] == ['user_id', 'amount']
+    assert indexes['ix_expenses_user_name'] == ['user_id', 'name']
+
+def test_run_migrations_is_idempotent(engine):
+    run_migrations(engine)
+    assert run_migrations(engine) == []
+    assert current_version(engine) == MIGRATIONS[-1][0]
+
+def test_user_date_query_uses_index(engine):
+    run_migrations(engine)
+    with engine.connect() as conn:
+        plan = conn.execute(text(
+            "EXPLAIN QUERY PLAN SELECT * FROM expenses WHERE user_id = 1 ORDER BY date DESC LIMIT 4"
+        )).fetchall()
+    assert any('ix_expenses_user_date' in row[-1] for row in plan)
+
+def test_run_migrations_adds_user_data_version(engine):
+    with engine.begin() as conn:
+        conn.execute(text("INSERT INTO user (name, email, password) VALUES ('a', 'a@x', 'pw')"))
+    run_migrations(engine)
+    with engine.connect() as conn:
+        assert conn.execute(text("SELECT data_version FROM user")).scalar() == 0
+
+def test_ai_results_move_to_shared_responses(engine):
+    run_migrations(engine)
+    # Re-run 7 against data in the old per-user layout
+    with engine.begin() as conn:
+        conn.execute(text("DROP TABLE ai_responses"))
+        conn.execute(text("DROP TABLE ai_user_results"))
+        conn.execute(text(
+            "CREATE TABLE ai_results (user_id INTEGER PRIMARY KEY, data_hash VARCHAR(64) NOT NULL, "
+            "response TEXT NOT NULL, created_at DATETIME NOT NULL, html TEXT)"))
+        conn.execute(text(
+            "INSERT INTO ai_results VALUES (1, 'h', 'same', '2025-01-01 00:00:00', NULL), "
+            "(2, 'h', 'same', '2025-01-01 00:00:00', NULL), (3, 'k', 'other', '2025-01-02 00:00:00', '<p>other</p>')"))
+        conn.execute(text("DELETE FROM schema_version WHERE version = 7"))
+    assert run_migrations(engine) == [7]
+
+    with engine.connect() as conn:
+        assert conn.execute(text("SELECT COUNT(*) FROM ai_responses")).scalar() == 2
+        assert conn.execute(text("SELECT user_id, digest FROM ai_user_results ORDER BY user_id")).fetchall() \
+            == [(1, 'h'), (2, 'h'), (3, 'k')]
+    assert not inspect(engine).has_table('ai_results')
+
+def test_concurrent_runs_apply_each_migration_once(tmp_path):
+    import threading
+    url = f"sqlite:///{tmp_path / 'race.db'}"
+    setup = create_engine(url)
+    with setup.begin() as conn:
+        conn.execute(text(BASELINE_USER))
+        conn.execute(text(BASELINE_EXPENSES))
+
+    results, errors = [], []
+    def migrate():
+        try:
+            results.append(run_migrations(create_engine(url)))
+        except Exception as e:
+            errors.append(e)
+    threads = [threading.Thread(target=migrate) for _ in range(6)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert errors == []
+    assert sorted(v for applied in results for v in applied) == [m[0] for m in MIGRATIONS]
+    with setup.connect() as conn:
+        assert conn.execute(text("SELECT COUNT(*) FROM schema_version")).scalar() == len(MIGRATIONS)
+
+def test_migrations_skip_columns_of_missing_tables():
+    engine = create_engine('sqlite://')
+    with engine.begin() as conn:
+        conn.execute(text(BASELINE_EXPENSES))  # no user table, as in the index benchmark
+    assert run_migrations(engine) == [m[0] for m in MIGRATIONS]
+    assert not inspect(engine).has_table('user')
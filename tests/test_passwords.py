@@ -0,0 +1,54 @@
+import os
+import sys
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import threading
+import time
+
+import pytest
+
+from passwords import PasswordHasher, HasherBusy, hash_cost
+
+def test_hash_uses_configured_cost_and_checks():
+    hasher = PasswordHasher(rounds=4, max_workers=1)
+    hashed = hasher.hash('secret')
+    assert hash_cost(hashed) == 4
+    assert hasher.check('secret', hashed)
+    assert not hasher.check('wrong', hashed)
+
+def test_needs_rehash_only_when_cost_differs():
+    old = PasswordHasher(rounds=4, max_workers=1).hash('secret')
+    assert PasswordHasher(rounds=5, max_workers=1).needs_rehash(old)
+    assert not PasswordHasher(rounds=4, max_workers=1).needs_rehash(old)
+    assert not PasswordHasher(rounds=4, max_workers=1).needs_rehash('not-a-bcrypt-hash')
+
+def test_concurrent_hashes_are_capped_at_max_workers():
+    hasher = PasswordHasher(rounds=4, max_workers=2)
+    running, peak, lock = [0], [0], threading.Lock()
+
+    def slow(_):
+        with lock:
+            running[0] += 1
+            peak[0] = max(peak[0], running[0])
+        time.sleep(0.02)
+        with lock:
+            running[0] -= 1
+        return True
+
+    threads = [threading.Thread(target=hasher._run, args=(slow, None)) for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert peak[0] == 2
+
+def test_raises_busy_when_queue_is_full():
+    hasher = PasswordHasher(rounds=4, max_workers=1, max_pending=1, queue_timeout=0.01)
+    release = threading.Event()
+    blocker = threading.Thread(target=hasher._run, args=(lambda: release.wait(),))
+    blocker.start()
+    time.sleep(0.02)
+    with pytest.raises(HasherBusy):
+        hasher.hash('secret')
+    release.set()
+    blocker.join()
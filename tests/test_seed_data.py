@@ -0,0 +1,37 @@
+import os
+import sys
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import random
+from datetime import date
+
+from seed_data import generate_expenses, generate_user, batched, CATEGORIES
+
+END = date(2025, 6, 30)
+
+def test_same_seed_gives_same_rows():
+    first = list(generate_expenses(random.Random(7), 1, 500, END))
+    second = list(generate_expenses(random.Random(7), 1, 500, END))
+    assert first == second
+    assert first != list(generate_expenses(random.Random(8), 1, 500, END))
+    assert generate_user(random.Random(7), 1) == generate_user(random.Random(7), 1)
+
+def test_rows_are_valid_and_inside_the_window():
+    rows = list(generate_expenses(random.Random(1), 3, 2000, END, months=12))
+    assert len(rows) == 2000
+    assert all(r['user_id'] == 3 and r['amount'] >= 1 for r in rows)
+    assert all(date(2024, 6, 1) <= r['date'] <= END for r in rows)
+    assert {r['name'] for r in rows} <= set(CATEGORIES) | {'Rent'}
+    assert max(CATEGORIES, key=lambda n: sum(r['name'] == n for r in rows)) == 'Food'
+
+def test_one_rent_row_per_month_never_after_end():
+    end = date(2026, 10, 2)
+    rows = list(generate_expenses(random.Random(4), 1, 20000, end, months=12))
+    rent = [r['date'] for r in rows if r['name'] == 'Rent']
+    months = [(d.year, d.month) for d in rent]
+    assert len(months) == len(set(months)) == 13  # Oct 2025 .. Oct 2026
+    assert max(r['date'] for r in rows) <= end
+    assert len(list(generate_expenses(random.Random(4), 1, 3, end))) == 3
+
+def test_batched_splits_without_losing_rows():
+    assert [len(b) for b in batched(range(25), 10)] == [10, 10, 5]